@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of the collector hot paths on a synthetic proc and cgroup tree
+
+Times sams.pidfinder.Slurm find() (method proc and cgroup),
+sams.sampler.Software sample() (accounting process and task),
+sams.sampler.SlurmCGroup(2) sample() and sams.sampler.Pressure sample() on
+trees built by fakeproc.py with an increasing number of tasks. Between
+the rounds the cpu usage of all tasks is advanced and a part of the
+processes are replaced (churn), this is not included in the times.
+
+The first call (that finds and opens everything) is reported separately
+from the median of the following rounds.
+
+Usage: collector.py [--sizes 1000,10000,100000] [--threads N] [--rounds N] [--churn RATE]
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakeproc  # noqa: E402
+
+import sams.core  # noqa: E402
+import sams.pidfinder.Slurm  # noqa: E402
+import sams.sampler.Pressure  # noqa: E402
+import sams.sampler.SlurmCGroup  # noqa: E402
+import sams.sampler.SlurmCGroup2  # noqa: E402
+import sams.sampler.Software  # noqa: E402
+
+CONFIG = """
+common:
+  procdir: %(procdir)s
+sams.pidfinder.Slurm:
+  cgroup_base: %(cgroup2)s
+sams.sampler.Pressure:
+  cgroup_base: %(cgroup2)s
+sams.sampler.SlurmCGroup:
+  cgroup_base: %(cgroup1)s
+sams.sampler.SlurmCGroup2:
+  cgroup_base: %(cgroup2)s
+"""
+
+
+class NullQueue:
+    """outQueue that throws away the samples"""
+
+    def put(self, item):
+        pass
+
+
+def benchmarks(fake, config):
+    """Returns (name, setup, call) for each benchmark, setup returns the object call is called with"""
+
+    def pidfinder(method):
+        def setup():
+            extra = {"sams.pidfinder.Slurm": {"method": method}}
+            return sams.pidfinder.Slurm.PIDFinder("sams.pidfinder.Slurm", fake.jobid, config.derive(extra))
+
+        return setup
+
+    def sampler(module, id, extra=None, **attributes):
+        def setup():
+            s = module.Sampler(id, NullQueue(), config.derive(extra or {}))
+            s.jobid = fake.jobid
+            s.add_pids(list(fake.processes.keys()))
+            for name, value in attributes.items():
+                setattr(s, name, value)
+            return s
+
+        return setup
+
+    def sample(s):
+        if s.do_sample():
+            s.sample()
+
+    return [
+        ("PIDFinder.find() proc", pidfinder("proc"), lambda p: p.find()),
+        ("PIDFinder.find() cgroup", pidfinder("cgroup"), lambda p: p.find()),
+        ("Software.sample() process", sampler(sams.sampler.Software, "sams.sampler.Software"), sample),
+        (
+            "Software.sample() task",
+            sampler(sams.sampler.Software, "sams.sampler.Software", {"sams.sampler.Software": {"accounting": "task"}}),
+            sample,
+        ),
+        ("SlurmCGroup.sample()", sampler(sams.sampler.SlurmCGroup, "sams.sampler.SlurmCGroup"), sample),
+        # The cpuset of the processes is in the v1 hierarchy, give the v2 cgroup directly.
+        (
+            "SlurmCGroup2.sample()",
+            sampler(sams.sampler.SlurmCGroup2, "sams.sampler.SlurmCGroup2", cgroup=os.path.relpath(fake.job_cgroup, fake.cgroup2)),
+            sample,
+        ),
+        ("Pressure.sample()", sampler(sams.sampler.Pressure, "sams.sampler.Pressure"), sample),
+    ]
+
+
+def run(tasks, args):
+    root = tempfile.mkdtemp(prefix="sams-bench-")
+    try:
+        fake = fakeproc.FakeProc(root)
+        start = time.perf_counter()
+        fake.build(max(1, tasks // args.threads), args.threads, args.other)
+        build_time = time.perf_counter() - start
+        print("tasks: %d, pids: %d, other pids: %d (built in %.1f s)" % (fake.tasks, len(fake.processes), args.other, build_time))
+
+        config_file = os.path.join(root, "config.yaml")
+        with open(config_file, "w") as file:
+            file.write(CONFIG % {"procdir": fake.procdir, "cgroup1": fake.cgroup1, "cgroup2": fake.cgroup2})
+        config = sams.core.Config(config_file, {"options": {"jobid": fake.jobid}})
+
+        for name, setup, call in benchmarks(fake, config):
+            obj = setup()
+            start = time.perf_counter()
+            call(obj)
+            first = time.perf_counter() - start
+            times = []
+            for _ in range(args.rounds):
+                fake.advance()
+                new = fake.churn(args.churn, args.threads) if args.churn else []
+                if hasattr(obj, "add_pids"):
+                    obj.add_pids(new)
+                start = time.perf_counter()
+                call(obj)
+                times.append(time.perf_counter() - start)
+            median = statistics.median(times)
+            print(
+                "  %-28s first: %10.2f ms  median: %10.2f ms  %8.2f us/task" % (name, first * 1e3, median * 1e3, median / fake.tasks * 1e6)
+            )
+    finally:
+        shutil.rmtree(root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Number of tasks in the job [%(default)s]")
+    parser.add_argument("--threads", type=int, default=10, help="Number of tasks per process [%(default)s]")
+    parser.add_argument("--other", type=int, default=500, help="Number of processes outside of the job [%(default)s]")
+    parser.add_argument("--rounds", type=int, default=5, help="Number of rounds after the first call [%(default)s]")
+    parser.add_argument("--churn", type=float, default=0.01, help="Part of the processes replaced each round [%(default)s]")
+    args = parser.parse_args()
+
+    for tasks in [int(size) for size in args.sizes.split(",")]:
+        run(tasks, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+"""
+Builds a synthetic proc and cgroup tree of a Slurm job
+
+The tree is built under a root directory:
+
+  ROOT/proc     /proc with <pid>/{stat,cgroup,cpuset,exe,task/<tid>/stat} and uptime
+  ROOT/cgroup2  cgroup v2 with system.slice/slurmstepd.scope/job_<jobid>/step_0/user/task_0
+  ROOT/cgroup1  cgroup v1 with {cpuset,cpuacct,memory}/slurm/uid_<uid>/job_<jobid>
+
+The processes are placed in both hierarchies (a hybrid setup), so the
+same tree can be used for sams.pidfinder.Slurm (procdir: ROOT/proc,
+cgroup_base: ROOT/cgroup2), sams.sampler.Software, sams.sampler.Pressure
+(cgroup_base: ROOT/cgroup2) and sams.sampler.SlurmCGroup (cgroup_base:
+ROOT/cgroup1).
+
+Usage: fakeproc.py ROOT [--pids N] [--threads N] [--other N] [--jobid N]
+"""
+
+import argparse
+import os
+import shutil
+
+# Field 23 (vsize) to 52 of /proc/<pid>/stat.
+STAT_TAIL = " ".join(["0"] * 30)
+
+MEMORY_STAT_V2 = "".join(
+    "%s %d\n" % (key, 4096 * n)
+    for n, key in enumerate(
+        ["anon", "file", "kernel", "kernel_stack", "pagetables", "sock", "shmem", "file_mapped", "pgfault", "pgmajfault"]
+    )
+)
+
+MEMORY_STAT_V1 = "".join(
+    "%s %d\n" % (key, 4096 * n)
+    for n, key in enumerate(
+        ["cache", "rss", "mapped_file", "swap", "pgmajfault", "total_cache", "total_rss", "total_swap", "total_pgmajfault"]
+    )
+)
+
+PRESSURE = "some avg10=0.00 avg60=0.00 avg300=0.00 total=0\nfull avg10=0.00 avg60=0.00 avg300=0.00 total=0\n"
+
+
+def _write(path, data):
+    with open(path, "w") as file:
+        file.write(data)
+
+
+class FakeProc:
+    """Synthetic proc and cgroup tree for one Slurm job under root"""
+
+    def __init__(self, root, jobid=1, uid=1000, exes=10):
+        self.root = root
+        self.jobid = jobid
+        self.uid = uid
+        self.exes = exes
+        self.procdir = os.path.join(root, "proc")
+        self.cgroup2 = os.path.join(root, "cgroup2")
+        self.cgroup1 = os.path.join(root, "cgroup1")
+        self.job_cgroup = os.path.join(self.cgroup2, "system.slice/slurmstepd.scope/job_%d" % jobid)
+        # Leaf cgroup the processes are placed in, as done by slurmstepd.
+        self.task_cgroup = os.path.join(self.job_cgroup, "step_0/user/task_0")
+        self.job_path = "slurm/uid_%d/job_%d" % (uid, jobid)
+        # pid -> list of tids (including pid) of the processes of the job.
+        self.processes = {}
+        self.other = []
+        self.next_pid = 1000
+        self.ticks = 0
+
+        os.makedirs(self.procdir, exist_ok=True)
+        os.makedirs(self.task_cgroup, exist_ok=True)
+        _write(os.path.join(self.procdir, "uptime"), "12345.67 123456.78\n")
+        for name, data in [
+            ("cpu.stat", "usage_usec 0\nuser_usec 0\nsystem_usec 0\nnr_periods 0\nnr_throttled 0\nthrottled_usec 0\n"),
+            ("memory.stat", MEMORY_STAT_V2),
+            (
+                "io.stat",
+                "8:0 rbytes=1024 wbytes=2048 rios=1 wios=2 dbytes=0 dios=0\n259:0 rbytes=4096 wbytes=0 rios=4 wios=0 dbytes=0 dios=0\n",
+            ),
+            ("memory.current", "1073741824\n"),
+            ("memory.high", "max\n"),
+            ("memory.max", "4294967296\n"),
+            ("memory.swap.current", "0\n"),
+            ("cpuset.cpus", "0-15\n"),
+            ("cgroup.events", "populated 1\nfrozen 0\n"),
+        ]:
+            _write(os.path.join(self.job_cgroup, name), data)
+        for name in ["cpu.pressure", "io.pressure", "memory.pressure"]:
+            _write(os.path.join(self.job_cgroup, name), PRESSURE)
+            _write(os.path.join(self.task_cgroup, name), PRESSURE)
+        for controller, files in [
+            ("cpuset", {"cpuset.cpus": "0-15\n"}),
+            ("cpuacct", {"cpuacct.stat": "user 0\nsystem 0\n"}),
+            (
+                "memory",
+                {
+                    "memory.usage_in_bytes": "1073741824\n",
+                    "memory.limit_in_bytes": "4294967296\n",
+                    "memory.max_usage_in_bytes": "2147483648\n",
+                    "memory.memsw.usage_in_bytes": "1073741824\n",
+                    "memory.stat": MEMORY_STAT_V1,
+                },
+            ),
+        ]:
+            path = os.path.join(self.cgroup1, controller, self.job_path)
+            os.makedirs(path, exist_ok=True)
+            for name, data in files.items():
+                _write(os.path.join(path, name), data)
+
+    def _stat(self, pid, comm, ppid, threads):
+        # Fields 3-22: state, ppid, pgrp, session, tty_nr, tpgid, flags, minflt, cminflt,
+        # majflt, cmajflt, utime, stime, cutime, cstime, priority, nice, num_threads,
+        # itrealvalue and starttime.
+        return "%d (%s) S %d %d %d 0 -1 4194560 0 0 0 0 %d %d 0 0 20 0 %d 0 %d %s\n" % (
+            pid,
+            comm,
+            ppid,
+            pid,
+            pid,
+            self.ticks,
+            self.ticks // 4,
+            threads,
+            pid,
+            STAT_TAIL,
+        )
+
+    def add_process(self, threads=1, job=True):
+        """Add a process with threads tasks, returns the pid"""
+        pid = self.next_pid
+        tids = list(range(pid, pid + threads))
+        self.next_pid += threads
+        exe = "/opt/app/bin/app%d" % (pid % self.exes)
+        comm = os.path.basename(exe)
+
+        base = os.path.join(self.procdir, str(pid))
+        os.makedirs(os.path.join(base, "task"))
+        _write(os.path.join(base, "stat"), self._stat(pid, comm, 1, threads))
+        os.symlink(exe, os.path.join(base, "exe"))
+        if job:
+            _write(os.path.join(base, "cpuset"), "/%s/step_0\n" % self.job_path)
+            _write(
+                os.path.join(base, "cgroup"),
+                "0::/system.slice/slurmstepd.scope/job_%d/step_0/user/task_0\n"
+                "4:cpuset:/%s/step_0\n"
+                "3:cpuacct:/%s/step_0\n" % (self.jobid, self.job_path, self.job_path),
+            )
+        else:
+            _write(os.path.join(base, "cpuset"), "/\n")
+            _write(os.path.join(base, "cgroup"), "0::/system.slice/other.service\n")
+        for tid in tids:
+            os.mkdir(os.path.join(base, "task", str(tid)))
+            _write(os.path.join(base, "task", str(tid), "stat"), self._stat(tid, comm, 1, threads))
+
+        if job:
+            self.processes[pid] = tids
+        else:
+            self.other.append(pid)
+        return pid
+
+    def remove_process(self, pid):
+        shutil.rmtree(os.path.join(self.procdir, str(pid)))
+        self.processes.pop(pid, None)
+
+    def write_cgroup_procs(self):
+        _write(os.path.join(self.task_cgroup, "cgroup.procs"), "".join("%d\n" % pid for pid in self.processes))
+
+    def build(self, pids, threads=1, other=0):
+        """Add pids processes with threads tasks each to the job and other processes outside of it"""
+        for _ in range(pids):
+            self.add_process(threads)
+        for _ in range(other):
+            self.add_process(1, job=False)
+        self.write_cgroup_procs()
+
+    def churn(self, rate, threads=1):
+        """Replace rate (0-1) of the processes of the job with new ones, returns the new pids"""
+        count = int(len(self.processes) * rate)
+        for pid in list(self.processes.keys())[:count]:
+            self.remove_process(pid)
+        new = [self.add_process(threads) for _ in range(count)]
+        self.write_cgroup_procs()
+        return new
+
+    def advance(self, ticks=100):
+        """Advance the cpu usage of every task of the job by ticks"""
+        self.ticks += ticks
+        for pid, tids in self.processes.items():
+            comm = "app%d" % (pid % self.exes)
+            base = os.path.join(self.procdir, str(pid))
+            _write(os.path.join(base, "stat"), self._stat(pid, comm, 1, len(tids)))
+            for tid in tids:
+                _write(os.path.join(base, "task", str(tid), "stat"), self._stat(tid, comm, 1, len(tids)))
+
+    @property
+    def tasks(self):
+        return sum(len(tids) for tids in self.processes.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("root", help="Directory to build the tree in")
+    parser.add_argument("--pids", type=int, default=100, help="Number of processes in the job [%(default)s]")
+    parser.add_argument("--threads", type=int, default=10, help="Number of tasks per process [%(default)s]")
+    parser.add_argument("--other", type=int, default=100, help="Number of processes outside of the job [%(default)s]")
+    parser.add_argument("--jobid", type=int, default=1, help="Slurm jobid [%(default)s]")
+    args = parser.parse_args()
+
+    fake = FakeProc(args.root, jobid=args.jobid)
+    fake.build(args.pids, args.threads, args.other)
+    print("Built %d pids with %d tasks in %s" % (len(fake.processes), fake.tasks, args.root))
+
+
+if __name__ == "__main__":
+    main()
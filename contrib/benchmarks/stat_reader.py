@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmark of reading per-task cpu usage from /proc/<pid>/task/<tid>/stat
+
+Compares the original open/read/regex/close implementation of
+sams.sampler.Software with sams.procfs.StatReader. The benchmark starts
+a number of idle threads in its own process and reads the stat file of
+every thread a number of times.
+
+Usage: stat_reader.py [--threads N] [--rounds N]
+"""
+
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+import sams.procfs  # noqa: E402
+
+CLOCK_TICKS = os.sysconf(os.sysconf_names["SC_CLK_TCK"])
+
+
+def before(pid, tasks):
+    """The implementation used by sams.sampler.Software before StatReader"""
+    result = {}
+    for task in tasks:
+        with open("/proc/%d/task/%d/stat" % (pid, task)) as f:
+            stat = f.read()
+        m = re.search(r"^\d+ \(.*\) [RSDZTyEXxKWPI] (.*)", stat)
+        stats = m.group(1).split(r" ")
+        result[task] = {
+            "user": float(stats[14 - 4]) / CLOCK_TICKS,
+            "system": float(stats[15 - 4]) / CLOCK_TICKS,
+        }
+    return result
+
+
+def after(pid, tasks, reader, counters):
+    for task in tasks:
+        cpu = reader.read_cpu((pid, task))
+        counters.set(task, cpu[0] / CLOCK_TICKS, cpu[1] / CLOCK_TICKS)
+    return counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--threads", type=int, default=256, help="Number of threads [%(default)s]")
+    parser.add_argument("--rounds", type=int, default=100, help="Number of samples [%(default)s]")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    threads = [threading.Thread(target=stop.wait) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+
+    try:
+        pid = os.getpid()
+        tasks = [int(t) for t in os.listdir("/proc/%d/task" % pid)]
+        reads = len(tasks) * args.rounds
+
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            before(pid, tasks)
+        before_time = time.perf_counter() - start
+
+        reader = sams.procfs.StatReader(max_open=len(tasks))
+        counters = sams.procfs.TaskCounters()
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            after(pid, tasks, reader, counters)
+        after_time = time.perf_counter() - start
+        reader.close_all()
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    print("tasks: %d, rounds: %d" % (len(tasks), args.rounds))
+    print("before: %8.2f us/task" % (before_time / reads * 1e6))
+    print("after:  %8.2f us/task" % (after_time / reads * 1e6))
+    print("speedup: %.1fx" % (before_time / after_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -44,6 +44,8 @@ import os
 import sqlite3
 
 import sams.base
+import sams.core
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
@@ -200,19 +202,23 @@ group by jobid
 class Aggregator(sams.base.Aggregator):
     """SAMS Software accounting aggregator"""
 
+    OPTIONS = sams.base.Aggregator.OPTIONS + [
+        Option("db_path", type=str, required=True),
+        Option("cluster", type=str, required=True),
+        Option("file_pattern", "sa-%(jobid_hash)d.db", str),
+        Option("jobid_hash_size", 0, int),
+        Option("sqlite_temp_store", "DEFAULT", str, choices=["DEFAULT", "FILE", "MEMORY"]),
+    ]
+
     def __init__(self, id, config):
         super(Aggregator, self).__init__(id, config)
         self.db = {}
-        self.db_path = self.config.get([self.id, "db_path"])
-        self.cluster = self.config.get([self.id, "cluster"])
-        self.file_pattern = self.config.get([self.id, "file_pattern"], "sa-%(jobid_hash)d.db")
-        self.jobid_hash_size = self.config.get([self.id, "jobid_hash_size"], 0)
+        self.db_path = self.options.db_path
+        self.cluster = self.options.cluster
+        self.file_pattern = self.options.file_pattern
+        self.jobid_hash_size = self.options.jobid_hash_size
         self.inserted = {}
-
-        self.sqlite_temp_store = self.config.get([self.id, "sqlite_temp_store"], "DEFAULT")
-
-        if self.sqlite_temp_store not in ["DEFAULT", "FILE", "MEMORY"]:
-            sams.base.AggregatorException("sqlite_temp_store must be one of DEFAULT, FILE or MEMORY")
+        self.sqlite_temp_store = self.options.sqlite_temp_store
 
     def _open_db(self, jobid_hash):
         """Open database object"""
@@ -289,7 +295,8 @@ class Aggregator(sams.base.Aggregator):
                 logger.info("Jobid: %d on node %s has no %s", jobid, node, module)
                 raise sams.base.AggregatorException("Jobid: %d on node %s has no %s" % (jobid, node, module))
 
-        if len(data["sams.sampler.Software"]["execs"]) == 0:
+        execs = sams.core.job_execs(data)
+        if len(execs) == 0:
             raise sams.base.AggregatorException("Jobid: %d on node %s has no execs" % (jobid, node))
 
         # Begin transaction
@@ -356,7 +363,7 @@ class Aggregator(sams.base.Aggregator):
             node_id = self.get_id(jobid, "nodes", node)
 
         # Insert information about running commands
-        for sw, info in data["sams.sampler.Software"]["execs"].items():
+        for sw, info in execs.items():
             # Insert software
             sw_id = None
             if self.do_insert(jobid, "softwares", sw):
@@ -38,7 +38,7 @@ import re
 import sqlite3
 
 import sams.base
-from sams.core import JobSoftware, Software
+from sams.core import JobSoftware, Option, Software
 
 logger = logging.getLogger(__name__)
 
@@ -97,14 +97,17 @@ SELECT path from software where software IS NULL order by path
 class Backend(sams.base.Backend):
     """SAMS Software accounting aggregator"""
 
+    OPTIONS = sams.base.Backend.OPTIONS + [
+        Option("db_path", type=str, required=True),
+        Option("file_pattern", r"sa-\d+.db", str),
+        Option("sqlite_temp_store", "DEFAULT", str, choices=["DEFAULT", "FILE", "MEMORY"]),
+    ]
+
     def __init__(self, id, config):
         super(Backend, self).__init__(id, config)
-        self.db_path = self.config.get([self.id, "db_path"])
-        self.file_pattern = re.compile(self.config.get([self.id, "file_pattern"], r"sa-\d+.db"))
-        self.sqlite_temp_store = self.config.get([self.id, "sqlite_temp_store"], "DEFAULT")
-
-        if self.sqlite_temp_store not in ["DEFAULT", "FILE", "MEMORY"]:
-            sams.base.BackendException("sqlite_temp_store must be one of DEFAULT, FILE or MEMORY")
+        self.db_path = self.options.db_path
+        self.file_pattern = re.compile(self.options.file_pattern)
+        self.sqlite_temp_store = self.options.sqlite_temp_store
 
         self.dry_run(False)
         self.updated = {}
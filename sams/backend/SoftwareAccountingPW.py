@@ -62,6 +62,7 @@ from peewee import (
 
 import sams.base
 import sams.core
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
@@ -148,30 +149,34 @@ class Command(BaseModel):
 class Backend(sams.base.Backend):
     """SAMS Software accounting backend"""
 
+    OPTIONS = sams.base.Backend.OPTIONS + [
+        Option("cluster", type=str, required=True),
+        Option("database", "sqlite", str, choices=["sqlite", "postgresql", "mysql"]),
+        Option("database_options", {}, dict),
+        Option("create_tables", "no", str, choices=["yes", "no"]),
+    ]
+
     def __init__(self, id, config):
         super(Backend, self).__init__(id, config)
-        self.cluster = self.config.get([self.id, "cluster"])
+        self.cluster = self.options.cluster
         self.inserted = {}
         self._dry_run = False
 
-        self.database = self.config.get([self.id, "database"], "sqlite")
-        self.database_options = self.config.get([self.id, "database_options"], {})
+        self.database = self.options.database
+        self.database_options = self.options.database_options
 
         if self.database == "sqlite":
             sdb = SqliteDatabase(**self.database_options)
         elif self.database == "postgresql":
             sdb = PostgresqlDatabase(**self.database_options)
-        elif self.database == "mysql":
-            sdb = MySQLDatabase(**self.database_options)
         else:
-            raise sams.base.BackendException("A valid database config is not provided. Use: sqlite, postgresql or mysql")
+            sdb = MySQLDatabase(**self.database_options)
 
         db.initialize(sdb)
         self.db = db
 
         # create tables
-        create_tables = self.config.get([self.id, "create_tables"], "no")
-        if create_tables == "yes":
+        if self.options.create_tables == "yes":
             self.db.create_tables([User, Project, Job, Software, Command, Node, LastSent])
 
     def dry_run(self, dry):
@@ -188,7 +193,8 @@ class Backend(sams.base.Backend):
                 logger.info("Jobid: %d on node %s has no %s", jobid, node_name, module)
                 raise sams.base.AggregatorException(f"Jobid: {jobid} on node {node_name} has no {module}")
 
-        if len(data["sams.sampler.Software"]["execs"]) == 0:
+        execs = sams.core.job_execs(data)
+        if len(execs) == 0:
             raise sams.base.AggregatorException("Jobid: {jobid} on node {node_name} has no execs")
 
         with self.db.atomic():
@@ -245,7 +251,7 @@ class Backend(sams.base.Backend):
                 node.save()
 
             # Insert information about running commands
-            for path, info in data["sams.sampler.Software"]["execs"].items():
+            for path, info in execs.items():
                 # Insert software
                 software = None
                 try:
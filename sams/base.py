@@ -21,6 +21,7 @@ along with this program; If not, see <http://www.gnu.org/licenses/>.
 import logging
 import os
 import queue
+import random
 import select
 import socket
 import threading
@@ -28,31 +29,71 @@ import time
 from abc import ABC, abstractmethod
 from typing import List
 
-from sams.core import Config
+import sams.core
+from sams.core import Config, Option
 
 logger = logging.getLogger(__name__)
 
 
+class PIDFinderException(Exception):
+    pass
+
+
 class PIDFinder:
-    """PIDFinder base class"""
+    """PIDFinder base class
+
+    OPTIONS are compiled into self.options when the pid finder is created,
+    subclasses extend them with their own options.
+    """
+
+    OPTIONS = [
+        # Root of the proc file system, can be changed for testing.
+        Option("procdir", "/proc", str, fallback=["common", "procdir"]),
+    ]
 
     def __init__(self, id, jobid, config):
         self.id = id
         self.jobid = jobid
         self.config = config
+        self.options = self.config.compile(self.id, self.OPTIONS)
+        self.procdir = self.options.procdir
 
     # pylint: disable=no-self-use
     def find(self):
         raise NotImplementedError("Not implemented")
         # return []
 
+    # pylint: disable=no-self-use
+    def find_jobs(self):
+        """Returns a dict with new pids per jobid for all jobs on the node"""
+        raise NotImplementedError("Not implemented")
+
+    # pylint: disable=no-self-use
+    def cgroup_events(self, jobid=None):
+        """Path to the cgroup.events file of the job (if known)"""
+        return None
+
 
 class SamplerException(Exception):
     pass
 
 
 class Sampler(threading.Thread):
-    """Sampler base class"""
+    """Sampler base class
+
+    OPTIONS are compiled into self.options when the sampler is created,
+    subclasses can extend them with their own options.
+    """
+
+    OPTIONS = [
+        Option("procdir", "/proc", str, fallback=["common", "procdir"]),
+        Option("sampler_interval", 60, (int, float)),
+        Option("adaptive", False, bool),
+        Option("min_interval", None, (int, float)),
+        Option("max_interval", None, (int, float)),
+        Option("adaptive_threshold", 0.1, (float, int)),
+        Option("checkpoint_interval", 0, (int, float), fallback=["common", "checkpoint_interval"]),
+    ]
 
     def __init__(self, id, outQueue, config):
         super(Sampler, self).__init__()
@@ -62,39 +103,156 @@ class Sampler(threading.Thread):
         self.config = config
         self.jobid = self.config.get(["options", "jobid"])
         self.pidQueue = queue.Queue()
-        self.pids = []
-        self.sampler_interval = self.config.get([self.id, "sampler_interval"], 60)
+        # Pids of the job that are still of interest to the sampler, see retire_pids().
+        self.pids = set()
+        # Number of pids received from the pidfinder.
+        self.pids_seen = 0
+        self.options = self.config.compile(self.id, self.OPTIONS)
+        # Root of the proc file system, can be changed for testing.
+        self.procdir = self.options.procdir
+        self.sampler_interval = self.options.sampler_interval
+        # Adaptive sampling, the interval is halved (down to min_interval) when the
+        # values given to adapt() change more than adaptive_threshold and doubled
+        # (up to max_interval) when they have been stable for a few samples.
+        self.adaptive = self.options.adaptive
+        self.min_interval = self.options.min_interval or self.sampler_interval / 4
+        self.max_interval = self.options.max_interval or self.sampler_interval * 4
+        self.adaptive_threshold = self.options.adaptive_threshold
+        self.interval = self.sampler_interval
+        self._adapt_values = None
+        self._adapt_peak = {}
+        self._stable = 0
+        # Set by throttle() when the collector is over its cpu budget.
+        self.throttle_factor = 1
+        # How often (in seconds) checkpoint_data() is sent to the outputs, 0 disables.
+        self.checkpoint_interval = self.options.checkpoint_interval
+        self.last_checkpoint = time.time()
+        # Number of times sample() has been called.
+        self.samples = 0
+        self.instrumentation = sams.core.Instrumentation()
+        # Latest sams.procfs.ProcSnapshot if the collector takes snapshots.
+        self.snapshot = None
+        # Set if the sampler is run from a sams.core.Scheduler.
+        self.scheduler = None
+        self._scheduled = None
+        # Set by samplers that can block (wait for a command), they are run in
+        # their own thread also when the other samplers are run from a scheduler.
+        self.blocking = False
 
     def init(self):  # pylint: disable=no-self-use
         pass
 
-    def run(self):
+    def _init(self):
         try:
             self.init()
         except Exception:
             logger.exception("Failed to do self.init in %s", self.id)
+
+    def run(self):
+        self._init()
         while True:
             try:
-                pids = self.pidQueue.get(timeout=self.sampler_interval)
+                pids = self.pidQueue.get(timeout=self.interval * self.throttle_factor)
                 if not pids:
                     self.pidQueue.task_done()
                     break
-                logger.debug("Received new pids: %s", pids)
-                self.pids.extend(pids)
+                self.add_pids(pids)
                 self.pidQueue.task_done()
             except queue.Empty:
                 logger.debug("%s queue.Empty timeout", self.id)
-            try:
-                if self.do_sample():
+            self.tick()
+
+        self.finish()
+        self.outQueue.join()
+
+    def schedule(self, scheduler):
+        """Run the sampler from a sams.core.Scheduler instead of in its own thread"""
+        self.scheduler = scheduler
+        scheduler.call(self._init)
+        self._scheduled = scheduler.add(self.tick, self.sampler_interval)
+
+    def add_pids(self, pids):
+        logger.debug("Received new pids: %s", pids)
+        self.pids.update(pids)
+        self.pids_seen += len(pids)
+
+    def retire_pids(self, pids):
+        """Forget pids that has ended and been accounted for. The
+        pidfinder only sends a pid again if it is reused by a new process."""
+        self.pids.difference_update(pids)
+
+    def tick(self):
+        try:
+            if self.do_sample():
+                self.samples += 1
+                self.instrumentation.set("pids", len(self.pids))
+                with self.instrumentation.measure("sample"):
                     self.sample()
-            except Exception:
-                logger.exception("Failed to do self.sample in %s", self.id)
+        except Exception:
+            logger.exception("Failed to do self.sample in %s", self.id)
+        self.checkpoint()
+
+    def checkpoint(self):
+        """Send checkpoint_data() to the outputs if checkpoint_interval has passed"""
+        if not self.checkpoint_interval or time.time() - self.last_checkpoint < self.checkpoint_interval:
+            return
+        self.last_checkpoint = time.time()
+        try:
+            with self.instrumentation.measure("checkpoint_data"):
+                data = self.checkpoint_data()
+        except Exception:
+            logger.exception("Failed to do self.checkpoint_data in %s", self.id)
+            return
+        if data is not None:
+            self.store(data, "checkpoint")
+
+    def adapt(self, values):
+        """Adapt the interval to how much values (a dict of numbers) have changed since last sample.
 
+        The change is relative to the largest value seen, so noise around zero
+        does not count as a change.
+        """
+        if not self.adaptive:
+            return
+        last = self._adapt_values
+        self._adapt_values = dict(values)
+        change = 0.0
+        for key, value in values.items():
+            self._adapt_peak[key] = max(self._adapt_peak.get(key, 0.0), abs(value))
+            if last is None or key not in last or not self._adapt_peak[key]:
+                continue
+            change = max(change, abs(value - last[key]) / self._adapt_peak[key])
+
+        if last is None:
+            return
+        if change > self.adaptive_threshold:
+            self._stable = 0
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self._stable += 1
+            if self._stable >= 3:
+                self._stable = 0
+                self.interval = min(self.max_interval, self.interval * 2)
+        logger.debug("%s change: %f, interval: %s", self.id, change, self.interval)
+        self._update_interval()
+
+    def throttle(self, level):
+        """Called by the collector when it is over its cpu budget (level > 0)
+        or no longer is (level 0). Stretches the interval by 2**level."""
+        self.throttle_factor = 2**level
+        self._update_interval()
+
+    def _update_interval(self):
+        if self._scheduled is not None:
+            self._scheduled.interval = self.interval * self.throttle_factor
+
+    def finish(self):
         try:
-            self.store(self.final_data(), "final")
+            with self.instrumentation.measure("final_data"):
+                data = self.final_data()
+            self.store(data, "final")
         except Exception:
             logger.exception("Failed to do self.final_data in %s", self.id)
-        self.outQueue.join()
 
     def _storage_wrapping(self, data, type="now"):
         """
@@ -122,11 +280,26 @@ class Sampler(threading.Thread):
     def final_data(self):
         raise NotImplementedError("Not implemented")
 
+    # pylint: disable=no-self-use
+    def checkpoint_data(self):
+        """The data so far in the same format as final_data(), without
+        ending anything. None if the sampler does not support checkpoints."""
+        return None
+
     def do_sample(self):
-        return len(self.pids) > 0
+        return self.pids_seen > 0
+
+    def update_snapshot(self, snapshot):
+        """Called by the collector with a new (immutable) /proc snapshot"""
+        self.snapshot = snapshot
 
     def exit(self):
         logger.debug("%s exit", self.id)
+        if self.scheduler is not None:
+            self.scheduler.remove(self._scheduled)
+            self.scheduler.call_wait(self.finish)
+            self.outQueue.join()
+            return
         self.pidQueue.put(None)
 
 
@@ -135,11 +308,18 @@ class AggregatorException(Exception):
 
 
 class Aggregator:
-    """Aggregator base class"""
+    """Aggregator base class
+
+    OPTIONS are compiled into self.options when the aggregator is created,
+    subclasses extend them with their own options.
+    """
+
+    OPTIONS = []
 
     def __init__(self, id, config):
         self.id = id
         self.config = config
+        self.options = self.config.compile(self.id, self.OPTIONS)
 
     # pylint: disable=no-self-use
     def aggregate(self, data):
@@ -147,11 +327,18 @@ class Aggregator:
 
 
 class Loader:
-    """Loader base class"""
+    """Loader base class
+
+    OPTIONS are compiled into self.options when the loader is created,
+    subclasses extend them with their own options.
+    """
+
+    OPTIONS = []
 
     def __init__(self, id, config):
         self.id = id
         self.config = config
+        self.options = self.config.compile(self.id, self.OPTIONS)
 
     # pylint: disable=no-self-use
     def load(self):
@@ -171,11 +358,18 @@ class BackendException(Exception):
 
 
 class Backend:
-    """Backend base class"""
+    """Backend base class
+
+    OPTIONS are compiled into self.options when the backend is created,
+    subclasses extend them with their own options.
+    """
+
+    OPTIONS = []
 
     def __init__(self, id, config):
         self.id = id
         self.config = config
+        self.options = self.config.compile(self.id, self.OPTIONS)
 
     # pylint: disable=no-self-use
     def update(self, software):
@@ -187,11 +381,18 @@ class Backend:
 
 
 class Software:
-    """Software base class"""
+    """Software base class
+
+    OPTIONS are compiled into self.options when the software mapper is created,
+    subclasses extend them with their own options.
+    """
+
+    OPTIONS = []
 
     def __init__(self, id, config):
         self.id = id
         self.config = config
+        self.options = self.config.compile(self.id, self.OPTIONS)
 
     # pylint: disable=no-self-use
     def update(self):
@@ -199,22 +400,75 @@ class Software:
 
 
 class Output(threading.Thread):
-    """Output base class"""
+    """Output base class
+
+    OPTIONS are compiled into self.options when the output is created,
+    subclasses can extend them with their own options.
+    """
+
+    OPTIONS = [
+        Option("queue_size", 0, int),
+        Option("queue_policy", "block", str, choices=sams.core.Channel.POLICIES),
+        Option("retry_count", 3, int),
+        Option("retry_sleep", 3, (int, float)),
+        Option("checkpoint_interval", 0, (int, float), fallback=["common", "checkpoint_interval"]),
+    ]
 
     def __init__(self, id, config):
         super(Output, self).__init__()
         self.id = id
         self.config = config
+        self.options = self.config.compile(self.id, self.OPTIONS)
 
-        self.dataQueue = queue.Queue()
+        self.dataQueue = sams.core.Channel(self.options.queue_size, self.options.queue_policy)
         self.jobid = self.config.get(["options", "jobid"])
+        self.instrumentation = sams.core.Instrumentation()
+        # How often (in seconds) write_checkpoint() is called, 0 disables.
+        self.checkpoint_interval = self.options.checkpoint_interval
+        # Set by checkpoint() when there is something new to write.
+        self.checkpoint_dirty = False
+        # Start at a random point of the interval so the nodes of a job does not write at the same time.
+        self.last_checkpoint_write = time.time() - random.uniform(0, self.checkpoint_interval)
 
     def run(self):
         while True:
-            data = self.dataQueue.get()
-            if data is None:
-                self.dataQueue.task_done()
+            batch = self.dataQueue.get_batch()
+            stop = None in batch
+            try:
+                with self.instrumentation.measure("store"):
+                    self.store_batch(batch[: batch.index(None)] if stop else batch)
+            except Exception:
+                logger.exception("Failed to store batch in %s", self.id)
+            self.dataQueue.task_done(len(batch))
+            if stop:
                 break
+            if self.checkpoint_interval and self.checkpoint_dirty and time.time() - self.last_checkpoint_write >= self.checkpoint_interval:
+                self.last_checkpoint_write = time.time()
+                self.checkpoint_dirty = False
+                try:
+                    with self.instrumentation.measure("checkpoint"):
+                        self.write_checkpoint()
+                except Exception:
+                    logger.exception("Failed to do self.write_checkpoint in %s", self.id)
+
+        for _ in range(self.options.retry_count):
+            try:
+                with self.instrumentation.measure("write"):
+                    self.write()
+                break
+            except Exception:
+                logger.exception("Failed to do self.write in %s", self.id)
+            time.sleep(self.options.retry_sleep)
+
+    def store_batch(self, batch):
+        """Store a list of messages from the samplers, can be overridden to store in bulk"""
+        for data in batch:
+            if data.get("type") == "checkpoint":
+                try:
+                    self.checkpoint({data["id"]: data["data"]})
+                except Exception:
+                    logger.exception("Failed to do self.checkpoint in %s", self.id)
+                continue
             try:
                 self.store({data["id"]: data["data"]})
             except Exception:
@@ -224,15 +478,6 @@ class Output(threading.Thread):
                     self.final({data["id"]: data["data"]})
                 except Exception:
                     logger.exception("Failed to do self.final in %s", self.id)
-            self.dataQueue.task_done()
-
-        for _ in range(int(self.config.get([self.id, "retry_count"], 3))):
-            try:
-                self.write()
-                break
-            except Exception:
-                logger.exception("Failed to do self.write in %s", self.id)
-            time.sleep(int(self.config.get([self.id, "retry_sleep"], 3)))
 
     # pylint: disable=no-self-use
     def store(self, data):
@@ -241,6 +486,14 @@ class Output(threading.Thread):
     def final(self, data):
         self.store(data)
 
+    # pylint: disable=no-self-use
+    def checkpoint(self, data):
+        """Checkpoint data from a sampler, ignored unless the output supports checkpoints"""
+
+    # pylint: disable=no-self-use
+    def write_checkpoint(self):
+        raise NotImplementedError("Not implemented")
+
     # pylint: disable=no-self-use
     def write(self):
         raise NotImplementedError("Not implemented")
@@ -250,11 +503,18 @@ class Output(threading.Thread):
 
 
 class XMLWriter:
-    """XMLWriter base class"""
+    """XMLWriter base class
+
+    OPTIONS are compiled into self.options when the xml writer is created,
+    subclasses extend them with their own options.
+    """
+
+    OPTIONS = []
 
     def __init__(self, id, config):
         self.id = id
         self.config = config
+        self.options = self.config.compile(self.id, self.OPTIONS)
 
     # pylint: disable=no-self-use
     def write(self, data):
@@ -262,14 +522,26 @@ class XMLWriter:
 
 
 class Listener(ABC):
-    """Base class for listening to sockets and sending encoded data."""
+    """Base class for listening to sockets and sending encoded data.
+
+    OPTIONS are compiled into self.options when the listener is created,
+    subclasses extend them with their own options.
+    """
+
+    OPTIONS = [
+        Option("socketdir", "/tmp/softwareaccounting", str),
+        Option("jobid", 0, int, path=["options", "jobid"]),
+    ]
 
     def __init__(self, id: str, config: Config, samplers: List):
         self.id = id
         self.config = config
         self.samplers = samplers
-        socket_directory = self.config.get([self.id, "socketdir"], "/tmp/softwareaccounting")
-        self.job_id = self.config.get(["options", "jobid"], 0)
+        # Set by the collector to a function that returns sams.collector.self data.
+        self.self_stats = None
+        self.options = self.config.compile(self.id, self.OPTIONS)
+        socket_directory = self.options.socketdir
+        self.job_id = self.options.jobid
         self.server_socket = socket.socket(socket.AF_UNIX)
         self.is_finished = False
         if not os.path.isdir(socket_directory):
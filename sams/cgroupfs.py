@@ -0,0 +1,126 @@
+"""
+Reader for cgroup files that are read every sample
+
+SAMS Software accounting
+Copyright (C) 2018-2021  Swedish National Infrastructure for Computing (SNIC)
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def parse_keyed(data, into):
+    """Parse a flat keyed ("key value", memory.stat, cpu.stat) or nested
+    keyed ("MAJ:MIN key=value ...", io.stat) cgroup file into the dict into.
+
+    The values of nested keyed files are summed over all lines. into is
+    reused between reads, the values of keys that are missing from data
+    are set to 0.
+    """
+    for key in into:
+        into[key] = 0
+    for line in data.split(b"\n"):
+        fields = line.split()
+        if not fields:
+            continue
+        try:
+            if len(fields) == 2 and b"=" not in fields[1]:
+                into[fields[0].decode()] = int(fields[1])
+                continue
+            for field in fields[1:]:
+                key, _, value = field.partition(b"=")
+                key = key.decode()
+                into[key] = into.get(key, 0) + int(value)
+        except ValueError:
+            # Values like "max" are not counters.
+            continue
+    return into
+
+
+class CGroupReader:
+    """Reads cgroup files that are read over and over again.
+
+    The files are kept open and re-read from the start with pread, with
+    a read size that grows to fit the largest file. A file that can not be read is not tried again
+    until after a backoff (in number of reads of the file) that doubles
+    for every failure, up to max_backoff. Only the first failure is
+    logged as an error.
+    """
+
+    def __init__(self, bufsize=4096, max_backoff=64):
+        self.bufsize = bufsize
+        self.max_backoff = max_backoff
+        self.fds = {}
+        # path -> [failures, reads left to skip]
+        self.failed = {}
+
+    def read(self, path):
+        """Returns the content of path as bytes or None if it can not be read"""
+        failed = self.failed.get(path)
+        if failed is not None and failed[1] > 0:
+            failed[1] -= 1
+            return None
+        try:
+            fd = self.fds.get(path)
+            if fd is None:
+                fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+                self.fds[path] = fd
+            data = os.pread(fd, self.bufsize, 0)
+            while len(data) == self.bufsize:
+                self.bufsize *= 2
+                data = os.pread(fd, self.bufsize, 0)
+        except OSError as err:
+            self.close(path)
+            self._failed(path, err)
+            return None
+        if failed is not None:
+            logger.info("%s can be read again", path)
+            del self.failed[path]
+        return data
+
+    def _failed(self, path, err):
+        failed = self.failed.setdefault(path, [0, 0])
+        if not failed[0]:
+            logger.error("Failed to open %s for reading: %s", path, err)
+        else:
+            logger.debug("Failed to open %s for reading: %s", path, err)
+        failed[0] += 1
+        failed[1] = min(2 ** failed[0] - 1, self.max_backoff)
+
+    def value(self, path):
+        """First line of path without whitespace or "" if it can not be read"""
+        data = self.read(path)
+        if data is None:
+            return ""
+        return data.split(b"\n", 1)[0].strip().decode()
+
+    def keyed(self, path, into):
+        """The counters of a keyed file parsed into the dict into, or None if it can not be read"""
+        data = self.read(path)
+        if data is None:
+            return None
+        return parse_keyed(data, into)
+
+    def close(self, path):
+        fd = self.fds.pop(path, None)
+        if fd is not None:
+            os.close(fd)
+
+    def close_all(self):
+        for path in list(self.fds.keys()):
+            self.close(path)
@@ -18,29 +18,134 @@ You should have received a copy of the GNU General Public License
 along with this program; If not, see <http://www.gnu.org/licenses/>.
 """
 
+import collections
+import contextlib
+import copy
+import heapq
+import itertools
 import logging
+import marshal
+import math
 import os
-import queue
 import resource  # Resource usage information.
+import select
+import socket
 import sys
 import threading
-
-import yaml
+import time
+import zlib
 
 logger = logging.getLogger(__name__)
 
 
+class ConfigException(Exception):
+    pass
+
+
+class Option:
+    """Declaration of a config option of a plugin, see Config.compile()"""
+
+    __slots__ = ("name", "default", "type", "choices", "path", "fallback", "required")
+
+    def __init__(self, name, default=None, type=None, choices=None, path=None, fallback=None, required=False):
+        self.name = name
+        self.default = default
+        # Type (or tuple of types) of the value, numbers are also accepted as strings.
+        self.type = type
+        self.choices = choices
+        # Where the value is read from instead of [id, name].
+        self.path = path
+        # Where the value is read from if it is not set, e.g. ["common", name].
+        self.fallback = fallback
+        self.required = required
+
+    def resolve(self, config, id):
+        path = self.path or [id, self.name]
+        # Falsy values like 0 or false are set, only missing and null values are not.
+        value = config.lookup(path)
+        if value is None and self.fallback:
+            value = config.lookup(self.fallback)
+        if self.required and (value is None or isinstance(value, (str, list, dict)) and not value):
+            raise ConfigException("%s is required" % "/".join(path))
+        if value is None:
+            return self.default
+        if self.type is not None and not isinstance(value, self.type):
+            convert = self.type[0] if isinstance(self.type, tuple) else self.type
+            if convert not in (int, float) or isinstance(value, bool):
+                raise ConfigException("%s must be of type %s" % ("/".join(path), convert.__name__))
+            try:
+                value = convert(value)
+            except (TypeError, ValueError) as e:
+                raise ConfigException("%s must be of type %s" % ("/".join(path), convert.__name__)) from e
+        if self.choices is not None and value not in self.choices:
+            raise ConfigException("%s must be one of %s" % ("/".join(path), ", ".join(str(c) for c in self.choices)))
+        return value
+
+
 class Config:
-    """Config class, reads config_file.yaml"""
+    """Config class, reads config_file.yaml
+
+    If cache_dir is set the parsed config is cached there, keyed by the
+    path of config_file and used as long as the mtime and hash of the file
+    are the same. yaml is then only imported when the file has changed.
+    """
 
-    def __init__(self, config_file, extra=None):
+    def __init__(self, config_file, extra=None, cache_dir=None):
         self._cfg = {}
-        with open(config_file, "r") as file:
-            self._cfg = yaml.load(file, Loader=yaml.SafeLoader)
+        with open(config_file, "rb") as file:
+            content = file.read()
+            mtime = os.fstat(file.fileno()).st_mtime_ns
+        self._cfg = self._load_cached(config_file, content, mtime, cache_dir)
 
         if extra:
             self._cfg = self._merge(extra, self._cfg)
 
+    @staticmethod
+    def _parse(content):
+        import yaml  # pylint: disable=import-outside-toplevel
+
+        # The C implementation (libyaml) is much faster if available.
+        return yaml.load(content, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+    @classmethod
+    def _load_cached(cls, config_file, content, mtime, cache_dir):
+        if not cache_dir:
+            return cls._parse(content)
+
+        digest = (len(content), zlib.crc32(content), zlib.adler32(content))
+        cache_file = os.path.join(cache_dir, "%08x.config" % zlib.crc32(os.path.abspath(config_file).encode()))
+        try:
+            with open(cache_file, "rb") as file:
+                # Only trust files written by ourselves.
+                if os.fstat(file.fileno()).st_uid == os.getuid():
+                    cached_file, cached_mtime, cached_digest, cfg = marshal.load(file)
+                    if cached_file == os.path.abspath(config_file) and cached_mtime == mtime and cached_digest == digest:
+                        return cfg
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+        cfg = cls._parse(content)
+        try:
+            data = marshal.dumps((os.path.abspath(config_file), mtime, digest, cfg))
+        except ValueError:
+            # Only plain types can be cached (not dates).
+            return cfg
+        try:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            tmp_file = "%s.%d" % (cache_file, os.getpid())
+            with open(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as file:
+                file.write(data)
+            os.rename(tmp_file, cache_file)
+        except OSError as e:
+            logger.debug("Failed to write config cache %s: %s", cache_file, e)
+        return cfg
+
+    def derive(self, extra):
+        """Returns a new Config with extra merged into a copy of this config"""
+        config = Config.__new__(Config)
+        config._cfg = self._merge(extra, copy.deepcopy(self._cfg))
+        return config
+
     def _merge(self, source, destination):
         """Merges two dicts"""
         for key, value in source.items():
@@ -53,32 +158,153 @@ class Config:
 
         return destination
 
-    def _get(self, cfg, items):
-        """Helper function to do the recursive fetch of values from cfg"""
-        item = items[0]
-        if item in cfg and cfg[item]:
-            if len(items) > 1:
-                return self._get(cfg[item], items[1:])
-            else:
-                return cfg[item]
-        return None
-
     def get(self, items, default=None):
-        """get config value"""
-        value = self._get(self._cfg, items)
-        if value is None:
-            return default
+        """get config value, unset and empty values gives default"""
+        value = self._cfg
+        for item in items:
+            if item not in value or not value[item]:
+                return default
+            value = value[item]
         return value
 
+    def lookup(self, items):
+        """get config value, None if it is unset. Unlike get() empty values are returned"""
+        value = self._cfg
+        for item in items:
+            if not isinstance(value, dict) or value.get(item) is None:
+                return None
+            value = value[item]
+        return value
+
+    # Option names -> namedtuple class of the compiled options.
+    _compiled = {}
+
+    def compile(self, id, options):
+        """Resolve and validate the options (a list of Option, later ones replace
+        earlier ones with the same name) of plugin id once. Returns an immutable
+        object with the values as attributes, raises ConfigException if an option
+        is invalid."""
+        options = list({o.name: o for o in options}.values())
+        names = tuple(o.name for o in options)
+        cls = Config._compiled.get(names)
+        if cls is None:
+            cls = Config._compiled[names] = collections.namedtuple("Options", names)
+        return cls(*(o.resolve(self, id) for o in options))
+
+
+class Channel:
+    """Queue of messages for one consumer that is read in batches.
+
+    The number of queued messages is bounded by maxsize (0 is unbounded),
+    when the channel is full policy decides what happens:
+
+    block: put() waits until the consumer has made room.
+    drop-oldest: the oldest "now" message is dropped.
+    coalesce: the queued "now" message with the same id is replaced,
+              otherwise the oldest "now" message is dropped.
+
+    Checkpoint messages are replaced and dropped in the same way. Other
+    messages (final data and the None used to tell the consumer to exit)
+    are never dropped.
+    """
+
+    POLICIES = ["block", "drop-oldest", "coalesce"]
+
+    def __init__(self, maxsize=0, policy="block"):
+        if policy not in self.POLICIES:
+            raise ValueError("policy must be one of %s" % ", ".join(self.POLICIES))
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._unfinished = 0
+        self.max_depth = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _droppable(item):
+        return isinstance(item, dict) and item.get("type", "now") in ["now", "checkpoint"]
+
+    def _make_room(self, item):
+        """Drop or coalesce a queued message to make room for item, called with the lock held"""
+        if self.policy == "coalesce" and self._droppable(item):
+            for i in range(len(self._items) - 1, -1, -1):
+                queued = self._items[i]
+                if self._droppable(queued) and queued.get("id") == item.get("id") and queued.get("type", "now") == item.get("type", "now"):
+                    del self._items[i]
+                    self._unfinished -= 1
+                    self.coalesced += 1
+                    return
+        for i, queued in enumerate(self._items):
+            if self._droppable(queued):
+                del self._items[i]
+                self._unfinished -= 1
+                self.dropped += 1
+                return
+
+    def put(self, item):
+        self.put_many([item])
+
+    def put_many(self, items):
+        with self._cond:
+            for item in items:
+                if self.maxsize and len(self._items) >= self.maxsize:
+                    if self.policy == "block":
+                        while len(self._items) >= self.maxsize:
+                            self._cond.wait()
+                    elif self._droppable(item):
+                        # Other messages are queued beyond maxsize.
+                        self._make_room(item)
+                self._items.append(item)
+                self._unfinished += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._cond.notify_all()
+
+    def get_batch(self, max_items=0, timeout=None):
+        """Wait for messages and return up to max_items (0 is all) of them,
+        returns an empty list if timeout expires"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                return []
+            count = len(self._items) if not max_items else min(max_items, len(self._items))
+            batch = [self._items.popleft() for _ in range(count)]
+            self._cond.notify_all()
+            return batch
+
+    def task_done(self, count=1):
+        with self._cond:
+            self._unfinished -= count
+            if self._unfinished <= 0:
+                self._unfinished = 0
+                self._cond.notify_all()
+
+    def join(self):
+        """Wait until all messages have been handled"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._unfinished <= 0)
+
+    def qsize(self):
+        return len(self._items)
+
+    def stats(self):
+        return {
+            "depth": len(self._items),
+            "max_depth": self.max_depth,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
 
 class OneToN(threading.Thread):
-    """Class that takes one Queue and forwards into N other queues"""
+    """Class that takes one Queue and forwards into N other queues, in batches"""
 
-    def __init__(self, id="OneToN"):
+    def __init__(self, id="OneToN", batch_size=100):
         super(OneToN, self).__init__()
         self.id = id
+        self.batch_size = batch_size
 
-        self.inQueue = queue.Queue()
+        self.inQueue = Channel()
         self.outQueue = []
         self._lock = threading.Lock()
 
@@ -87,16 +313,22 @@ class OneToN(threading.Thread):
     def run(self):
         """Thread that forwards data from inQueue to outQueue[]"""
         while True:
-            value = self.inQueue.get()
-            logger.debug("%s received: %s", self.id, value)
-            if value is None:
-                break
+            batch = self.inQueue.get_batch(self.batch_size)
+            stop = None in batch
+            values = batch[: batch.index(None)] if stop else batch
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("%s received %d values", self.id, len(values))
             # Lock the outQueue so that is will not change during sending.
-            self._lock.acquire()
-            for q in self.outQueue:
-                q.put(value)
-            self._lock.release()
-            self.inQueue.task_done()
+            with self._lock:
+                for q in self.outQueue:
+                    if isinstance(q, Channel):
+                        q.put_many(values)
+                    else:
+                        for value in values:
+                            q.put(value)
+            self.inQueue.task_done(len(batch))
+            if stop:
+                break
 
         logger.debug("%s is waiting for outQueue to be done", self.id)
         for q in self.outQueue:
@@ -106,13 +338,11 @@ class OneToN(threading.Thread):
     def addQueue(self, queue):
         """Add an new output queue"""
         # Lock the outQueue list so that it is consistent
-        self._lock.acquire()
-        self.outQueue.append(queue)
-        self._lock.release()
+        with self._lock:
+            self.outQueue.append(queue)
 
     def put(self, value):
         """Put value into the queue"""
-        logger.debug("%s put(%s)", self.id, value)
         self.inQueue.put(value)
 
     def exit(self):
@@ -122,6 +352,454 @@ class OneToN(threading.Thread):
         self.join()
 
 
+class Inotify:
+    """Minimal inotify(7) wrapper using ctypes"""
+
+    IN_MODIFY = 0x00000002
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = os.O_CLOEXEC
+
+    def __init__(self):
+        # Only needed when job end events are used, ctypes.util is slow to import.
+        import ctypes.util  # pylint: disable=import-outside-toplevel
+
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask=IN_MODIFY):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = self._ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        """Read pending events, returns the set of watch descriptors with events"""
+        wds = set()
+        try:
+            buf = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return wds
+        offset = 0
+        while offset + 16 <= len(buf):
+            # struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+            wd = int.from_bytes(buf[offset : offset + 4], sys.byteorder, signed=True)
+            length = int.from_bytes(buf[offset + 12 : offset + 16], sys.byteorder)
+            wds.add(wd)
+            offset += 16 + length
+        return wds
+
+    def close(self):
+        os.close(self.fd)
+
+
+class JobEndWatcher(threading.Thread):
+    """Thread that calls callback(jobid) when a job has ended.
+
+    A job has ended when the cgroup.events file of the job cgroup
+    changes from "populated 1" to "populated 0" or when a
+    "finished <jobid>" message is received on the control socket.
+    """
+
+    def __init__(self, callback, control_socket=None):
+        super(JobEndWatcher, self).__init__(daemon=True)
+        self.callback = callback
+        self.control_socket = control_socket
+        self.inotify = None
+        self.server_socket = None
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+        if self.control_socket:
+            socket_directory = os.path.dirname(self.control_socket)
+            if socket_directory and not os.path.isdir(socket_directory):
+                os.makedirs(socket_directory)
+            if os.path.exists(self.control_socket):
+                os.unlink(self.control_socket)
+            self.server_socket = socket.socket(socket.AF_UNIX)
+            self.server_socket.bind(self.control_socket)
+            self.server_socket.listen(5)
+
+    @staticmethod
+    def _populated(path):
+        with open(path) as file:
+            for line in file:
+                key, value = line.split()
+                if key == "populated":
+                    return value == "1"
+        return None
+
+    def watch(self, jobid, path):
+        """Start watching the cgroup.events file in path for jobid"""
+        with self._lock:
+            if self.inotify is None:
+                self.inotify = Inotify()
+            wd = self.inotify.add_watch(path)
+            self._watches[wd] = {"jobid": jobid, "path": path, "populated": bool(self._populated(path))}
+        logger.debug("Watching %s for jobid: %s", path, jobid)
+
+    def _check_watches(self, wds):
+        for wd in wds:
+            with self._lock:
+                watch = self._watches.get(wd)
+                if watch is None:
+                    continue
+                try:
+                    populated = self._populated(watch["path"])
+                except OSError:
+                    # The cgroup has been removed.
+                    populated = False
+                if populated is None:
+                    continue
+                if populated:
+                    watch["populated"] = True
+                    continue
+                if not watch["populated"]:
+                    # Wait until the cgroup has been populated once.
+                    continue
+                del self._watches[wd]
+                self.inotify.rm_watch(wd)
+            logger.info("%s is no longer populated", watch["path"])
+            self.callback(watch["jobid"])
+
+    def _check_control_socket(self):
+        connection, _ = self.server_socket.accept()
+        with connection:
+            connection.settimeout(1)
+            try:
+                message = connection.recv(1024).decode("ascii", "replace").split()
+            except OSError as e:
+                logger.debug("Failed to read from control socket: %s", e)
+                return
+        if len(message) == 2 and message[0] == "finished" and message[1].isdigit():
+            logger.info("Received finished message for jobid: %s", message[1])
+            self.callback(int(message[1]))
+        else:
+            logger.warning("Unknown message on control socket: %s", message)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            fds = []
+            if self.inotify is not None:
+                fds.append(self.inotify.fd)
+            if self.server_socket is not None:
+                fds.append(self.server_socket)
+            readable, _, _ = select.select(fds, [], [], 1)
+            for fd in readable:
+                try:
+                    if fd is self.server_socket:
+                        self._check_control_socket()
+                    else:
+                        self._check_watches(self.inotify.read())
+                except Exception:
+                    logger.exception("Failed to check for job end")
+
+    def exit(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        if self.inotify is not None:
+            self.inotify.close()
+        if self.server_socket is not None:
+            self.server_socket.close()
+            os.unlink(self.control_socket)
+
+    @staticmethod
+    def send_finished(control_socket, jobid):
+        """Tell the collector listening on control_socket that jobid has finished"""
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.connect(control_socket)
+            sock.sendall(("finished %d\n" % jobid).encode("ascii"))
+
+
+class ScheduledCall:
+    """A function call in the Scheduler, repeated every interval if interval is set"""
+
+    __slots__ = ("function", "args", "interval", "cancelled")
+
+    def __init__(self, function, args=(), interval=None):
+        self.function = function
+        self.args = args
+        self.interval = interval
+        self.cancelled = False
+
+
+class Scheduler(threading.Thread):
+    """Calls functions from a single thread on deadlines aligned to the wall clock.
+
+    A function added with an interval is called at every multiple of the
+    interval (in seconds since epoch), so functions with the same interval
+    are called at the same time. Functions given to call() are called as
+    soon as possible.
+    """
+
+    def __init__(self, id="Scheduler"):
+        super(Scheduler, self).__init__()
+        self.id = id
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._exit = False
+
+        self.start()
+
+    @staticmethod
+    def next_deadline(interval, now=None):
+        """The first multiple of interval after now"""
+        if now is None:
+            now = time.time()
+        return (math.floor(now / interval) + 1) * interval
+
+    def _push(self, deadline, call):
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._counter), call))
+            self._cond.notify()
+
+    def add(self, function, interval):
+        """Call function every interval seconds, returns a handle for remove()"""
+        call = ScheduledCall(function, interval=interval)
+        self._push(self.next_deadline(interval), call)
+        return call
+
+    def remove(self, call):
+        """Stop calling a function added with add()"""
+        call.cancelled = True
+
+    def call(self, function, *args):
+        """Call function(*args) as soon as possible in the scheduler thread"""
+        self._push(0, ScheduledCall(function, args))
+
+    def call_wait(self, function, *args):
+        """Call function(*args) in the scheduler thread and wait for it to finish"""
+        if threading.current_thread() is self or not self.is_alive():
+            function(*args)
+            return
+        done = threading.Event()
+
+        def wrapper():
+            try:
+                function(*args)
+            finally:
+                done.set()
+
+        self.call(wrapper)
+        done.wait()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._exit:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    timeout = self._heap[0][0] - time.time()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if self._exit:
+                    break
+                deadline, _, call = heapq.heappop(self._heap)
+            if call.cancelled:
+                continue
+            try:
+                call.function(*call.args)
+            except Exception:
+                logger.exception("%s failed to call %s", self.id, call.function)
+            if call.interval and not call.cancelled:
+                # Ticks that has been missed are skipped.
+                self._push(self.next_deadline(call.interval, max(time.time(), deadline)), call)
+        logger.debug("%s is done", self.id)
+
+    def exit(self):
+        """Stop the scheduler, pending calls are dropped"""
+        logger.debug("%s got exit message", self.id)
+        with self._cond:
+            self._exit = True
+            self._cond.notify()
+        self.join()
+
+
+def _rusage_thread_time():
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+# CPU time of the calling thread, time.thread_time needs Python 3.7.
+thread_time = getattr(time, "thread_time", _rusage_thread_time)
+
+
+class Instrumentation:
+    """Number of calls and the wall and cpu time spent in them, and gauges, of a plugin"""
+
+    def __init__(self):
+        # name -> [calls, wall time, cpu time]
+        self.timings = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        """Measure the time spent in the with block as a call to name.
+        The cpu time is the time of the calling thread."""
+        wall = time.perf_counter()
+        cpu = thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, thread_time() - cpu)
+
+    def add(self, name, wall, cpu):
+        with self._lock:
+            timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += wall
+            timing[2] += cpu
+
+    def set(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def summary(self):
+        with self._lock:
+            summary = {name: {"calls": t[0], "wall": t[1], "cpu": t[2]} for name, t in self.timings.items()}
+            summary.update(self.gauges)
+        return summary
+
+    @staticmethod
+    def process():
+        """Resource usage of the collector process"""
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            with open("/proc/self/statm") as file:
+                rss = int(file.read().split()[1]) * resource.getpagesize()
+        except (OSError, ValueError, IndexError):
+            rss = None
+        return {
+            "user": usage.ru_utime,
+            "system": usage.ru_stime,
+            # ru_maxrss is in kilobytes.
+            "max_rss": usage.ru_maxrss * 1024,
+            "rss": rss,
+            "threads": threading.active_count(),
+        }
+
+
+class StartupProfile:
+    """Wall time of the startup phases of a program and the number of modules
+    each phase imported, reported in the style of python -X importtime.
+    A disabled profile measures nothing."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        # (depth, name, wall time, imported modules) in the order the phases ended.
+        self.phases = []
+        self._depth = 0
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        if not self.enabled:
+            yield
+            return
+        modules = len(sys.modules)
+        wall = time.perf_counter()
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            self.phases.append((self._depth, name, time.perf_counter() - wall, len(sys.modules) - modules))
+
+    @staticmethod
+    def process_age():
+        """Seconds since the process was started (including the interpreter startup) or None"""
+        try:
+            with open("/proc/self/stat") as file:
+                starttime = int(file.read().rsplit(")", 1)[1].split()[19])
+            with open("/proc/uptime") as file:
+                uptime = float(file.read().split()[0])
+        except (OSError, ValueError, IndexError):
+            return None
+        return uptime - starttime / os.sysconf(os.sysconf_names["SC_CLK_TCK"])
+
+    def report(self):
+        lines = ["startup: %10s | %7s | phase" % ("wall [us]", "modules")]
+        for depth, name, wall, modules in self.phases:
+            lines.append("startup: %10d | %7d | %s%s" % (wall * 1e6, modules, "  " * depth, name))
+        age = self.process_age()
+        if age is not None:
+            lines.append("startup: %10d | %7d | since process start" % (age * 1e6, len(sys.modules)))
+        return "\n".join(lines)
+
+
+class CPUBudget:
+    """Keeps the cpu usage of the collector process within percent of the wall time.
+
+    check() is called periodically and returns the throttle level. The level is
+    raised by one (up to max_level) for every check where the usage since the
+    previous check was above the budget and lowered by one when it was below
+    half of the budget, so it does not flap when throttling brings the usage
+    just under the budget.
+    """
+
+    def __init__(self, percent, max_level=3):
+        self.percent = percent
+        self.max_level = max_level
+        self.level = 0
+        # Periods of throttling, end is None while still throttled.
+        self.events = []
+        self._last = self._usage()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _usage():
+        times = os.times()
+        return time.monotonic(), times.user + times.system
+
+    def check(self):
+        wall, cpu = self._usage()
+        elapsed = wall - self._last[0]
+        if elapsed <= 0:
+            return self.level
+        usage = 100.0 * (cpu - self._last[1]) / elapsed
+        self._last = (wall, cpu)
+
+        level = self.level
+        if usage > self.percent:
+            level = min(self.max_level, level + 1)
+        elif usage < self.percent / 2:
+            level = max(0, level - 1)
+        if level != self.level:
+            logger.info("Collector cpu usage: %.2f%% (budget: %s%%), throttle level: %d", usage, self.percent, level)
+            now = time.time()
+            with self._lock:
+                if self.events and self.events[-1]["end"] is None:
+                    self.events[-1]["end"] = now
+                if level > 0:
+                    self.events.append({"start": now, "end": None, "level": level, "usage": usage})
+            self.level = level
+        return self.level
+
+    def summary(self, since=0):
+        """Budget and the throttle events that ended after since"""
+        now = time.time()
+        with self._lock:
+            events = [dict(e) for e in self.events if e["end"] is None or e["end"] > since]
+        return {
+            "cpu_budget_percent": self.percent,
+            "level": self.level,
+            "throttled_time": sum((e["end"] or now) - max(e["start"], since) for e in events),
+            "events": events,
+        }
+
+
 class ClassLoader:
     """Static class that loads an class by name"""
 
@@ -189,6 +867,18 @@ def createDaemon(umask=0, workdir="/", maxfds=1024):
     return 0
 
 
+def job_execs(data):
+    """The execs of sams.sampler.Software in data merged with the execs
+    of the short lived processes from sams.sampler.ProcessAccounting"""
+    execs = {exe: dict(info) for exe, info in data["sams.sampler.Software"]["execs"].items()}
+    for exe, info in data.get("sams.sampler.ProcessAccounting", {}).get("execs", {}).items():
+        if exe not in execs:
+            execs[exe] = {"user": 0.0, "system": 0.0}
+        execs[exe]["user"] += info["user"]
+        execs[exe]["system"] += info["system"]
+    return execs
+
+
 class JobSoftware:
     def __init__(self, jobid, recordid):
         self._softwares = []
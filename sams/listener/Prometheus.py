@@ -3,7 +3,7 @@ import re
 from typing import Dict, Iterable, List
 
 import sams.base
-from sams.core import Config
+from sams.core import Config, Option
 
 logger = logging.getLogger(__name__)
 
@@ -13,11 +13,19 @@ class Listener(sams.base.Listener):
     Listener for Prometheus output.
     """
 
+    OPTIONS = sams.base.Listener.OPTIONS + [
+        Option("static_map", {}, dict),
+        Option("map", {}, dict),
+        Option("metrics", {}, dict),
+        Option("self_metrics", False, bool),
+    ]
+
     def __init__(self, id: str, config: Config, samplers: List):
         super().__init__(id, config, samplers)
-        self.static_map = self.config.get([self.id, "static_map"], {})
-        self.map = self.config.get([self.id, "map"], {})
-        self.metrics = self.config.get([self.id, "metrics"], {})
+        self.static_map = self.options.static_map
+        self.map = self.options.map
+        self.metrics = self.options.metrics
+        self.self_metrics = self.options.self_metrics
 
     @staticmethod
     def _nested_getitem(dct: Dict, keys: Iterable) -> Dict:
@@ -54,7 +62,54 @@ class Listener(sams.base.Listener):
         for match_set in self._get_matching_entries(data):
             self._compile_data(data, compiled_data, *match_set)
         # Parse & encode compiled data into bytestring.
-        return self._get_bytestring(compiled_data)
+        data_bytestring = self._get_bytestring(compiled_data)
+        if self.self_metrics and self.self_stats is not None:
+            data_bytestring += self._get_self_bytestring(self.self_stats())
+        return data_bytestring
+
+    def _get_self_bytestring(self, stats: Dict) -> bytes:
+        """Formats the sams.collector.self data of the collector as sams_collector_* metrics."""
+        metrics = dict()
+
+        def add(name, kind, value, **labels):
+            if value is None:
+                return
+            labels = dict(self.static_map, jobid=self.job_id, **labels)
+            label_str = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+            metrics.setdefault((name, kind), []).append(f"{name}{{{label_str}}} {value}")
+
+        for kind, plugins in (("sampler", stats["samplers"]), ("output", stats["outputs"])):
+            for plugin, summary in plugins.items():
+                for key, value in summary.items():
+                    if isinstance(value, dict):
+                        add("sams_collector_calls_total", "counter", value["calls"], plugin=plugin, call=key)
+                        add("sams_collector_wall_seconds_total", "counter", value["wall"], plugin=plugin, call=key)
+                        add("sams_collector_cpu_seconds_total", "counter", value["cpu"], plugin=plugin, call=key)
+                    else:
+                        add(f"sams_collector_{key}", "gauge", value, plugin=plugin)
+        for plugin, samples in stats["samples"].items():
+            add("sams_collector_samples_total", "counter", samples, plugin=plugin)
+        for queue, queue_stats in stats["queues"].items():
+            add("sams_collector_queue_depth", "gauge", queue_stats["depth"], queue=queue)
+            add("sams_collector_queue_max_depth", "gauge", queue_stats["max_depth"], queue=queue)
+            add("sams_collector_queue_dropped_total", "counter", queue_stats["dropped"], queue=queue)
+            add("sams_collector_queue_coalesced_total", "counter", queue_stats["coalesced"], queue=queue)
+        process = stats["process"]
+        add("sams_collector_process_cpu_seconds_total", "counter", process["user"], mode="user")
+        add("sams_collector_process_cpu_seconds_total", "counter", process["system"], mode="system")
+        add("sams_collector_process_rss_bytes", "gauge", process["rss"])
+        add("sams_collector_process_max_rss_bytes", "gauge", process["max_rss"])
+        add("sams_collector_process_threads", "gauge", process["threads"])
+        if "snapshot" in stats:
+            add("sams_collector_snapshots_total", "counter", stats["snapshot"]["count"])
+            add("sams_collector_snapshot_seconds_total", "counter", stats["snapshot"]["cost"])
+
+        formatted_data = []
+        for (name, kind), lines in sorted(metrics.items()):
+            formatted_data.append(f"# HELP {name} SAMS collector instrumentation")
+            formatted_data.append(f"# TYPE {name} {kind}")
+            formatted_data.extend(lines)
+        return ("\n".join(formatted_data) + "\n").encode("utf-8")
 
     def _get_all_samples(self) -> Dict:
         """Returns compilation of all most recent samples
@@ -23,28 +23,57 @@ import logging
 import os
 import re
 import shutil
+import time
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
 
 class Loader(sams.base.Loader):
+    OPTIONS = sams.base.Loader.OPTIONS + [
+        Option("in_path", type=str, required=True),
+        Option("archive_path", type=str, required=True),
+        Option("error_path", type=str, required=True),
+        Option("file_pattern", "^.*$", str),
+        Option("partial_max_age", 0, (int, float)),
+    ]
+
     def __init__(self, id, config):
         super(Loader, self).__init__(id, config)
-        self.in_path = self.config.get([self.id, "in_path"])
-        self.archive_path = self.config.get([self.id, "archive_path"])
-        self.error_path = self.config.get([self.id, "error_path"])
-        self.file_pattern = re.compile(self.config.get([self.id, "file_pattern"], "^.*$"))
+        self.in_path = self.options.in_path
+        self.archive_path = self.options.archive_path
+        self.error_path = self.options.error_path
+        self.file_pattern = re.compile(self.options.file_pattern)
+        # Load checkpoint files (<file>.partial) that has not been updated for this
+        # many seconds and has no final file, 0 never loads them.
+        self.partial_max_age = self.options.partial_max_age
         self.files = []
         self.current_file = None
 
+    def _load_partial(self, root, file, files):
+        """Returns True if the checkpoint file is of a job that never finished cleanly"""
+        # Files starting with . are being written by sams.output.File.
+        if not self.partial_max_age or file.startswith(".") or file[: -len(".partial")] in files:
+            return False
+        try:
+            age = time.time() - os.stat(os.path.join(root, file)).st_mtime
+        except OSError:
+            return False
+        return age > self.partial_max_age
+
     def load(self):
         """Find files in in_path matching file_pattern"""
         for root, _, files in os.walk(self.in_path):
             for file in files:
                 logger.debug("Found file: %s", file)
-                if self.file_pattern.match(file):
+                name = file
+                if file.endswith(".partial"):
+                    if not self._load_partial(root, file, files):
+                        continue
+                    name = file[: -len(".partial")]
+                if self.file_pattern.match(name):
                     logger.debug("Add %s to files[]", os.path.join(root, file))
                     self.files.append({"file": file, "path": os.path.relpath(root, self.in_path)})
 
@@ -108,4 +137,11 @@ class Loader(sams.base.Loader):
             os.path.join(out_path, self.current_file["file"]),
         )
 
+        if not self.current_file["file"].endswith(".partial"):
+            # Drop the checkpoint of the job, it would otherwise be loaded once it is older than partial_max_age.
+            try:
+                os.unlink(os.path.join(self.in_path, self.current_file["path"], self.current_file["file"] + ".partial"))
+            except FileNotFoundError:
+                pass
+
         self.current_file = None
@@ -25,6 +25,7 @@ import subprocess
 from copy import deepcopy
 from tempfile import mkdtemp
 
+from sams.core import Option
 from sams.loader.File import Loader as File
 
 logger = logging.getLogger(__name__)
@@ -80,11 +81,14 @@ class SacctLoader:
 
 
 class Loader(File):
+    OPTIONS = File.OPTIONS + [
+        Option("sacct", "/usr/bin/sacct", str),
+        Option("environment", {}, dict),
+    ]
+
     def __init__(self, id, config):
         super(Loader, self).__init__(id, config)
-        sacct_bin = self.config.get([self.id, "sacct"], "/usr/bin/sacct")
-        sacct_env = self.config.get([self.id, "environment"], {})
-        self.sacct = SacctLoader(sacct_bin, sacct_env)
+        self.sacct = SacctLoader(self.options.sacct, self.options.environment)
         self.updated_data = None
 
     def next(self):
@@ -50,6 +50,7 @@ import socket
 import time
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
@@ -57,15 +58,21 @@ logger = logging.getLogger(__name__)
 class Output(sams.base.Output):
     """File output Class"""
 
+    OPTIONS = sams.base.Output.OPTIONS + [
+        Option("static_map", {}, dict),
+        Option("map", {}, dict),
+        Option("metrics", {}, dict),
+        Option("server", "localhost", str),
+        Option("port", 2003, int),
+        Option("servers", ["localhost:2003"], list),
+    ]
+
     def __init__(self, id, config):
         super(Output, self).__init__(id, config)
-        self.static_map = self.config.get([self.id, "static_map"], {})
-        self.map = self.config.get([self.id, "map"], {})
-        self.metrics = self.config.get([self.id, "metrics"], {})
-        server = self.config.get([self.id, "server"], "localhost")
-        port = self.config.get([self.id, "port"], 2003)
-        self.servers = self.config.get([self.id, "servers"], ["localhost:2003"])
-        self.servers.append("%s:%d" % (server, port))
+        self.static_map = self.options.static_map
+        self.map = self.options.map
+        self.metrics = self.options.metrics
+        self.servers = self.options.servers + ["%s:%d" % (self.options.server, self.options.port)]
         self.data = {}
 
         # UDP Socket
@@ -46,6 +46,7 @@ import socket
 import time
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
@@ -53,12 +54,19 @@ logger = logging.getLogger(__name__)
 class Output(sams.base.Output):
     """File output Class"""
 
+    OPTIONS = sams.base.Output.OPTIONS + [
+        Option("static_map", {}, dict),
+        Option("map", {}, dict),
+        Option("metrics", {}, dict),
+        Option("socket", "/run/collectd.socket", str),
+    ]
+
     def __init__(self, id, config):
         super(Output, self).__init__(id, config)
-        self.static_map = self.config.get([self.id, "static_map"], {})
-        self.map = self.config.get([self.id, "map"], {})
-        self.metrics = self.config.get([self.id, "metrics"], {})
-        self.socket = self.config.get([self.id, "socket"], "/run/collectd.socket")
+        self.static_map = self.options.static_map
+        self.map = self.options.map
+        self.metrics = self.options.metrics
+        self.socket = self.options.socket
         self.data = {}
 
     def dict2str(self, dct, base=""):
@@ -33,6 +33,11 @@ sams.output.File:
 
   # Skip the list of modules.
   exclude: ['sams.sampler.ModuleName']
+
+  # Write the data so far to <file>.partial this often (in seconds),
+  # 0 disables, defaults to checkpoint_interval in the common section.
+  # Requires checkpoint_interval on the samplers.
+  checkpoint_interval: 0
 """
 
 import json
@@ -40,6 +45,7 @@ import logging
 import os
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
@@ -47,10 +53,23 @@ logger = logging.getLogger(__name__)
 class Output(sams.base.Output):
     """File output Class"""
 
+    OPTIONS = sams.base.Output.OPTIONS + [
+        Option("base_path", "/tmp", str),
+        Option("file_pattern", "%(jobid)s.%(node)s.json", str),
+        Option("jobid_hash_size", None, int),
+        Option("exclude", [], list),
+        Option("jobid", 0, int, path=["options", "jobid"]),
+        Option("node", 0, str, path=["options", "node"]),
+    ]
+
     def __init__(self, id, config):
         super(Output, self).__init__(id, config)
-        self.exclude = dict((e, True) for e in self.config.get([self.id, "exclude"], []))
+        self.exclude = dict((e, True) for e in self.options.exclude)
         self.data = {}
+        # Latest checkpoint data of the samplers, written over data in the partial file.
+        self.checkpoints = {}
+        # Content of the partial file, None until a checkpoint has been written.
+        self.written = None
 
     def store(self, data):
         for k, v in data.items():
@@ -58,18 +77,20 @@ class Output(sams.base.Output):
                 continue
             self.data[k] = v
 
-    def write(self):
-        base_path = self.config.get([self.id, "base_path"], "/tmp")
-        file_pattern = self.config.get([self.id, "file_pattern"], "%(jobid)s.%(node)s.json")
-        jobid = self.config.get(["options", "jobid"], 0)
-        node = self.config.get(["options", "node"], 0)
-        jobid_hash_size = self.config.get([self.id, "jobid_hash_size"])
+    def checkpoint(self, data):
+        for k, v in data.items():
+            if k in self.exclude:
+                continue
+            self.checkpoints[k] = v
+            self.checkpoint_dirty = True
 
-        filename = file_pattern % {"jobid": jobid, "node": node}
-        tfilename = ".%s" % filename
+    def _path(self):
+        """Directory and name of the output file"""
+        base_path = self.options.base_path
+        filename = self.options.file_pattern % {"jobid": self.options.jobid, "node": self.options.node}
 
-        if jobid_hash_size is not None:
-            base_path = os.path.join(base_path, str(int(jobid / jobid_hash_size)))
+        if self.options.jobid_hash_size is not None:
+            base_path = os.path.join(base_path, str(int(self.options.jobid / self.options.jobid_hash_size)))
 
             if not os.path.isdir(base_path):
                 try:
@@ -79,9 +100,15 @@ class Output(sams.base.Output):
                     if not os.path.isdir(base_path):
                         assert False, "Failed to makedirs '%s' " % base_path
 
+        return base_path, filename
+
+    @staticmethod
+    def _write(base_path, filename, data):
+        """Write data to filename atomically, returns True on success"""
+        tfilename = ".%s" % filename
         try:
             with open(os.path.join(base_path, tfilename), "w") as file:
-                file.write(json.dumps(self.data, sort_keys=True, separators=(",", ":")))
+                file.write(json.dumps(data, sort_keys=True, separators=(",", ":")))
             os.rename(os.path.join(base_path, tfilename), os.path.join(base_path, filename))
         except Exception:
             logger.debug("Failed to write file")
@@ -89,3 +116,25 @@ class Output(sams.base.Output):
                 os.unlink(os.path.join(base_path, tfilename))
             except Exception:
                 logger.error("Failed to unlink tmp file")
+            return False
+        return True
+
+    def write_checkpoint(self):
+        base_path, filename = self._path()
+        data = dict(self.data)
+        data.update(self.checkpoints)
+        if self._write(base_path, filename + ".partial", data):
+            self.written = data
+
+    def write(self):
+        base_path, filename = self._path()
+        if self.written is not None:
+            # The final file is the last checkpoint, which is only rewritten if the
+            # final data differs from it, so the end of the job is mostly a rename.
+            if self.data == self.written or self._write(base_path, filename + ".partial", self.data):
+                try:
+                    os.replace(os.path.join(base_path, filename + ".partial"), os.path.join(base_path, filename))
+                    return
+                except OSError as e:
+                    logger.warning("Failed to rename the checkpoint of %s: %s", filename, e)
+        self._write(base_path, filename, self.data)
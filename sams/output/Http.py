@@ -39,6 +39,16 @@ sams.output.Http:
 
   # Skip the list of modules.
   exclude: ['sams.sampler.ModuleName']
+
+  # Post the data so far to checkpoint_uri this often (in seconds),
+  # 0 disables, defaults to checkpoint_interval in the common section.
+  # Requires checkpoint_interval on the samplers.
+  checkpoint_interval: 0
+
+  # uri to write checkpoints to, same replacements as uri. The final
+  # data is posted as a delta of the last checkpoint, which is merged
+  # by sams-post-receiver if checkpoint_uri is uri + ".partial".
+  checkpoint_uri: "https://etui.hpc2n.umu.se:8443/%(jobid_hash)d/%(jobid)s.%(node)s.yaml.partial"
 """
 
 import json
@@ -47,6 +57,7 @@ import logging
 import requests
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
@@ -54,10 +65,27 @@ logger = logging.getLogger(__name__)
 class Output(sams.base.Output):
     """http/https output Class"""
 
+    OPTIONS = sams.base.Output.OPTIONS + [
+        Option("uri", type=str, required=True),
+        Option("checkpoint_uri", None, str),
+        Option("jobid_hash_size", 1000, int),
+        Option("key_file", None, str),
+        Option("cert_file", None, str),
+        Option("username", None, str),
+        Option("password", None, str),
+        Option("exclude", [], list),
+        Option("jobid", 0, int, path=["options", "jobid"]),
+        Option("node", 0, str, path=["options", "node"]),
+    ]
+
     def __init__(self, id, config):
         super(Output, self).__init__(id, config)
-        self.exclude = dict((e, True) for e in self.config.get([self.id, "exclude"], []))
+        self.exclude = dict((e, True) for e in self.options.exclude)
         self.data = {}
+        # Latest checkpoint data of the samplers, posted over data as a checkpoint.
+        self.checkpoints = {}
+        # Data of the last checkpoint that was received, None until one has been posted.
+        self.posted = None
 
     def store(self, data):
         for k, v in data.items():
@@ -66,17 +94,41 @@ class Output(sams.base.Output):
             logger.debug("Store data for: %s => %s", k, v)
             self.data[k] = v
 
+    def checkpoint(self, data):
+        for k, v in data.items():
+            if k in self.exclude:
+                continue
+            self.checkpoints[k] = v
+            self.checkpoint_dirty = True
+
+    def write_checkpoint(self):
+        in_uri = self.options.checkpoint_uri or self.options.uri + ".partial"
+        data = dict(self.data)
+        data.update(self.checkpoints)
+        if self._post(in_uri, data):
+            self.posted = data
+            return True
+        return False
+
     def write(self):
-        in_uri = self.config.get([self.id, "uri"])
-        jobid = self.config.get(["options", "jobid"], 0)
-        node = self.config.get(["options", "node"], 0)
-        jobid_hash_size = self.config.get([self.id, "jobid_hash_size"])
-        cert_file = self.config.get([self.id, "cert_file"])
-        key_file = self.config.get([self.id, "key_file"])
-        username = self.config.get([self.id, "username"])
-        password = self.config.get([self.id, "password"])
-
-        jobid_hash = int(jobid / jobid_hash_size)
+        if self.posted is not None:
+            # Only post what changed since the last checkpoint, the receiver merges it
+            # into the checkpoint. Falls back to all data if the receiver can not.
+            delta = {k: v for k, v in self.data.items() if k not in self.posted or self.posted[k] != v}
+            if self._post(self.options.uri, delta, delta=True):
+                return True
+            logger.info("The checkpoint delta was not accepted, sending all data")
+        return self._post(self.options.uri, self.data)
+
+    def _post(self, in_uri, data, delta=False):
+        jobid = self.options.jobid
+        node = self.options.node
+        cert_file = self.options.cert_file
+        key_file = self.options.key_file
+        username = self.options.username
+        password = self.options.password
+
+        jobid_hash = int(jobid / self.options.jobid_hash_size)
         uri = in_uri % {"jobid": jobid, "node": node, "jobid_hash": jobid_hash}
 
         requests_kwargs = {}
@@ -92,7 +144,9 @@ class Output(sams.base.Output):
             requests_kwargs["cert"] = (cert_file, key_file)
 
         headers = {"Content-Type": "application/json"}
-        body = json.dumps(self.data, sort_keys=True, separators=(",", ":"))
+        if delta:
+            headers["X-SAMS-Checkpoint-Delta"] = "1"
+        body = json.dumps(data, sort_keys=True, separators=(",", ":"))
 
         logger.debug("Sending data to: %s", uri)
         response = requests.post(uri, data=body, headers=headers, **requests_kwargs)
@@ -46,6 +46,7 @@ import os
 import re
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
@@ -53,13 +54,21 @@ logger = logging.getLogger(__name__)
 class Output(sams.base.Output):
     """File output Class"""
 
+    OPTIONS = sams.base.Output.OPTIONS + [
+        Option("static_map", {}, dict),
+        Option("map", {}, dict),
+        Option("metrics", {}, dict),
+        Option("path", "/var/lib/prometheus/node-exporter/slurm_%(jobid)s.prom", str),
+        Option("jobid", 0, int, path=["options", "jobid"]),
+    ]
+
     def __init__(self, id, config):
         super(Output, self).__init__(id, config)
-        self.static_map = self.config.get([self.id, "static_map"], {})
-        self.map = self.config.get([self.id, "map"], {})
-        self.metrics = self.config.get([self.id, "metrics"], {})
-        self.path = self.config.get([self.id, "path"], "/var/lib/prometheus/node-exporter/slurm_%(jobid)s.prom")
-        self.jobid = self.config.get(["options", "jobid"], 0)
+        self.static_map = self.options.static_map
+        self.map = self.options.map
+        self.metrics = self.options.metrics
+        self.path = self.options.path
+        self.jobid = self.options.jobid
 
         self.output_file = self.path % dict(jobid=self.jobid)
 
@@ -86,6 +95,21 @@ class Output(sams.base.Output):
         return dct
 
     def store(self, data):
+        self._store(data)
+        self.write_prom()
+
+    def store_batch(self, batch):
+        """Store all messages in the batch and write the prom file once"""
+        for data in batch:
+            if data.get("type") == "checkpoint":
+                continue
+            try:
+                self._store({data["id"]: data["data"]})
+            except Exception:
+                logger.exception("Failed to store")
+        self.write_prom()
+
+    def _store(self, data):
         logger.debug("store: %s", data)
         for k, v in data.items():
             self.data[k] = v
@@ -98,8 +122,6 @@ class Output(sams.base.Output):
                 if m:
                     self.save(d["value"], destination, m.groupdict())
 
-        self.write_prom()
-
     def write_prom(self):
         if not self.promdata:
             logger.debug("Nothing to write")
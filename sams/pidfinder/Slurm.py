@@ -24,67 +24,206 @@ sams.pidfinder.Slurm:
     # How long to wait (in seconds) after process was removed.
     grace_period: 600
 
+    # Root of the proc file system (defaults to common/procdir or /proc)
+    procdir: /proc
+
+    # How to find the pids of the job.
+    # proc: scan every pid in /proc and check its cpuset.
+    # cgroup: read cgroup.procs of the job cgroup. Falls back to
+    #         scanning /proc until the job cgroup can be found.
+    method: proc
+
+    # Base path of the cgroup file system (only used by method: cgroup)
+    cgroup_base: /sys/fs/cgroup
+
+    # Path(s) to the job cgroup relative to cgroup_base
+    # (can use %(jobid)s and 'glob'). The first existing path is used.
+    cgroup_paths:
+      - system.slice/slurmstepd.scope/job_%(jobid)s
+      - cpuset/slurm/uid_*/job_%(jobid)s
+      - freezer/slurm/uid_*/job_%(jobid)s
+
 """
 
+import glob
 import logging
 import os
 import re
 import time
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
 
-class Pids:
-    def __init__(self, pid, jobid):
-        self._pid = pid
-        self.jobid = jobid
-        self.injob = self.check_job()
-        self.update()
+CGROUP_PATHS = [
+    "system.slice/slurmstepd.scope/job_%(jobid)s",
+    "cpuset/slurm/uid_*/job_%(jobid)s",
+    "freezer/slurm/uid_*/job_%(jobid)s",
+]
 
-    def update(self):
-        self.last_seen = time.time()
 
-    def check_job(self):
-        try:
-            with open("/proc/%d/cpuset" % self._pid) as file:
-                cpuset = file.read()
-                m = re.search(r"/job_([0-9]+)/", cpuset)
-                if m:
-                    if int(m.group(1)) == self.jobid:
-                        return True
-        except Exception:
-            pass
-
-        # This pid is not within the Slurm CGroup.
-        return False
+class PIDFinder(sams.base.PIDFinder):
+    """Finds the pids of jobid or, if jobid is None, of all jobs on the node"""
 
+    OPTIONS = sams.base.PIDFinder.OPTIONS + [
+        Option("grace_period", 600, (int, float)),
+        Option("method", "proc", str, choices=["proc", "cgroup"]),
+        Option("cgroup_base", "/sys/fs/cgroup", str),
+        Option("cgroup_paths", CGROUP_PATHS, list),
+    ]
 
-class PIDFinder(sams.base.PIDFinder):
     def __init__(self, id, jobid, config):
         super(PIDFinder, self).__init__(id, jobid, config)
+        # pid -> (jobid, starttime), jobid is None for pids that are not part of a (watched) job.
         self.processes = {}
-        self.procdir = "/proc"
         self.create_time = time.time()
+        self.last_seen = {}
+        self.method = self.options.method
+        self.cgroup_base = self.options.cgroup_base
+        self.cgroup_paths = self.options.cgroup_paths
+        self.cgroups = {}
+
+    def _get_cgroups(self):
+        """Find the cgroup directories of the job(s).
+
+        For a single job the directory is kept once found. For all jobs
+        on the node the directories are searched for every time.
+        """
+        if self.jobid is not None and self.jobid in self.cgroups:
+            return True
+        cgroups = {}
+        for path in self.cgroup_paths:
+            pattern = path % {"jobid": "*" if self.jobid is None else self.jobid}
+            for cgroup in glob.glob(os.path.join(self.cgroup_base, pattern)):
+                m = re.search(r"job_([0-9]+)$", cgroup)
+                if m and int(m.group(1)) not in cgroups and os.path.isdir(cgroup):
+                    cgroups[int(m.group(1))] = cgroup
+        self.cgroups = cgroups
+        if self.jobid is None:
+            return True
+        if self.jobid in self.cgroups:
+            logger.debug("Found cgroup: %s for jobid: %d", self.cgroups[self.jobid], self.jobid)
+            return True
+        logger.debug("No cgroup found for jobid: %d, scanning %s", self.jobid, self.procdir)
+        return False
 
-    def find(self):
-        pids = filter(lambda f: re.match(r"^\d+$", f), os.listdir(self.procdir))
-        pids = map(int, pids)
-
-        new_pids = []
+    @staticmethod
+    def _cgroup_pids(cgroup):
+        """Read the pids from cgroup.procs in the cgroup and its children"""
+        pids = set()
+        for root, _, files in os.walk(cgroup):
+            if "cgroup.procs" not in files:
+                continue
+            try:
+                with open(os.path.join(root, "cgroup.procs")) as file:
+                    pids.update(int(pid) for pid in file.read().split())
+            except OSError:
+                # The cgroup was removed during the walk.
+                pass
+        return pids
+
+    def _proc_pids(self):
+        """All pids on the node"""
+        return map(int, filter(lambda f: re.match(r"^\d+$", f), os.listdir(self.procdir)))
+
+    def _starttime(self, pid):
+        """Start time (in clock ticks after boot) of pid from /proc/<pid>/stat"""
+        try:
+            with open("%s/%d/stat" % (self.procdir, pid), "rb") as file:
+                stat = file.read()
+            # Field 22, counted after the ")" that ends the comm field.
+            return int(stat[stat.rindex(b")") + 2 :].split(b" ", 20)[19])
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _get_jobid(self, pid):
+        """Jobid of pid from the Slurm cpuset or None"""
+        try:
+            with open("%s/%d/cpuset" % (self.procdir, pid)) as file:
+                cpuset = file.read()
+                m = re.search(r"/job_([0-9]+)/", cpuset)
+                if m:
+                    jobid = int(m.group(1))
+                    if self.jobid is None or jobid == self.jobid:
+                        return jobid
+        except Exception:
+            pass
 
-        for pid in pids:
-            if pid not in self.processes.keys():
-                self.processes[pid] = Pids(pid, self.jobid)
-                if self.processes[pid].injob:
-                    new_pids.append(pid)
-            self.processes[pid].update()
+        # This pid is not within a (watched) Slurm CGroup.
+        return None
+
+    def find_jobs(self):
+        """Returns a dict with the new pids of each job"""
+        if self.method == "cgroup" and self._get_cgroups():
+            pids = {}
+            for jobid, cgroup in self.cgroups.items():
+                pids.update(dict.fromkeys(self._cgroup_pids(cgroup), jobid))
+        else:
+            pids = dict.fromkeys(self._proc_pids())
+
+        new_pids = {}
+        processes = {}
+        now = time.time()
+
+        for pid, jobid in pids.items():
+            known = self.processes.get(pid)
+            starttime = None
+            if known is not None and (jobid is None or known[0] is not None):
+                # Known pids are checked for reuse with a new starttime, also
+                # the ones that are not part of a job.
+                starttime = self._starttime(pid)
+                if starttime is None:
+                    # The pid has already disappeared.
+                    continue
+                if starttime == known[1]:
+                    processes[pid] = known
+                    if known[0] is not None:
+                        self.last_seen[known[0]] = now
+                    continue
+            if jobid is None:
+                jobid = self._get_jobid(pid)
+            if starttime is None:
+                starttime = self._starttime(pid)
+                if starttime is None:
+                    continue
+            if jobid is None:
+                processes[pid] = (None, starttime)
+                continue
+            # New pid or a reused pid with a new starttime.
+            new_pids.setdefault(jobid, []).append(pid)
+            processes[pid] = (jobid, starttime)
+            self.last_seen[jobid] = now
+
+        # Pids that have disappeared are dropped.
+        self.processes = processes
 
         return new_pids
 
-    def done(self):
-        procs = list(filter(lambda p: p.injob, self.processes.values()))
-        if not procs:
-            return self.create_time < time.time() - self.config.get([self.id, "grace_period"], 600)
-        return max(p.last_seen for p in procs) < time.time() - self.config.get([self.id, "grace_period"], 600)
+    def find(self):
+        return self.find_jobs().get(self.jobid, [])
+
+    def jobs(self):
+        """Jobs that have been seen and not forgotten"""
+        return list(self.last_seen.keys())
+
+    def forget(self, jobid):
+        """Stop tracking a job that has been handled"""
+        self.last_seen.pop(jobid, None)
+
+    def cgroup_events(self, jobid=None):
+        if jobid is None:
+            jobid = self.jobid
+        if jobid not in self.cgroups:
+            return None
+        path = os.path.join(self.cgroups[jobid], "cgroup.events")
+        if os.path.exists(path):
+            return path
+        return None
+
+    def done(self, jobid=None):
+        if jobid is None:
+            jobid = self.jobid
+        last_seen = self.last_seen.get(jobid, self.create_time)
+        return last_seen < time.time() - self.options.grace_period
@@ -0,0 +1,247 @@
+"""
+Snapshot of /proc information for the pids of a job
+
+SAMS Software accounting
+Copyright (C) 2018-2021  Swedish National Infrastructure for Computing (SNIC)
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import errno
+import logging
+import os
+import resource
+import threading
+import time
+from array import array
+from collections import namedtuple
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+# Errors that means that the process or task has exited.
+EXITED = (errno.ENOENT, errno.ESRCH)
+
+# stat is the tuple of fields in /proc/<pid>/stat after the comm field,
+# stat[0] is field 3 (state). Use stat_field() to get a field by number.
+ProcInfo = namedtuple("ProcInfo", ["pid", "stat", "cgroup", "cpuset", "tasks"])
+
+
+def parse_stat(data):
+    """Returns the fields after the comm field of a /proc/<pid>/stat line"""
+    return tuple(data[data.rindex(")") + 2 :].split())
+
+
+def stat_field(info, field):
+    """Field number field (as in proc(5)) from a ProcInfo"""
+    return info.stat[field - 3]
+
+
+class ProcSnapshot:
+    """Immutable view of the /proc information of a set of pids at one instant"""
+
+    def __init__(self, sample_time, processes, gone, cost):
+        self.time = sample_time
+        self.processes = MappingProxyType(processes)
+        # Pids that were part of the snapshot but no longer exists.
+        self.gone = frozenset(gone)
+        # Wall time (in seconds) it took to read the snapshot.
+        self.cost = cost
+
+    @property
+    def tasks(self):
+        """Number of tasks in the snapshot"""
+        return sum(len(p.tasks) for p in self.processes.values())
+
+    def __len__(self):
+        return len(self.processes)
+
+    def get(self, pid):
+        """ProcInfo of pid or None if pid is not part of the snapshot"""
+        return self.processes.get(pid)
+
+    @staticmethod
+    def _read(path):
+        with open(path) as file:
+            return file.read()
+
+    @classmethod
+    def take(cls, pids, procdir="/proc"):
+        """Read stat, cgroup, cpuset and the task list of every pid once"""
+        start = time.time()
+        processes = {}
+        gone = []
+        for pid in pids:
+            base = "%s/%d" % (procdir, pid)
+            try:
+                stat = parse_stat(cls._read(base + "/stat"))
+                tasks = tuple(int(t) for t in os.listdir(base + "/task"))
+            except (OSError, ValueError):
+                gone.append(pid)
+                continue
+            try:
+                cgroup = cls._read(base + "/cgroup")
+            except OSError:
+                cgroup = None
+            try:
+                cpuset = cls._read(base + "/cpuset")
+            except OSError:
+                cpuset = None
+            processes[pid] = ProcInfo(pid, stat, cgroup, cpuset, tasks)
+        return cls(start, processes, gone, time.time() - start)
+
+
+class FDBudget:
+    """Number of files that all StatReaders together may keep open.
+
+    Half of the soft RLIMIT_NOFILE, the rest is left for the outputs,
+    sockets and files that are only open while read.
+    """
+
+    def __init__(self, limit=None):
+        if limit is None:
+            soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+            limit = soft // 2 if soft != resource.RLIM_INFINITY else 65536
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.used -= 1
+
+
+# Shared by all StatReaders of the process.
+fd_budget = FDBudget()
+
+
+class StatReader:
+    """Reads fields from /proc stat files.
+
+    The files are kept open (up to max_open of them, and as long as the
+    process wide fd_budget allows) and re-read from the start with pread
+    (os.preadv needs Python 3.7). Errors other than the task having
+    exited (EMFILE etc) are raised, the task is still running.
+    """
+
+    def __init__(self, procdir="/proc", max_open=512, bufsize=1024):
+        self.procdir = procdir
+        self.max_open = max_open
+        self.bufsize = bufsize
+        self.fds = {}
+
+    def _path(self, key):
+        if isinstance(key, tuple):
+            return "%s/%d/task/%d/stat" % (self.procdir, key[0], key[1])
+        return "%s/%d/stat" % (self.procdir, key)
+
+    def read_cpu(self, key):
+        """Returns (utime, stime) in clock ticks (fields 14 and 15) or
+        None if the stat file can not be read (the task has exited).
+
+        key is pid for /proc/<pid>/stat or (pid, tid) for /proc/<pid>/task/<tid>/stat.
+        """
+        data = self._pread(key)
+        if not data:
+            return None
+        # The comm field can contain spaces and ")", fields are counted after the last ")".
+        fields = data[data.rindex(b")") + 2 :].split(b" ", 13)
+        return int(fields[11]), int(fields[12])
+
+    def read_stat(self, key):
+        """Returns (ppid, utime, stime, cutime, cstime), fields 4 and 14-17
+        with the times in clock ticks, or None if the stat file can not be read.
+        """
+        data = self._pread(key)
+        if not data:
+            return None
+        fields = data[data.rindex(b")") + 2 :].split(b" ", 15)
+        return int(fields[1]), int(fields[11]), int(fields[12]), int(fields[13]), int(fields[14])
+
+    def _pread(self, key):
+        """Content of the stat file, b"" if the task has exited"""
+        fd = self.fds.get(key)
+        keep = True
+        if fd is None:
+            try:
+                fd = os.open(self._path(key), os.O_RDONLY | os.O_CLOEXEC)
+            except OSError as err:
+                if err.errno in EXITED:
+                    return b""
+                raise
+            keep = len(self.fds) < self.max_open and fd_budget.acquire()
+            if keep:
+                self.fds[key] = fd
+        try:
+            data = os.pread(fd, self.bufsize, 0)
+        except OSError as err:
+            if err.errno not in EXITED:
+                if not keep:
+                    os.close(fd)
+                raise
+            data = b""
+        if not keep:
+            os.close(fd)
+        elif not data:
+            self.close(key)
+        return data
+
+    def close(self, key):
+        fd = self.fds.pop(key, None)
+        if fd is not None:
+            os.close(fd)
+            fd_budget.release()
+
+    def close_all(self, keys=None):
+        """Close all open files, or the ones in keys"""
+        for key in list(self.fds.keys()) if keys is None else list(keys):
+            self.close(key)
+
+
+class TaskCounters:
+    """Per-task user/system cpu time stored in a flat array('d')"""
+
+    __slots__ = ("index", "values")
+
+    def __init__(self):
+        # tid -> offset of the user value in values, system is at offset + 1.
+        self.index = {}
+        self.values = array("d")
+
+    def set(self, tid, user, system):
+        offset = self.index.get(tid)
+        if offset is None:
+            offset = len(self.values)
+            self.index[tid] = offset
+            self.values.append(user)
+            self.values.append(system)
+        else:
+            self.values[offset] = user
+            self.values[offset + 1] = system
+
+    def user(self):
+        return sum(self.values[0::2])
+
+    def system(self):
+        return sum(self.values[1::2])
+
+    def __len__(self):
+        return len(self.index)
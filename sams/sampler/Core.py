@@ -33,11 +33,17 @@ Output:
 import logging
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
 
 class Sampler(sams.base.Sampler):
+    OPTIONS = sams.base.Sampler.OPTIONS + [
+        Option("jobid", None, int, path=["options", "jobid"]),
+        Option("node", None, str, path=["options", "node"]),
+    ]
+
     def __init__(self, id, outQueue, config):
         super(Sampler, self).__init__(id, outQueue, config)
         self.core = {}
@@ -45,8 +51,8 @@ class Sampler(sams.base.Sampler):
     def init(self):
         logger.debug("init()")
         self.core = {
-            "jobid": self.config.get(["options", "jobid"]),
-            "node": self.config.get(["options", "node"]),
+            "jobid": self.options.jobid,
+            "node": self.options.node,
         }
         self._most_recent_sample = [self._storage_wrapping(self.core)]
         self.store(self.core)
@@ -57,5 +63,8 @@ class Sampler(sams.base.Sampler):
     def sample(self):
         logger.debug("sample()")
 
+    def checkpoint_data(self):
+        return self.core
+
     def final_data(self):
         return self.core
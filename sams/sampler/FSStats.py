@@ -43,6 +43,7 @@ import logging
 import os
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
@@ -68,15 +69,16 @@ class FSStats:
 
 
 class Sampler(sams.base.Sampler):
+    OPTIONS = sams.base.Sampler.OPTIONS + [
+        Option("mount_points", type=list, required=True),
+        Option("jobid", 0, int, path=["options", "jobid"]),
+    ]
+
     def __init__(self, id, outQueue, config):
         super(Sampler, self).__init__(id, outQueue, config)
         self.processes = {}
-        self.sampler_interval = self.config.get([self.id, "sampler_interval"], 60)
-        self.mount_points = self.config.get([self.id, "mount_points"])
-        self.jobid = self.config.get(["options", "jobid"], 0)
-
-        if not self.mount_points:
-            raise sams.base.SamplerException("mount_points not configured")
+        self.mount_points = self.options.mount_points
+        self.jobid = self.options.jobid
 
         mps = []
         for mp in self.mount_points:
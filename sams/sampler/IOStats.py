@@ -1,5 +1,5 @@
 """
-Fetches Metrics from iostat command
+Fetches Metrics from /proc/diskstats or the iostat command
 
 SAMS Software accounting
 Copyright (C) 2018-2021  Swedish National Infrastructure for Computing (SNIC)
@@ -25,7 +25,14 @@ sams.sampler.IOStats:
     # in seconds
     sampler_interval: 30
 
-    # Path to iostat command
+    # Where the statistics are read from.
+    # diskstats: read /proc/diskstats every sample and compute the
+    #            statistics from the difference to the previous sample.
+    # iostat: run iostat -xy in the background (one process and one
+    #         thread per job), the headers depend on the sysstat version.
+    backend: iostat
+
+    # Path to iostat command (only used by backend: iostat)
     iostat_command: /usr/bin/iostat
 
     # path(s) to devices to check (can use %(jobid)s and 'glob')
@@ -58,13 +65,70 @@ import os
 import queue
 import subprocess
 import threading
+import time
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
 COMMAND = """%(iostat_command)s -xy -p %(devices)s %(interval)s"""
 
+SECTOR_SIZE = 512
+
+
+def parse_diskstats(data, names):
+    """Counters (fields 4-14 of /proc/diskstats) of the devices in names"""
+    counters = {}
+    for line in data.splitlines():
+        fields = line.split()
+        if len(fields) >= 14 and fields[2] in names:
+            counters[fields[2]] = tuple(int(f) for f in fields[3:14])
+    return counters
+
+
+def diskstats_delta(old, new, elapsed):
+    """The iostat -x statistics of a device from two diskstats counters elapsed seconds apart"""
+    (r, rrqm, rsect, rms, w, wrqm, wsect, wms, _, io_ms, weighted_ms) = [n - o for n, o in zip(new, old)]
+    ios = r + w
+    return {
+        "rrqm_s": "%.2f" % (rrqm / elapsed),
+        "wrqm_s": "%.2f" % (wrqm / elapsed),
+        "r_s": "%.2f" % (r / elapsed),
+        "w_s": "%.2f" % (w / elapsed),
+        "rkB_s": "%.2f" % (rsect * SECTOR_SIZE / 1024 / elapsed),
+        "wkB_s": "%.2f" % (wsect * SECTOR_SIZE / 1024 / elapsed),
+        "avgrq-sz": "%.2f" % ((rsect + wsect) / ios if ios else 0.0),
+        "avgqu-sz": "%.2f" % (weighted_ms / 1000 / elapsed),
+        "await": "%.2f" % ((rms + wms) / ios if ios else 0.0),
+        "r_await": "%.2f" % (rms / r if r else 0.0),
+        "w_await": "%.2f" % (wms / w if w else 0.0),
+        "svctm": "%.2f" % (io_ms / ios if ios else 0.0),
+        "util": "%.2f" % min(io_ms / 10 / elapsed, 100.0),
+    }
+
+
+class DiskStats:
+    """Computes the iostat -x statistics of devices from /proc/diskstats"""
+
+    def __init__(self, path, device_map):
+        self.path = path
+        # kernel name (dm-20) -> configured path of the device
+        self.names = {os.path.basename(rp): dev for rp, dev in device_map.items()}
+        self.last = None
+        self.last_time = None
+
+    def read(self):
+        """Returns a list of {device: statistics} since the previous read, empty on the first read"""
+        with open(self.path) as file:
+            counters = parse_diskstats(file.read(), self.names)
+        now = time.monotonic()
+        last, last_time = self.last, self.last_time
+        self.last, self.last_time = counters, now
+        if last is None or now <= last_time:
+            return []
+        return [{self.names[name]: diskstats_delta(last[name], new, now - last_time)} for name, new in counters.items() if name in last]
+
 
 class IOStats(threading.Thread):
     def __init__(self, devices, t, command, device_map):
@@ -113,18 +177,25 @@ class IOStats(threading.Thread):
 
 
 class Sampler(sams.base.Sampler):
+    OPTIONS = sams.base.Sampler.OPTIONS + [
+        Option("backend", "iostat", str, choices=["diskstats", "iostat"]),
+        Option("iostat_command", "/usr/bin/iostat", str),
+        Option("iostat_devs", type=list, required=True),
+        Option("jobid", 0, int, path=["options", "jobid"]),
+    ]
+
     def __init__(self, id, outQueue, config):
         super(Sampler, self).__init__(id, outQueue, config)
         self.processes = {}
-        self.sampler_interval = self.config.get([self.id, "sampler_interval"], 60)
-        self.iostat_command = self.config.get([self.id, "iostat_command"], "/usr/bin/iostat")
-        self.iostat_devs = self.config.get([self.id, "iostat_devs"])
-        self.jobid = self.config.get(["options", "jobid"], 0)
-
-        if not self.iostat_devs:
-            raise sams.base.SamplerException("iostat_devs not configured")
+        self.backend = self.options.backend
+        # final_data() waits for iostat to print its next report.
+        self.blocking = self.backend == "iostat"
+        self.iostat_command = self.options.iostat_command
+        self.iostat_devs = self.options.iostat_devs
+        self.jobid = self.options.jobid
 
         self.job_iostat = None
+        self.diskstats = None
         devices = []
         for dev in self.iostat_devs:
             devices += glob.glob(dev % dict(jobid=self.jobid))
@@ -132,7 +203,9 @@ class Sampler(sams.base.Sampler):
         for dev in devices:
             rp = os.path.realpath(dev)
             device_map[rp] = dev
-        if devices:
+        if devices and self.backend == "diskstats":
+            self.diskstats = DiskStats(os.path.join(self.procdir, "diskstats"), device_map)
+        elif devices:
             self.job_iostat = IOStats(
                 devices=",".join(devices),
                 t=self.sampler_interval,
@@ -142,10 +215,20 @@ class Sampler(sams.base.Sampler):
             self.job_iostat.start()
 
     def do_sample(self):
+        if self.diskstats:
+            return True
         return self.job_iostat and not self.job_iostat.queue.empty()
 
     def sample(self):
         logger.debug("sample()")
+        if self.diskstats:
+            samples = self.diskstats.read()
+            for data in samples:
+                logger.debug(data)
+                self.store(data)
+            if samples:
+                self._most_recent_sample = [self._storage_wrapping(data) for data in samples]
+            return
         while not self.job_iostat.queue.empty():
             data = self.job_iostat.queue.get()
             logger.debug(data)
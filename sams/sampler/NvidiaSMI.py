@@ -67,6 +67,7 @@ import threading
 import time
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
@@ -120,18 +121,11 @@ class SMI(threading.Thread):
 
 
 class Sampler(sams.base.Sampler):
-    def __init__(self, id, outQueue, config):
-        super(Sampler, self).__init__(id, outQueue, config)
-        self._start_time = time.time()
-        self._last_sample_time = dict()
-        self._average_values = dict()
-        self._last_averaged_values = dict()
-        self.processes = {}
-        self.sampler_interval = self.config.get([self.id, "sampler_interval"], 60)
-        self.gpu_index_environment = self.config.get([self.id, "gpu_index_environment"], "SLURM_JOB_GPUS")
-        self.nvidia_smi_command = self.config.get([self.id, "nvidia_smi_command"], "/usr/bin/nvidia-smi")
-        self.nvidia_smi_metrics = self.config.get(
-            [self.id, "nvidia_smi_metrics"],
+    OPTIONS = sams.base.Sampler.OPTIONS + [
+        Option("gpu_index_environment", "SLURM_JOB_GPUS", str),
+        Option("nvidia_smi_command", "/usr/bin/nvidia-smi", str),
+        Option(
+            "nvidia_smi_metrics",
             [
                 "power.draw",
                 "power.limit",
@@ -142,15 +136,24 @@ class Sampler(sams.base.Sampler):
                 "utilization.gpu",
                 "utilization.memory",
             ],
-        )
-        self.metrics_to_average = self.config.get(
-            [self.id, "metrics_to_average"],
-            [
-                "power.draw",
-                "utilization.gpu",
-                "utilization.memory",
-            ],
-        )
+            list,
+        ),
+        Option("metrics_to_average", ["power.draw", "utilization.gpu", "utilization.memory"], list),
+    ]
+
+    def __init__(self, id, outQueue, config):
+        super(Sampler, self).__init__(id, outQueue, config)
+        # final_data() waits for nvidia-smi to print its next line.
+        self.blocking = True
+        self._start_time = time.time()
+        self._last_sample_time = dict()
+        self._average_values = dict()
+        self._last_averaged_values = dict()
+        self.processes = {}
+        self.gpu_index_environment = self.options.gpu_index_environment
+        self.nvidia_smi_command = self.options.nvidia_smi_command
+        self.nvidia_smi_metrics = self.options.nvidia_smi_metrics
+        self.metrics_to_average = self.options.metrics_to_average
 
         self.smi = None
         if self.gpu_index_environment in os.environ:
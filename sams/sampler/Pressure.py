@@ -37,16 +37,22 @@ import os
 import re
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
 
 class Sampler(sams.base.Sampler):
+    OPTIONS = sams.base.Sampler.OPTIONS + [
+        Option("cgroup_base", "/sys/fs/cgroup/unified", str),
+    ]
+
     def __init__(self, id, outQueue, config):
         super(Sampler, self).__init__(id, outQueue, config)
         self.processes = {}
-        self.cgroups = {}
-        self.cgroup_base = self.config.get([self.id, "cgroup_base"], "/sys/fs/cgroup/unified")
+        # cgroups (relative to cgroup_base) of the processes of the job.
+        self.cgroups = set()
+        self.cgroup_base = self.options.cgroup_base
         self.extract_pressure = re.compile(
             r"^(?P<type>some|full)\s+avg10=(?P<avg10>[\d\.]+)\s+avg60=(?P<avg60>[\d\.]+)\s+avg300=(?P<avg300>[\d\.]+)\s+total=(?P<total>[\d]+)\s*$"
         )
@@ -70,25 +76,31 @@ class Sampler(sams.base.Sampler):
 
     def _get_cgroup(self):
         """Get the cgroup base path for the slurm job"""
-        for pid in [pid for pid in self.pids if pid not in self.cgroups]:
+        for pid in list(self.pids):
             try:
-                with open("/proc/%d/cgroup" % pid, "r") as file:
-                    for line in file.readlines():
-                        m = re.search(r"^0::/(.*)$", line)
-                        if m:
-                            self.cgroups[pid] = m.group(1)
+                info = self.snapshot.get(pid) if self.snapshot else None
+                if info is not None and info.cgroup is not None:
+                    lines = info.cgroup.splitlines()
+                else:
+                    with open("%s/%d/cgroup" % (self.procdir, pid), "r") as file:
+                        lines = file.readlines()
+                for line in lines:
+                    m = re.search(r"^0::/(.*)$", line)
+                    if m:
+                        self.cgroups.add(m.group(1))
             except Exception as e:
-                logger.debug("Failed to fetch cgroup for pid: %d", self.pids[0])
+                logger.debug("Failed to fetch cgroup for pid: %d", pid)
                 logger.debug(e)
+        # Each pid is only looked at once, the cgroup is kept after the process has ended.
+        self.retire_pids(list(self.pids))
         if self.cgroups:
             return True
         return False
 
     def read_pressure(self, name):
-        cgroups = set(self.cgroups.values())
         output = {}
         types = set()
-        for cgroup in cgroups:
+        for cgroup in self.cgroups:
             try:
                 logger.debug(os.path.join(self.cgroup_base, cgroup, name))
                 with open(os.path.join(self.cgroup_base, cgroup, name), "r") as file:
@@ -105,7 +117,7 @@ class Sampler(sams.base.Sampler):
             except IOError as err:
                 logger.debug(
                     "Failed to open %s for reading",
-                    os.path.join(self.cgroup_base, type, cgroup, id),
+                    os.path.join(self.cgroup_base, cgroup, name),
                 )
                 logger.debug(err)
 
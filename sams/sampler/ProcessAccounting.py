@@ -0,0 +1,309 @@
+"""
+Fetches the cpu usage of short lived processes from the process accounting file
+
+Processes that start and exit between two pid finder updates are never
+seen by sams.sampler.Software. This sampler tails the kernel process
+accounting file (acct v3 records, enabled with accton(8)) and attributes
+the exited processes to the job through their parent pid.
+
+SAMS Software accounting
+Copyright (C) 2018-2021  Swedish National Infrastructure for Computing (SNIC)
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; If not, see <http://www.gnu.org/licenses/>.
+
+
+
+Config options:
+
+sams.sampler.ProcessAccounting:
+    # in seconds
+    sampler_interval: 60
+
+    # Path to the process accounting file
+    pacct: /var/log/account/pacct
+
+    # How long (in seconds) to keep records whose parent is not (yet)
+    # known to be part of the job.
+    pending_timeout: 300
+
+Output:
+summary:
+{
+    execs: {
+        COMMAND: {
+            user: 0,
+            system: 0,
+        },
+    },
+    processes: 0,
+}
+"""
+
+import logging
+import os
+import struct
+import time
+from collections import namedtuple
+
+import sams.base
+from sams.core import Option
+
+logger = logging.getLogger(__name__)
+
+# struct acct_v3 from linux/acct.h
+ACCT_V3 = struct.Struct("<BBHIIIIIIf8H16s")
+ACCT_VERSION = 3
+# Unit of the times in the records.
+AHZ = 100
+
+CLOCK_TICKS = os.sysconf(os.sysconf_names["SC_CLK_TCK"])
+
+# seq is the order the record was read in, a child is written before its parent.
+Record = namedtuple("Record", ["pid", "ppid", "btime", "utime", "stime", "comm", "seq"])
+
+
+def comp_t(value):
+    """Decode a comp_t, 13 bit mantissa and 3 bit base 8 exponent"""
+    return (value & 0x1FFF) << (((value >> 13) & 0x7) * 3)
+
+
+def parse(data, seq=0):
+    """Decode the acct v3 records in data, the length of data must be a multiple of the record size.
+    The records are numbered from seq."""
+    records = []
+    for (
+        _flag,
+        version,
+        _tty,
+        _exitcode,
+        _uid,
+        _gid,
+        pid,
+        ppid,
+        btime,
+        _etime,
+        utime,
+        stime,
+        _mem,
+        _io,
+        _rw,
+        _minflt,
+        _majflt,
+        _swaps,
+        comm,
+    ) in ACCT_V3.iter_unpack(data):
+        if version & 0x0F != ACCT_VERSION:
+            logger.debug("Ignore pacct record with version: %d", version & 0x0F)
+            continue
+        records.append(
+            Record(
+                pid,
+                ppid,
+                btime,
+                comp_t(utime) / AHZ,
+                comp_t(stime) / AHZ,
+                comm.split(b"\0", 1)[0].decode(errors="replace"),
+                seq + len(records),
+            )
+        )
+    return records
+
+
+class Sampler(sams.base.Sampler):
+    OPTIONS = sams.base.Sampler.OPTIONS + [
+        Option("pacct", "/var/log/account/pacct", str),
+        Option("pending_timeout", 300, (int, float)),
+    ]
+
+    def __init__(self, id, outQueue, config):
+        super(Sampler, self).__init__(id, outQueue, config)
+        self.pacct = self.options.pacct
+        self.pending_timeout = self.options.pending_timeout
+        self.file = None
+        self.inode = None
+        self.remainder = b""
+        # Processes known to be part of the job, from the pid finder or attributed
+        # records: pid -> [btime, seq of the exit record or None, from the pid finder,
+        # time the process was found gone without an exit record or None].
+        # The start time tells a reused pid apart and a record can only be a child
+        # of a process if it was written before the process exited.
+        self.known = {}
+        self.seq = 0
+        self.boot_time = self._boot_time()
+        self.pending = []
+        self.execs = {}
+        self.processes = 0
+        self.finished = False
+        # Only processes that exits after the sampler was started are of interest.
+        self._open(end=True)
+
+    def _boot_time(self):
+        """Boot time in seconds since epoch from /proc/stat"""
+        try:
+            with open(os.path.join(self.procdir, "stat")) as file:
+                for line in file:
+                    if line.startswith("btime "):
+                        return int(line.split()[1])
+        except (OSError, ValueError) as err:
+            logger.debug("Failed to read btime from %s/stat: %s", self.procdir, err)
+        return None
+
+    def _btime(self, pid):
+        """Start time of pid in seconds since epoch, or None if it is not known"""
+        if self.boot_time is None:
+            return None
+        try:
+            with open("%s/%d/stat" % (self.procdir, pid), "rb") as file:
+                stat = file.read()
+            return self.boot_time + int(stat[stat.rindex(b")") + 2 :].split(b" ", 20)[19]) // CLOCK_TICKS
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _running(self, pid, btime):
+        """True if the process pid that started at btime is still running"""
+        if btime is None:
+            return os.path.exists("%s/%d" % (self.procdir, pid))
+        current = self._btime(pid)
+        return current is not None and self._same_start(btime, current)
+
+    @staticmethod
+    def _same_start(btime, record_btime):
+        # The start time from /proc and the one in the record can differ by a second.
+        return btime is None or abs(btime - record_btime) <= 1
+
+    def _is_child(self, record):
+        """True if the parent of record is a known process that had not exited when record was written"""
+        parent = self.known.get(record.ppid)
+        if parent is None:
+            return False
+        btime, end, _, _ = parent
+        return (btime is None or record.btime >= btime - 1) and (end is None or record.seq < end)
+
+    def _open(self, end=False):
+        try:
+            self.file = open(self.pacct, "rb")
+        except OSError as err:
+            logger.debug("Failed to open %s: %s", self.pacct, err)
+            self.file = None
+            return
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.remainder = b""
+        if end:
+            self.file.seek(0, os.SEEK_END)
+
+    def _read(self):
+        """Read the records appended since last read, follows the file if it is rotated"""
+        if self.finished:
+            return []
+        if self.file is None:
+            self._open()
+            if self.file is None:
+                return []
+        records = self._read_file()
+        try:
+            stat = os.stat(self.pacct)
+            rotated = stat.st_ino != self.inode or stat.st_size < self.file.tell()
+        except OSError:
+            rotated = True
+        if rotated:
+            logger.debug("%s has been rotated", self.pacct)
+            self.file.close()
+            self._open()
+            if self.file is not None:
+                records.extend(self._read_file())
+        return records
+
+    def _read_file(self):
+        data = self.remainder + self.file.read()
+        size = len(data) - len(data) % ACCT_V3.size
+        self.remainder = data[size:]
+        records = parse(data[:size], self.seq)
+        self.seq += len(records)
+        return records
+
+    def _attribute(self, records):
+        """Add the records that descends from the pids of the job to execs"""
+        now = time.time()
+        self.pending.extend((now, record) for record in records)
+        for pid in self.pids:
+            # Processes seen by the pid finder are accounted for by sams.sampler.Software.
+            self.known[pid] = [self._btime(pid), None, True, None]
+        self.retire_pids(list(self.pids))
+
+        for _, record in self.pending:
+            known = self.known.get(record.pid)
+            if known is not None and known[1] is None and known[2] and self._same_start(known[0], record.btime):
+                # A pid of the job has exited.
+                known[1] = record.seq
+
+        # A child exits (and is written) before its parent, repeat until nothing more is found.
+        changed = True
+        while changed and self.pending:
+            changed = False
+            pending = []
+            for read_time, record in self.pending:
+                known = self.known.get(record.pid)
+                if known is not None and known[2] and known[1] == record.seq:
+                    continue
+                if not self._is_child(record):
+                    pending.append((read_time, record))
+                    continue
+                logger.debug("Attribute pid: %d (%s) to jobid: %d", record.pid, record.comm, self.jobid)
+                self.known[record.pid] = [record.btime, record.seq, False, None]
+                if record.comm not in self.execs:
+                    self.execs[record.comm] = {"user": 0.0, "system": 0.0}
+                self.execs[record.comm]["user"] += record.utime
+                self.execs[record.comm]["system"] += record.stime
+                self.processes += 1
+                changed = True
+            self.pending = pending
+
+        self.pending = [(t, r) for t, r in self.pending if t > now - self.pending_timeout]
+        # Processes that have exited can only be the parent of the records written before that.
+        oldest = min((r.seq for _, r in self.pending), default=self.seq)
+        self.known = {pid: k for pid, k in self.known.items() if k[1] is None or k[1] > oldest}
+        # The exit record of a process from the pid finder is lost if pacct is rotated
+        # away or accounting is turned off. It is forgotten pending_timeout after it
+        # was found gone, the records of its children can still be pending until then.
+        for pid, k in list(self.known.items()):
+            if not k[2] or k[1] is not None:
+                continue
+            if k[3] is None:
+                if not self._running(pid, k[0]):
+                    k[3] = now
+            elif k[3] <= now - self.pending_timeout:
+                logger.debug("No exit record of pid: %d, forgetting it", pid)
+                del self.known[pid]
+
+    def sample(self):
+        logger.debug("sample()")
+        self._attribute(self._read())
+
+    def checkpoint_data(self):
+        return {
+            "execs": {comm: dict(usage) for comm, usage in self.execs.items()},
+            "processes": self.processes,
+        }
+
+    def final_data(self):
+        logger.debug("%s final_data", self.id)
+        self._attribute(self._read())
+        self.finished = True
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        return {
+            "execs": self.execs,
+            "processes": self.processes,
+        }
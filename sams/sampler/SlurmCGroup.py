@@ -27,12 +27,26 @@ sams.sampler.SlurmCGroup:
 
     cgroup_base: /cgroup
 
+    # Counters from the keyed files (read once per sample) to add to
+    # the output, a list of counters per file. None by default.
+    stat_counters:
+        memory.stat: [total_rss, total_cache, total_swap, total_pgmajfault]
+        cpuacct.stat: [user, system]
+
 Output:
 {
     cpus: 0,
     memory_usage: 0,
     memory_limit: 0,
-    memory_max_usage: 0
+    memory_max_usage: 0,
+    memory_stat: {
+        total_rss: 0,
+        ...
+    },
+    cpuacct_stat: {
+        user: 0,
+        system: 0
+    }
 }
 """
 
@@ -42,21 +56,33 @@ import re
 import time
 
 import sams.base
+import sams.cgroupfs
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
 
 class Sampler(sams.base.Sampler):
+    OPTIONS = sams.base.Sampler.OPTIONS + [
+        Option("cgroup_base", "/cgroup", str),
+        Option("metrics_to_average", ["memory_usage"], list),
+        Option("stat_counters", {}, dict),
+    ]
+
     def __init__(self, id, outQueue, config):
         super().__init__(id, outQueue, config)
         self.processes = {}
         self.cgroup = None
-        self.cgroup_base = self.config.get([self.id, "cgroup_base"], "/cgroup")
+        self.cgroup_base = self.options.cgroup_base
         self.create_time = time.time()
         self.last_sample_time = self.create_time
-        self.metrics_to_average = self.config.get([self.id, "metrics_to_average"], ["memory_usage"])
+        self.metrics_to_average = self.options.metrics_to_average
         self._average_values = {k: 0 for k in self.metrics_to_average}
         self._last_averaged_values = {k: 0 for k in self.metrics_to_average}
+        self.stat_counters = self.options.stat_counters
+        # file -> counters, reused between the samples.
+        self._stats = {file: {} for file in self.stat_counters}
+        self.reader = sams.cgroupfs.CGroupReader()
 
     def do_sample(self):
         return self._get_cgroup()
@@ -64,6 +90,8 @@ class Sampler(sams.base.Sampler):
     def sample(self):
         logger.debug("sample()")
 
+        # The time the values are read, used for the averages.
+        sample_time = time.time()
         cpus = self._cpucount(self.read_cgroup("cpuset", "cpuset.cpus"))
         memory_usage = self.read_cgroup("memory", "memory.usage_in_bytes")
         memory_limit = self.read_cgroup("memory", "memory.limit_in_bytes")
@@ -75,9 +103,12 @@ class Sampler(sams.base.Sampler):
             "memory_usage": memory_usage,
             "memory_limit": memory_limit,
             "memory_max_usage": memory_max_usage,
-            "memory_swap": str(int(memory_usage_and_swap) - int(memory_usage)),
         }
-        self.compute_sample_averages(entry)
+        if memory_usage_and_swap and memory_usage:
+            entry["memory_swap"] = str(int(memory_usage_and_swap) - int(memory_usage))
+        self.read_stats(entry)
+        self.compute_sample_averages(entry, sample_time)
+        self.adapt({k: float(entry[k]) for k in self.metrics_to_average if k in entry})
         self._most_recent_sample = [self._storage_wrapping(entry)]
         self.store(entry)
 
@@ -86,14 +117,12 @@ class Sampler(sams.base.Sampler):
         """Version-specific regular expression to find correct cgroup path."""
         return r"^/(slurm/uid_\d+/job_\d+)/"
 
-    def compute_sample_averages(self, data):
+    def compute_sample_averages(self, data, sample_time):
         """Computes averages of selected measurements by
-        means of trapezoidal quadrature, approximating
-        that the time this function is called is the actual
-        time of sampling. This is not completely correct but simplifies
-        the implementation.
+        means of trapezoidal quadrature. sample_time is the
+        time the values in data were read, the interval between
+        samples may vary.
         """
-        sample_time = time.time()
         elapsed_time = sample_time - self.last_sample_time
         total_elapsed_time = sample_time - self.create_time
         for key, item in data.items():
@@ -107,7 +136,7 @@ class Sampler(sams.base.Sampler):
 
         for key, item in self._average_values.items():
             data[key + "_average"] = item
-        self.last_sample_time = time.time()
+        self.last_sample_time = sample_time
 
     def _get_cgroup(self):
         """Get the cgroup base path for the slurm job"""
@@ -115,14 +144,18 @@ class Sampler(sams.base.Sampler):
             return True
         for pid in self.pids:
             try:
-                logger.debug(f"Checking /proc/{pid}/cpuset")
-                with open("/proc/%d/cpuset" % pid, "r") as file:
-                    cpuset = file.readline()
-                    m = re.search(self._get_cgroup_regex(), cpuset)
-                    if m is not None:
-                        self.cgroup = m.group(1)
-                        return True
-            except (OSError, re.PatternError) as e:
+                info = self.snapshot.get(pid) if self.snapshot else None
+                if info is not None and info.cpuset is not None:
+                    cpuset = info.cpuset
+                else:
+                    logger.debug(f"Checking {self.procdir}/{pid}/cpuset")
+                    with open("%s/%d/cpuset" % (self.procdir, pid), "r") as file:
+                        cpuset = file.readline()
+                m = re.search(self._get_cgroup_regex(), cpuset)
+                if m is not None:
+                    self.cgroup = m.group(1)
+                    return True
+            except (OSError, re.error) as e:
                 logger.debug(f"Failed to fetch cpuset for pid: {pid}")
                 logger.debug(e)
         return False
@@ -146,16 +179,21 @@ class Sampler(sams.base.Sampler):
         any errors early."""
         return os.path.join(self.cgroup_base, resource_type, self.cgroup, value)
 
+    def _get_stat_path(self, file):
+        """Path of the keyed file, the controller is the prefix of the file name"""
+        return self._get_cgroup_item_path(file.split(".", 1)[0], file)
+
     def read_cgroup(self, *items):
-        path = self._get_cgroup_item_path(*items)
-        try:
-            with open(path, "r") as file:
-                return file.readline().strip()
-        except OSError as err:
-            logger.error(f"Failed to open {path} for reading")
-            logger.error(err)
-            return ""
-
-    @classmethod
-    def final_data(cls):
+        return self.reader.value(self._get_cgroup_item_path(*items))
+
+    def read_stats(self, entry):
+        """Add the stat_counters to entry, each keyed file is read and parsed once"""
+        for file, counters in self.stat_counters.items():
+            stats = self.reader.keyed(self._get_stat_path(file), self._stats[file])
+            if stats is None:
+                continue
+            entry[file.replace(".", "_")] = {counter: stats[counter] for counter in counters if counter in stats}
+
+    def final_data(self):
+        self.reader.close_all()
         return {}
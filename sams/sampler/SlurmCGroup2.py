@@ -11,17 +11,38 @@ sams.sampler.SlurmCGroup2:
 
     cgroup_base: /cgroup
 
+    # Counters from the keyed files (read once per sample) to add to
+    # the output, a list of counters per file. The io.stat counters are
+    # summed over all devices. None by default.
+    stat_counters:
+        memory.stat: [anon, file, kernel, pgmajfault]
+        cpu.stat: [usage_usec, user_usec, system_usec, nr_throttled, throttled_usec]
+        io.stat: [rbytes, wbytes, rios, wios]
+
 Output:
 {
     cpus: 0,
     memory_usage: 0,
     memory_limit: 0,
-    memory_max_usage: 0
+    memory_max_usage: 0,
+    memory_stat: {
+        anon: 0,
+        ...
+    },
+    cpu_stat: {
+        usage_usec: 0,
+        ...
+    },
+    io_stat: {
+        rbytes: 0,
+        ...
+    }
 }
 """
 
 import logging
 import os
+import time
 
 from .SlurmCGroup import Sampler as BaseCGroupSampler
 
@@ -32,6 +53,8 @@ class Sampler(BaseCGroupSampler):
     def sample(self):
         logger.debug("sample()")
 
+        # The time the values are read, used for the averages.
+        sample_time = time.time()
         cpus = self._cpucount(self.read_cgroup("cpuset.cpus"))
         memory_usage = self.read_cgroup("memory.current")
         memory_limit = self.read_cgroup("memory.high")
@@ -43,9 +66,12 @@ class Sampler(BaseCGroupSampler):
             "memory_usage": memory_usage,
             "memory_limit": memory_limit,
             "memory_max_usage": memory_max_usage,
-            "memory_swap": str(int(memory_usage_and_swap) - int(memory_usage)),
         }
-        self.compute_sample_averages(entry)
+        if memory_usage_and_swap and memory_usage:
+            entry["memory_swap"] = str(int(memory_usage_and_swap) - int(memory_usage))
+        self.read_stats(entry)
+        self.compute_sample_averages(entry, sample_time)
+        self.adapt({k: float(entry[k]) for k in self.metrics_to_average if k in entry})
         self._most_recent_sample = [self._storage_wrapping(entry)]
         self.store(entry)
 
@@ -53,6 +79,9 @@ class Sampler(BaseCGroupSampler):
     def _get_cgroup_regex():
         return r"^/(system.slice/slurmstepd.scope/job_\d+)/"
 
+    def _get_stat_path(self, file):
+        return self._get_cgroup_item_path(file)
+
     def _get_cgroup_item_path(self, value):
         """
         Version-specific parsing function. We assume the number
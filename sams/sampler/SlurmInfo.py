@@ -49,6 +49,7 @@ import re
 import subprocess
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
@@ -56,7 +57,17 @@ COMMAND = "%s show job %d -o"
 
 
 class Sampler(sams.base.Sampler):
-    data = {}
+    OPTIONS = sams.base.Sampler.OPTIONS + [
+        Option("scontrol", "/usr/bin/scontrol", str),
+        Option("environment", {}, dict),
+        Option("jobid", 0, int, path=["options", "jobid"]),
+    ]
+
+    def __init__(self, id, outQueue, config):
+        super(Sampler, self).__init__(id, outQueue, config)
+        self.data = {}
+        # scontrol waits for slurmctld.
+        self.blocking = True
 
     def do_sample(self):
         if all(k in self.data for k in ["account", "cpus", "nodes", "starttime", "username", "uid"]):
@@ -69,14 +80,11 @@ class Sampler(sams.base.Sampler):
     def sample(self):
         logger.debug("sample()")
 
-        scontrol = self.config.get([self.id, "scontrol"], "/usr/bin/scontrol")
-        jobid = self.config.get(["options", "jobid"], 0)
-
-        command = COMMAND % (scontrol, jobid)
+        command = COMMAND % (self.options.scontrol, self.options.jobid)
 
         try:
             local_env = os.environ.copy()
-            for env, value in self.config.get([self.id, "environment"], {}).items():
+            for env, value in self.options.environment.items():
                 local_env[env] = value
             process = subprocess.Popen(command, env=local_env, shell=True, stdout=subprocess.PIPE).stdout
             data = process.readlines()
@@ -130,5 +138,8 @@ class Sampler(sams.base.Sampler):
             self._most_recent_sample = [self._storage_wrapping(self.data)]
             self.store(self.data)
 
+    def checkpoint_data(self):
+        return dict(self.data)
+
     def final_data(self):
         return self.data
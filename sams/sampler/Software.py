@@ -28,6 +28,46 @@ sams.sampler.Software:
     # Map current running execs into softwares for live reporting
     # software_mapper: sams.software.Regexp
 
+    # How to read the cpu usage of the processes.
+    # process: read /proc/<pid>/stat, includes exited threads.
+    # task: sum /proc/<pid>/task/<tid>/stat over the running threads (debug).
+    accounting: process
+
+    # Max number of stat files to keep open between samples
+    max_open_files: 512
+
+    # Where the live job totals (current) are read from.
+    # processes: sum the cpu usage of all processes of the job.
+    # cgroup: read cpu.stat (v2) or cpuacct.stat (v1) of the job cgroup,
+    #         falls back to processes if the cgroup can not be found.
+    current_source: processes
+
+    # Base path of the cgroup file system (only used by current_source: cgroup)
+    cgroup_base: /sys/fs/cgroup
+
+    # How often (in seconds) the per exe usage is read from /proc,
+    # defaults to sampler_interval. With current_source: cgroup it is not
+    # read at all while the collector is over its cpu_budget_percent.
+    per_exe_interval: 600
+
+    # Attribute cpu usage of reaped children (cutime/cstime) that was
+    # never sampled, e.g. processes that started and ended between samples.
+    # none: not attributed.
+    # parent: attributed to the exe of the parent.
+    # unattributed: attributed to the exe "unattributed children".
+    # Disabled if sams.sampler.ProcessAccounting is also used.
+    child_attribution: none
+
+    # Max number of execs in the output, 0 is no limit. The usage of the
+    # execs with the least cpu usage is added to the exe "other execs".
+    max_execs: 0
+
+    # Rewrite the exe paths before they are counted, e.g. to collapse
+    # binaries compiled into the job specific tmp directory.
+    exe_normalize:
+      - match: '^/scratch/local/[0-9]+/'
+        replace: '/scratch/local/JOBID/'
+
 Output:
 Every sample:
 {
@@ -50,51 +90,92 @@ summary:
     },
     start_time: 0,
     end_time: 1,
+    execs_error: 0,
+    children: {
+        user: 0,
+        system: 0,
+    },
 }
 """
 
 import logging
 import os
 import re
+import sys
 import time
 
 import sams.base
 import sams.core
+import sams.procfs
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
 
+CLOCK_TICKS = os.sysconf(os.sysconf_names["SC_CLK_TCK"])
+
+UNATTRIBUTED_CHILDREN = "unattributed children"
+
+OTHER_EXECS = "other execs"
+
+# live_tasks of processes that are not accounted per task.
+NO_TASKS = frozenset()
+
+
 class Process:
-    def __init__(self, pid, jobid):
+    __slots__ = (
+        "pid",
+        "ppid",
+        "accounting",
+        "children",
+        "children_accounted",
+        "reaped",
+        "tasks",
+        "live_tasks",
+        "reader",
+        "starttime",
+        "ignore",
+        "done",
+        "updated",
+        "exe",
+    )
+
+    def __init__(self, pid, jobid, reader=None, accounting="process", children=False):
         self.pid = pid
-        self.tasks = {}
-        self.clock_tics = os.sysconf(os.sysconf_names["SC_CLK_TCK"])
+        self.ppid = None
+        self.accounting = accounting
+        # Cpu usage of reaped children (cutime/cstime), None unless tracked.
+        self.children = [0.0, 0.0] if children else None
+        # The part of children that has been accounted for.
+        self.children_accounted = [0.0, 0.0]
+        # Set when the usage of the ended process has been accounted for in the parent.
+        self.reaped = False
+        self.tasks = sams.procfs.TaskCounters()
+        self.live_tasks = NO_TASKS
+        self.reader = reader if reader is not None else sams.procfs.StatReader(max_open=0)
         self.starttime = time.time()
         self.ignore = False
         self.done = False
-        self.uptime = None
         self.updated = None
+        self.exe = None
 
         try:
-            self.exe = os.readlink("/proc/%d/exe" % self.pid)
+            # Many processes share the same few exe paths.
+            self.exe = sys.intern(os.readlink("%s/%d/exe" % (self.reader.procdir, self.pid)))
             logger.debug("Pid: %d (JobId: %d) has exe: %s", pid, jobid, self.exe)
         except Exception:
             logger.debug("Pid: %d (JobId: %d) has no exe or pid has disapeard", pid, jobid)
             self.ignore = True
             return
 
-    def _parse_stat(self, stat):
-        """Parse the relevant content from /proc/***/stat"""
+    def _done(self):
+        self.done = True
+        self.reader.close(self.pid)
+        self.reader.close_all((self.pid, task) for task in self.live_tasks)
+        self.live_tasks = NO_TASKS
 
-        m = re.search(r"^\d+ \(.*\) [RSDZTyEXxKWPI] (.*)", stat)
-        stats = m.group(1).split(r" ")
-        return {
-            "user": float(stats[14 - 4]) / self.clock_tics,  # User CPU time in s.
-            "system": float(stats[15 - 4]) / self.clock_tics,  # System CPU time in s.
-        }
-
-    def update(self, uptime):
-        """Update information about pids"""
+    def update(self, snapshot=None):
+        """Update information about pids, a pid that is gone in snapshot has ended"""
 
         if self.done:
             logger.debug("Pid: %d is done", self.pid)
@@ -102,38 +183,74 @@ class Process:
 
         logger.debug("Update pid: %d", self.pid)
 
-        self.uptime = uptime
+        if snapshot and self.pid in snapshot.gone:
+            logger.debug("Pid: %d is gone in snapshot", self.pid)
+            self._done()
+            return
 
         try:
-            tasks = filter(lambda f: re.match(r"^\d+$", f), os.listdir("/proc/%d/task" % self.pid))
-            tasks = map(int, tasks)
-        except Exception:
+            if self.accounting == "process":
+                self._update_process()
+            else:
+                self._update_tasks()
+        except OSError as err:
+            # Out of file descriptors etc, the process is still running and is read again next sample.
+            logger.warning("Failed to read /proc/%d: %s", self.pid, err)
+
+    def _read_stat(self):
+        """(ppid, utime, stime, cutime, cstime) from /proc/<pid>/stat.
+
+        The cpu counters are always read at sample time, the snapshot is only
+        taken when the pidfinder runs and can be a whole
+        pid_finder_update_interval old.
+        """
+        return self.reader.read_stat(self.pid)
+
+    def _update_children(self, stat):
+        self.ppid = stat[0]
+        if self.children is not None:
+            self.children = [stat[3] / CLOCK_TICKS, stat[4] / CLOCK_TICKS]
+
+    def _update_process(self):
+        """Cpu usage of the whole thread group (including exited threads) from /proc/<pid>/stat"""
+        stat = self._read_stat()
+        if stat is None:
+            logger.debug("Failed to read /proc/%d/stat, most likely due to process ending", self.pid)
+            self._done()
+            return
+        self.tasks.set(self.pid, stat[1] / CLOCK_TICKS, stat[2] / CLOCK_TICKS)
+        self._update_children(stat)
+        self.updated = time.time()
+
+    def _update_tasks(self):
+        """Cpu usage summed over every /proc/<pid>/task/<tid>/stat"""
+        try:
+            tasks = set(int(t) for t in os.listdir("%s/%d/task" % (self.reader.procdir, self.pid)) if t.isdigit())
+        except OSError as err:
+            if err.errno not in sams.procfs.EXITED:
+                raise
             logger.debug(
                 "Failed to read /proc/%d/task, most likely due to process ending",
                 self.pid,
             )
-            self.done = True
+            self._done()
             return
 
+        if self.children is not None:
+            stat = self._read_stat()
+            if stat is not None:
+                self._update_children(stat)
+
+        # Close the stat files of tasks that have exited.
+        self.reader.close_all((self.pid, task) for task in self.live_tasks - tasks)
+        self.live_tasks = tasks
+
         for task in tasks:
-            try:
-                with open("/proc/%d/task/%d/stat" % (self.pid, task)) as f:
-                    stat = f.read()
-                    stats = self._parse_stat(stat)
-                    self.tasks[task] = {
-                        "user": stats["user"],
-                        "system": stats["system"],
-                    }
-                    logger.debug(
-                        "Task usage for pid: %d, task: %d, user: %f, system: %f",
-                        self.pid,
-                        task,
-                        stats["user"],
-                        stats["system"],
-                    )
-
-            except Exception:
+            cpu = self.reader.read_cpu((self.pid, task))
+            if cpu is None:
                 logger.debug("Ignore missing task for pid: %d", self.pid)
+                continue
+            self.tasks.set(task, cpu[0] / CLOCK_TICKS, cpu[1] / CLOCK_TICKS)
 
         self.updated = time.time()
 
@@ -142,12 +259,71 @@ class Process:
         return {
             "starttime": self.starttime,
             "exe": self.exe,
-            "user": sum(t["user"] for t in self.tasks.values()),
-            "system": sum(t["system"] for t in self.tasks.values()),
+            "user": self.tasks.user(),
+            "system": self.tasks.system(),
         }
 
 
+class TopExecs:
+    """Per exe user/system cpu usage for at most max_execs execs (Space-Saving).
+
+    When a new exe is added and the table is full the exe with the least
+    usage is evicted, its usage is moved to other and the new exe inherits
+    it as error: up to error seconds of the usage of the exe can be in
+    other instead. An exe with more than total / max_execs usage is never
+    evicted. The sum of all execs and other is always exact.
+    """
+
+    __slots__ = ("max_execs", "entries", "other", "evicted")
+
+    def __init__(self, max_execs=0):
+        self.max_execs = max_execs
+        # exe -> [user, system, error]
+        self.entries = {}
+        self.other = [0.0, 0.0]
+        # Number of evictions.
+        self.evicted = 0
+
+    def add(self, exe, user, system):
+        entry = self.entries.get(exe)
+        if entry is None:
+            error = 0.0
+            if self.max_execs and len(self.entries) >= self.max_execs:
+                victim = min(self.entries, key=lambda e: sum(self.entries[e]))
+                v_user, v_system, v_error = self.entries.pop(victim)
+                self.other[0] += v_user
+                self.other[1] += v_system
+                self.evicted += 1
+                error = v_user + v_system + v_error
+            entry = self.entries[exe] = [0.0, 0.0, error]
+        entry[0] += user
+        entry[1] += system
+
+    def error(self):
+        """Max usage (in seconds) of any exe that can be in other, the
+        usage of the least used exe once something has been evicted."""
+        if not self.evicted:
+            return 0.0
+        return min(sum(entry) for entry in self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+
 class Sampler(sams.base.Sampler):
+    OPTIONS = sams.base.Sampler.OPTIONS + [
+        Option("software_mapper", None, str),
+        Option("accounting", "process", str, choices=["process", "task"]),
+        Option("max_open_files", 512, int),
+        Option("current_source", "processes", str, choices=["processes", "cgroup"]),
+        Option("cgroup_base", "/sys/fs/cgroup", str),
+        Option("per_exe_interval", None, (int, float)),
+        Option("child_attribution", "none", str, choices=["none", "parent", "unattributed"]),
+        Option("max_execs", 0, int),
+        Option("exe_normalize", [], list),
+        Option("metrics_to_average", ["system", "user"], list),
+    ]
+
     def __init__(self, id, outQueue, config):
         super(Sampler, self).__init__(id, outQueue, config)
         self.processes = {}
@@ -155,11 +331,42 @@ class Sampler(sams.base.Sampler):
         self.last_sample_time = None
         self.last_total = None
         self.software_mapper = None
-        self.metrics_to_average = self.config.get([self.id, "metrics_to_average"], ["system", "user"])
+        self.reader = sams.procfs.StatReader(self.procdir, max_open=self.options.max_open_files)
+        self.accounting = self.options.accounting
+        self.current_source = self.options.current_source
+        self.cgroup_base = self.options.cgroup_base
+        self.cgroup_cpu = None
+        self.per_exe_interval = self.options.per_exe_interval or self.sampler_interval
+        self.last_per_exe_time = None
+        # Set while the collector is over its cpu budget, see throttle().
+        self.skip_per_exe = False
+        # Number of samples where the per exe usage was not read because of skip_per_exe.
+        self.per_exe_skipped = 0
+        self.last_total_source = None
+        self.aggr = {}
+        self.child_attribution = self.options.child_attribution
+        if self.child_attribution != "none" and "sams.sampler.ProcessAccounting" in self.config.get(["sams.collector", "samplers"], []):
+            # The short lived processes would be counted twice.
+            logger.error("child_attribution is disabled, it can not be combined with sams.sampler.ProcessAccounting")
+            self.child_attribution = "none"
+        # Attributed cpu usage of reaped children per exe.
+        self.children = {}
+        self.max_execs = self.options.max_execs
+        self.exe_normalize = [(re.compile(r["match"]), r["replace"]) for r in self.options.exe_normalize]
+        # Cpu usage per exe of the processes that has ended, see _retire().
+        self.retired = TopExecs(self.max_execs)
+        # Number of processes folded into retired.
+        self.retired_processes = 0
+        self.retired_start_time = None
+        self.retired_updated = None
+        self.children_total = {"user": 0.0, "system": 0.0}
+        # Usage of tracked children that has ended, not yet seen in cutime/cstime of the parent.
+        self.explained = {}
+        self.metrics_to_average = self.options.metrics_to_average
         self._average_values = {k: 0 for k in self.metrics_to_average}
         self._last_averaged_values = {k: 0 for k in self.metrics_to_average}
 
-        software_mapper = self.config.get([id, "software_mapper"], None)
+        software_mapper = self.options.software_mapper
         if software_mapper is not None:
             logger.debug("Loading software_mapper: %s", software_mapper)
             try:
@@ -187,52 +394,223 @@ class Sampler(sams.base.Sampler):
                 logger.debug(e)
         return output
 
-    def sample(self):
-        logger.debug("sample()")
-
-        with open("/proc/uptime", "r") as f:
-            uptime = float(f.readline().split()[0])
-
+    def _update_processes(self):
+        """Read the cpu usage of every process of the job from /proc"""
+        pids = 0
+        tasks = 0
         for pid in self.pids:
             logger.debug("evaluate pid: %d", pid)
-            if pid not in self.processes.keys():
+            if pid not in self.processes:
                 logger.debug("Create new instance of Process for pid: %d", pid)
-                self.processes[pid] = Process(pid, self.jobid)
-            self.processes[pid].update(uptime)
+                self.processes[pid] = Process(pid, self.jobid, self.reader, self.accounting, self.child_attribution != "none")
+                if self.exe_normalize and self.processes[pid].exe is not None:
+                    self.processes[pid].exe = self.normalize(self.processes[pid].exe)
+            process = self.processes[pid]
+            if process.done:
+                continue
+            process.update(self.snapshot)
+            pids += 1
+            tasks += len(process.live_tasks) if self.accounting == "task" else 1
+        self.instrumentation.set("pids_walked", pids)
+        self.instrumentation.set("tasks_walked", tasks)
+
+        if self.child_attribution != "none":
+            self._attribute_children()
+        self._retire()
+
+    def add_pids(self, pids):
+        # A pid that is sent again has been reused by a new process, the old one has ended.
+        for pid in pids:
+            p = self.processes.pop(pid, None)
+            if p is None:
+                continue
+            logger.debug("Pid: %d has been reused, retire the old process", pid)
+            p._done()
+            if self.child_attribution != "none" and not p.ignore and not p.reaped and p.ppid is not None:
+                self._reap(p)
+            self._fold(p)
+        super(Sampler, self).add_pids(pids)
+
+    def _fold(self, p):
+        """Add the usage of the ended process p to the per exe totals"""
+        self.retired_processes += 1
+        if p.ignore:
+            return
+        self.retired.add(p.exe, p.tasks.user(), p.tasks.system())
+        if self.retired_start_time is None or p.starttime < self.retired_start_time:
+            self.retired_start_time = p.starttime
+        if p.updated is not None and (self.retired_updated is None or p.updated > self.retired_updated):
+            self.retired_updated = p.updated
+
+    def _retire(self):
+        """Fold the processes that has ended (and been attributed to their parent)
+        into per exe totals and drop their pids from the live set, so the cost
+        of a sample follows the number of running processes."""
+        pids = []
+        for pid, p in list(self.processes.items()):
+            if not p.done and not p.ignore:
+                continue
+            if self.child_attribution != "none" and not p.ignore and not p.reaped and p.ppid is not None:
+                continue
+            self._fold(p)
+            pids.append(pid)
+            del self.processes[pid]
+        self.retire_pids(pids)
+        self.instrumentation.set("retired", self.retired_processes)
+
+    def _reap(self, p):
+        """The usage of the ended process p explains that much of the cutime/cstime increase of its parent"""
+        p.reaped = True
+        explained = self.explained.setdefault(p.ppid, [0.0, 0.0])
+        explained[0] += p.tasks.user() + p.children[0]
+        explained[1] += p.tasks.system() + p.children[1]
+
+    def _attribute_children(self):
+        """Attribute the part of the cutime/cstime increase of each process
+        that is not explained by the tracked children that has ended."""
+        for p in self.processes.values():
+            if p.done and not p.ignore and not p.reaped and p.ppid is not None:
+                self._reap(p)
+
+        for p in self.processes.values():
+            if p.done or p.ignore:
+                continue
+            delta = [p.children[i] - p.children_accounted[i] for i in range(2)]
+            p.children_accounted = list(p.children)
+            explained = self.explained.pop(p.pid, [0.0, 0.0])
+            unexplained = [max(delta[i] - explained[i], 0.0) for i in range(2)]
+            # A child can be seen as ended before its usage shows up in the parent.
+            explained = [max(explained[i] - delta[i], 0.0) for i in range(2)]
+            if explained[0] or explained[1]:
+                self.explained[p.pid] = explained
+            if not unexplained[0] and not unexplained[1]:
+                continue
+            exe = p.exe if self.child_attribution == "parent" else UNATTRIBUTED_CHILDREN
+            logger.debug("Attribute children of pid: %d, user: %f, system: %f to: %s", p.pid, unexplained[0], unexplained[1], exe)
+            if exe not in self.children:
+                self.children[exe] = {"user": 0.0, "system": 0.0}
+            self.children[exe]["user"] += unexplained[0]
+            self.children[exe]["system"] += unexplained[1]
+            self.children_total["user"] += unexplained[0]
+            self.children_total["system"] += unexplained[1]
+
+        # Forget the ended children of processes that are not tracked.
+        self.explained = {pid: e for pid, e in self.explained.items() if pid in self.processes and not self.processes[pid].done}
+
+    def _get_cgroup_cpu(self):
+        """Find the cpu accounting file of the job cgroup from /proc/<pid>/cgroup"""
+        if self.cgroup_cpu is not None:
+            return True
+        for pid in self.pids:
+            info = self.snapshot.get(pid) if self.snapshot else None
+            try:
+                if info is not None and info.cgroup is not None:
+                    cgroup = info.cgroup
+                else:
+                    with open("%s/%d/cgroup" % (self.procdir, pid)) as file:
+                        cgroup = file.read()
+            except OSError:
+                continue
+            for line in cgroup.splitlines():
+                hierarchy, controllers, path = line.split(":", 2)
+                m = re.match(r"^/(.*/job_[0-9]+)", path)
+                if not m:
+                    continue
+                if hierarchy == "0" and controllers == "":
+                    cpu = os.path.join(self.cgroup_base, m.group(1), "cpu.stat")
+                elif "cpuacct" in controllers.split(","):
+                    cpu = os.path.join(self.cgroup_base, controllers, m.group(1), "cpuacct.stat")
+                else:
+                    continue
+                if os.path.exists(cpu):
+                    logger.debug("Found cgroup cpu accounting: %s for jobid: %d", cpu, self.jobid)
+                    self.cgroup_cpu = cpu
+                    return True
+        return False
+
+    def _cgroup_total(self):
+        """Total user/system cpu usage (in seconds) of the job cgroup or None"""
+        if not self._get_cgroup_cpu():
+            return None
+        try:
+            with open(self.cgroup_cpu) as file:
+                values = dict(line.split() for line in file if line.strip())
+            if self.cgroup_cpu.endswith("cpu.stat"):
+                return {
+                    "user": int(values["user_usec"]) / 1000000.0,
+                    "system": int(values["system_usec"]) / 1000000.0,
+                }
+            return {
+                "user": int(values["user"]) / CLOCK_TICKS,
+                "system": int(values["system"]) / CLOCK_TICKS,
+            }
+        except (OSError, KeyError, ValueError):
+            logger.debug("Failed to read %s, most likely due to job ending", self.cgroup_cpu)
+            self.cgroup_cpu = None
+            return None
 
-        # Send information about current usage
-        aggr, total = self._aggregate()
+    def sample(self):
+        logger.debug("sample()")
+
+        now = time.time()
+        total = None
+        source = "processes"
+        if self.current_source == "cgroup":
+            total = self._cgroup_total()
+            if total is not None:
+                source = "cgroup"
+
+        # The per exe usage is read on its own (longer) interval, or
+        # every sample if the totals has to be computed from it.
+        if total is None or (
+            not self.skip_per_exe
+            and (self.last_per_exe_time is None or now - self.last_per_exe_time > self.per_exe_interval - self.interval / 2)
+        ):
+            self._update_processes()
+            self.aggr, process_total = self._aggregate()
+            self.last_per_exe_time = now
+            if total is None:
+                total = process_total
+        elif self.skip_per_exe:
+            self.per_exe_skipped += 1
+            self.instrumentation.set("per_exe_skipped", self.per_exe_skipped)
+
+        # The same time is used for the rates and the averages.
+        sample_time = time.time()
 
-        if self.last_sample_time is None:
+        # Totals from different sources can not be compared.
+        if self.last_sample_time is None or source != self.last_total_source:
             self.last_total = total
-            self.last_sample_time = time.time()
+            self.last_total_source = source
+            self.last_sample_time = sample_time
             return
 
-        time_diff = time.time() - self.last_sample_time
-        if time_diff > self.sampler_interval / 2:
+        # Send information about current usage
+        time_diff = sample_time - self.last_sample_time
+        if time_diff > self.interval / 2:
             entry = {
                 "current": {
-                    "software": self.map_software(aggr),
+                    "software": self.map_software(self.aggr),
                     "total_user": total["user"],
                     "total_system": total["system"],
                     "user": (total["user"] - self.last_total["user"]) / time_diff,
                     "system": (total["system"] - self.last_total["system"]) / time_diff,
                 }
             }
-            self.compute_sample_averages(entry["current"])
+            self.compute_sample_averages(entry["current"], sample_time)
+            self.adapt({"cpu": entry["current"]["user"] + entry["current"]["system"]})
             self._most_recent_sample = [self._storage_wrapping(entry)]
             self.store(entry)
             self.last_total = total
-            self.last_sample_time = time.time()
+            self.last_sample_time = sample_time
 
-    def compute_sample_averages(self, data):
+    def compute_sample_averages(self, data, sample_time):
         """Computes averages of selected measurements by
-        means of trapezoidal quadrature, approximating
-        that the time this function is called is the actual
-        time of sampling. This is not completely correct but simplifies
-        the implementation.
+        means of trapezoidal quadrature. sample_time is the
+        time the totals were read and must be the same time
+        that is used for the rates, the interval between
+        samples may vary.
         """
-        sample_time = time.time()
         elapsed_time = sample_time - self.last_sample_time
         total_elapsed_time = sample_time - self.create_time
         for key, item in data.items():
@@ -249,16 +627,20 @@ class Sampler(sams.base.Sampler):
         data["elapsed_time"] = total_elapsed_time
 
     def last_updated(self):
-        procs = list(filter(lambda p: not p.ignore, self.processes.values()))
-        if not procs:
+        updated = [p.updated for p in self.processes.values() if not p.ignore and p.updated is not None]
+        if self.retired_updated is not None:
+            updated.append(self.retired_updated)
+        if not updated:
             return self.create_time
-        return int(max(p.updated for p in procs))
+        return int(max(updated))
 
     def start_time(self):
-        procs = list(filter(lambda p: not p.ignore, self.processes.values()))
-        if not procs:
+        starttimes = [p.starttime for p in self.processes.values() if not p.ignore]
+        if self.retired_start_time is not None:
+            starttimes.append(self.retired_start_time)
+        if not starttimes:
             return 0
-        return int(min(p.starttime for p in procs))
+        return int(min(starttimes))
 
     def _aggregate(self):
         aggr = {}
@@ -277,13 +659,85 @@ class Sampler(sams.base.Sampler):
             aggr[exe]["system"] += a["system"]
             total["user"] += a["user"]
             total["system"] += a["system"]
+        for exe, (user, system, _) in self.retired.entries.items():
+            if exe not in aggr:
+                aggr[exe] = {"user": 0.0, "system": 0.0}
+            aggr[exe]["user"] += user
+            aggr[exe]["system"] += system
+            total["user"] += user
+            total["system"] += system
+        for exe, a in self.children.items():
+            if exe not in aggr:
+                aggr[exe] = {"user": 0.0, "system": 0.0}
+            aggr[exe]["user"] += a["user"]
+            aggr[exe]["system"] += a["system"]
+            total["user"] += a["user"]
+            total["system"] += a["system"]
+        if self.max_execs:
+            aggr = self._cap_execs(aggr)
         return aggr, total
 
+    def _cap_execs(self, aggr):
+        """Keep the max_execs execs with the most cpu usage, the rest (and
+        what has been evicted from retired) is added to OTHER_EXECS"""
+        other = {"user": self.retired.other[0], "system": self.retired.other[1]}
+        if OTHER_EXECS in aggr:
+            other["user"] += aggr[OTHER_EXECS]["user"]
+            other["system"] += aggr[OTHER_EXECS]["system"]
+            del aggr[OTHER_EXECS]
+        if len(aggr) > self.max_execs:
+            execs = sorted(aggr, key=lambda exe: aggr[exe]["user"] + aggr[exe]["system"], reverse=True)
+            for exe in execs[self.max_execs :]:
+                other["user"] += aggr[exe]["user"]
+                other["system"] += aggr[exe]["system"]
+            aggr = {exe: aggr[exe] for exe in execs[: self.max_execs]}
+        if other["user"] or other["system"]:
+            aggr[OTHER_EXECS] = other
+        return aggr
+
+    def normalize(self, exe):
+        """exe rewritten by the exe_normalize rules"""
+        for pattern, replace in self.exe_normalize:
+            exe = pattern.sub(replace, exe)
+        return sys.intern(exe)
+
+    def throttle(self, level):
+        """With the job totals read from the cgroup the per exe usage is
+        skipped instead of stretching the interval, the live totals keep
+        their resolution and the per exe usage is read again at the end."""
+        if self.current_source != "cgroup":
+            super(Sampler, self).throttle(level)
+            return
+        self.skip_per_exe = level > 0
+
+    def checkpoint_data(self):
+        """The per exe usage as of the last time it was read"""
+        aggr, _ = self._aggregate()
+        data = {
+            "execs": aggr,
+            "start_time": self.start_time(),
+            "end_time": self.last_updated(),
+        }
+        if self.max_execs:
+            data["execs_error"] = self.retired.error()
+        if self.child_attribution != "none":
+            data["children"] = dict(self.children_total)
+        return data
+
     def final_data(self):
         logger.debug("%s final_data", self.id)
+        if self.per_exe_interval > self.sampler_interval or self.per_exe_skipped:
+            # The per exe usage can be up to per_exe_interval old.
+            self._update_processes()
+        self.reader.close_all()
         aggr, _ = self._aggregate()
-        return {
+        data = {
             "execs": aggr,
             "start_time": self.start_time(),
             "end_time": self.last_updated(),
         }
+        if self.max_execs:
+            data["execs_error"] = self.retired.error()
+        if self.child_attribution != "none":
+            data["children"] = self.children_total
+        return data
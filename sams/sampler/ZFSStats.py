@@ -27,73 +27,210 @@ sams.sampler.ZFSStats:
     # Volumes to check (can use "%(jobid)s")
     volumes: ['local/tmp.%(jobid)s']
 
-    # ZFS command
+    # Where the statistics are read from.
+    # zfs: one "zfs list" of all volumes every sample.
+    # kstat: statvfs of the mount point of each volume (from /proc/mounts)
+    #        and the io counters from /proc/spl/kstat/zfs/<pool>/objset-*,
+    #        nothing is forked. The volumes must be mounted. Reports
+    #        referenced (size - free of the file system) instead of used.
+    backend: zfs
+
+    # ZFS command (only used by backend: zfs)
     zfs_command: /sbin/zfs
 
+    # Metrics to compute the time weighted average of, default: used
+    # (referenced with backend: kstat)
+    metrics_to_average: ['used']
+
 Output:
 {
     'local/tmp.12345': {
         free: 0,
+        size: 0,
+        # only with backend: zfs
         used: 0,
-        size: 0
+        # only with backend: kstat
+        referenced: 0,
+        reads: 0,
+        writes: 0,
+        nread: 0,
+        nwritten: 0
     }
 }
 """
 
+import glob
 import logging
+import os
+import re
 import subprocess
 import time
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
 
 class ZFSStats:
-    def __init__(self, volumes, zfs_command="/sbin/zfs"):
+    """Reads used and avail of all volumes with a single zfs list"""
+
+    def __init__(self, volumes, zfs_command="/sbin/zfs", timeout=None):
         self.volumes = volumes
         self.zfs_command = zfs_command
+        self.timeout = timeout
 
-    def zfs_data(self, volume):
-        process = subprocess.Popen(
-            [self.zfs_command, "list", "-Hp", "-o", "used,avail", volume],
+    def zfs_data(self):
+        """Returns {volume: (used, avail)} of the volumes that zfs list knows about"""
+        process = subprocess.run(
+            [self.zfs_command, "list", "-Hp", "-o", "name,used,avail"] + self.volumes,
             stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=self.timeout,
+            check=False,
         )
-        used, avail = process.stdout.readline().strip().split()
-        return int(used), int(avail)
+        if process.returncode:
+            # Missing volumes are reported on stderr, the other volumes are still listed.
+            logger.debug("%s list failed: %s", self.zfs_command, process.stderr.decode(errors="replace").strip())
+        data = {}
+        for line in process.stdout.decode().splitlines():
+            fields = line.split("\t")
+            if len(fields) == 3:
+                data[fields[0]] = (int(fields[1]), int(fields[2]))
+        return data
+
+    def sample(self):
+        ret = {}
+        try:
+            data = self.zfs_data()
+        except Exception as e:
+            logger.error(e)
+            return ret
+        for v in self.volumes:
+            if v not in data:
+                logger.error("No zfs data for volume: %s", v)
+                continue
+            (used, avail) = data[v]
+            ret[v] = dict(size=avail + used, free=avail, used=used)
+        return ret
+
+
+class KStatZFSStats:
+    """Reads the volumes from statvfs of their mount points and the
+    io counters from the objset kstats, without forking"""
+
+    COUNTERS = ["reads", "writes", "nread", "nwritten"]
+
+    def __init__(self, volumes, procdir="/proc"):
+        self.volumes = volumes
+        self.procdir = procdir
+        # volume -> mount point and objset kstat file
+        self.mounts = {}
+        self.objsets = {}
+        # Mounted volumes that have been looked for in the objset kstats,
+        # they are not looked for again until they are mounted again.
+        self.scanned = set()
+
+    def _find_mounts(self):
+        with open(os.path.join(self.procdir, "mounts")) as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) >= 3 and fields[2] == "zfs" and fields[0] in self.volumes:
+                    # Spaces etc are escaped as octal in /proc/mounts.
+                    mount = re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), fields[1])
+                    if self.mounts.get(fields[0]) != mount:
+                        self.scanned.discard(fields[0])
+                    self.mounts[fields[0]] = mount
+
+    def _find_objsets(self, volumes):
+        self.scanned.update(volumes)
+        pools = set(v.split("/", 1)[0] for v in volumes)
+        for pool in pools:
+            for path in glob.glob(os.path.join(self.procdir, "spl/kstat/zfs", pool, "objset-*")):
+                try:
+                    values = self._read_kstat(path)
+                except OSError:
+                    continue
+                if values.get("dataset_name") in volumes:
+                    self.objsets[values["dataset_name"]] = path
+
+    @staticmethod
+    def _read_kstat(path):
+        """name -> value of a kstat file, the first two lines are headers"""
+        with open(path) as file:
+            lines = file.read().splitlines()[2:]
+        return {fields[0]: fields[2] for fields in (line.split(None, 2) for line in lines) if len(fields) == 3}
 
     def sample(self):
+        if len(self.mounts) < len(self.volumes):
+            try:
+                self._find_mounts()
+            except OSError as e:
+                logger.error(e)
+        volumes = [v for v in self.mounts if v not in self.objsets and v not in self.scanned]
+        if volumes:
+            self._find_objsets(volumes)
         ret = {}
         for v in self.volumes:
+            if v not in self.mounts:
+                logger.error("Volume: %s is not mounted", v)
+                continue
             try:
-                (used, avail) = self.zfs_data(v)
-                ret[v] = dict(size=avail + used, free=avail, used=used)
-            except Exception as e:
+                st = os.statvfs(self.mounts[v])
+            except OSError as e:
                 logger.error(e)
+                del self.mounts[v]
+                self.scanned.discard(v)
+                continue
+            size = st.f_blocks * st.f_frsize
+            avail = st.f_bavail * st.f_frsize
+            # Only what the file system references, zfs list used also
+            # includes snapshots and children which statvfs does not see.
+            ret[v] = dict(size=size, free=avail, referenced=size - avail)
+            if v in self.objsets:
+                try:
+                    values = self._read_kstat(self.objsets[v])
+                    ret[v].update({key: int(values[key]) for key in self.COUNTERS if key in values})
+                except (OSError, ValueError) as e:
+                    logger.debug(e)
+                    del self.objsets[v]
+                    self.scanned.discard(v)
         return ret
 
 
 class Sampler(sams.base.Sampler):
+    OPTIONS = sams.base.Sampler.OPTIONS + [
+        Option("volumes", type=list, required=True),
+        Option("backend", "zfs", str, choices=["zfs", "kstat"]),
+        Option("zfs_command", "/sbin/zfs", str),
+        Option("jobid", 0, int, path=["options", "jobid"]),
+        Option("metrics_to_average", None, list),
+    ]
+
     def __init__(self, id, outQueue, config):
         super(Sampler, self).__init__(id, outQueue, config)
         self.processes = {}
-        self.volumes = self.config.get([self.id, "volumes"])
-        self.zfs_command = self.config.get([self.id, "zfs_command"], "/sbin/zfs")
-        self.jobid = self.config.get(["options", "jobid"], 0)
+        self.volumes = self.options.volumes
+        self.backend = self.options.backend
+        # zfs list can take long on a busy pool.
+        self.blocking = self.backend == "zfs"
+        self.zfs_command = self.options.zfs_command
+        self.jobid = self.options.jobid
         self.create_time = time.time()
         self.last_sample_time = self.create_time
-        self.metrics_to_average = self.config.get([self.id, "metrics_to_average"], ["used"])
-
-        if not self.volumes:
-            raise sams.base.SamplerException("volumes not configured")
+        self.metrics_to_average = self.options.metrics_to_average
+        if self.metrics_to_average is None:
+            self.metrics_to_average = ["referenced"] if self.backend == "kstat" else ["used"]
 
         volumes = [volume % dict(jobid=self.jobid) for volume in self.volumes]
 
         self._average_values = {v: {k: 0 for k in self.metrics_to_average} for v in volumes}
         self._last_averaged_values = {v: {k: 0 for k in self.metrics_to_average} for v in volumes}
         self.zfsstat = None
-        if volumes:
-            self.zfsstat = ZFSStats(volumes=volumes, zfs_command=self.zfs_command)
+        if volumes and self.backend == "kstat":
+            self.zfsstat = KStatZFSStats(volumes=volumes, procdir=self.procdir)
+        elif volumes:
+            self.zfsstat = ZFSStats(volumes=volumes, zfs_command=self.zfs_command, timeout=self.sampler_interval)
 
     def do_sample(self):
         if not self.zfsstat:
@@ -103,19 +240,27 @@ class Sampler(sams.base.Sampler):
     def sample(self):
         logger.debug("sample()")
         if self.zfsstat:
+            # The time the values are read, not when zfs list is done.
+            sample_time = time.time()
             entry = self.zfsstat.sample()
-            self.compute_sample_averages(entry)
+            self.compute_sample_averages(entry, sample_time)
+            self.adapt(
+                {
+                    "%s:%s" % (volume, key): float(value)
+                    for volume, data in entry.items()
+                    for key, value in data.items()
+                    if key in self.metrics_to_average
+                }
+            )
             self._most_recent_sample = [self._storage_wrapping(entry)]
             self.store(entry)
 
-    def compute_sample_averages(self, volume_data):
+    def compute_sample_averages(self, volume_data, sample_time):
         """Computes averages of selected measurements by
-        means of trapezoidal quadrature, approximating
-        that the time this function is called is the actual
-        time of sampling. This is not completely correct but simplifies
-        the implementation.
+        means of trapezoidal quadrature. sample_time is the
+        time the values in volume_data were read, the interval
+        between samples may vary.
         """
-        sample_time = time.time()
         elapsed_time = sample_time - self.last_sample_time
         total_elapsed_time = sample_time - self.create_time
         for v, data in volume_data.items():
@@ -46,6 +46,7 @@ import logging
 import re
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
@@ -53,11 +54,17 @@ logger = logging.getLogger(__name__)
 class Software(sams.base.Software):
     """SAMS Software accounting aggregator"""
 
+    OPTIONS = sams.base.Software.OPTIONS + [
+        Option("rules", [], list),
+        Option("rewrite", [], list),
+        Option("stop_on_rewrite_match", False, bool),
+    ]
+
     def __init__(self, id, config):
         super(Software, self).__init__(id, config)
-        self.rules = self.config.get([self.id, "rules"], [])
-        self.rewrite = self.config.get([self.id, "rewrite"], [])
-        self.stop_on_rewrite_match = self.config.get([self.id, "stop_on_rewrite_match"], False)
+        self.rules = self.options.rules
+        self.rewrite = self.options.rewrite
+        self.stop_on_rewrite_match = self.options.stop_on_rewrite_match
 
     @classmethod
     def _handle_rewrite(cls, software, rw):
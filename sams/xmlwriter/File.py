@@ -40,6 +40,7 @@ from xml.etree import ElementTree
 from xml.etree.ElementTree import Element
 
 import sams.base
+from sams.core import Option
 
 logger = logging.getLogger(__name__)
 
@@ -50,11 +51,17 @@ ISO_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
 class XMLWriter(sams.base.XMLWriter):
     """SAMS Software accounting xml output"""
 
+    OPTIONS = sams.base.XMLWriter.OPTIONS + [
+        Option("remove_less_then", 1.0, (float, int)),
+        Option("jobs_per_file", 1000, int),
+        Option("output_path", "/var/spool/softwareaccounting/records", str),
+    ]
+
     def __init__(self, id, config):
         super(XMLWriter, self).__init__(id, config)
         self.create_time = time.time()
-        self.remove_less_then = self.config.get([self.id, "remove_less_then"], 1.0)
-        self.jobs_per_file = self.config.get([self.id, "jobs_per_file"], 1000)
+        self.remove_less_then = self.options.remove_less_then
+        self.jobs_per_file = self.options.jobs_per_file
 
     @classmethod
     def prettify(cls, elem):
@@ -73,7 +80,7 @@ class XMLWriter(sams.base.XMLWriter):
             return
 
         # Create output
-        output_path = self.config.get([self.id, "output_path"], "/var/spool/softwareaccounting/records")
+        output_path = self.options.output_path
         n = 0
         while data:
             output_file = os.path.join(output_path, "%s.%d.xml") % (
@@ -27,9 +27,12 @@ import platform
 import signal
 import sys
 import threading
+import time
+import tracemalloc
 from optparse import OptionParser
 
 import sams.core
+import sams.procfs
 from sams import __version__
 
 logger = logging.getLogger(__name__)
@@ -37,13 +40,202 @@ logger = logging.getLogger(__name__)
 id = "sams.collector"
 
 
-class Main:
-    def __init__(self):
+class Job:
+    """The samplers, outputs and listeners of one job"""
+
+    def __init__(self, jobid, config, scheduler=None, cpu_budget=None, profile=None):
+        self.jobid = jobid
+        self.config = config
+        # sams.core.StartupProfile that the loading of the plugins is measured in.
+        self.profile = profile if profile is not None else sams.core.StartupProfile(enabled=False)
+        # Samplers are run from the scheduler instead of in their own threads if set.
+        self.scheduler = scheduler
+        # sams.core.CPUBudget of the collector process, if any.
+        self.cpu_budget = cpu_budget
+        self.start_time = time.time()
         self.samplers = []
         self.outputs = []
         self.listeners = []
         self.pidQueue = None
         self.outQueue = None
+        self.pids = set()
+        self.snapshots = self.config.get([id, "snapshot"], False)
+        self.procdir = self.config.get([id, "procdir"], self.config.get(["common", "procdir"], "/proc"))
+        self.snapshot_stats = {"count": 0, "cost": 0.0, "pids": 0, "tasks": 0}
+
+    def start(self):
+        """Load and start all modules, raises if any of them fails"""
+        if self.scheduler is None:
+            self.pidQueue = sams.core.OneToN("pidQueue")
+        self.outQueue = sams.core.OneToN("outQueue")
+
+        try:
+            for o in self.config.get([id, "outputs"], []):
+                logger.info("Load: %s", o)
+                try:
+                    with self.profile.measure("import %s" % o):
+                        Output = sams.core.ClassLoader.load(o, "Output")
+                    with self.profile.measure("init %s" % o):
+                        output = Output(o, self.config)
+                    self.outputs.append(output)
+                    self.outQueue.addQueue(output.dataQueue)
+                    output.start()
+                except Exception:
+                    logger.error("Failed to initialize: %s", o)
+                    raise
+
+            for s in self.config.get([id, "samplers"], []):
+                logger.info("Load: %s", s)
+                try:
+                    with self.profile.measure("import %s" % s):
+                        Sampler = sams.core.ClassLoader.load(s, "Sampler")
+                    with self.profile.measure("init %s" % s):
+                        sampler = Sampler(s, self.outQueue.inQueue, self.config)
+                    self.samplers.append(sampler)
+                    if self.scheduler is not None and not sampler.blocking:
+                        sampler.schedule(self.scheduler)
+                    else:
+                        if self.scheduler is not None:
+                            logger.info("%s can block, it is run in its own thread", s)
+                        if self.pidQueue is None:
+                            self.pidQueue = sams.core.OneToN("pidQueue")
+                        self.pidQueue.addQueue(sampler.pidQueue)
+                        sampler.start()
+                except Exception:
+                    logger.error("Failed to initialize: %s", s)
+                    raise
+
+            for loader_config in self.config.get([id, "listeners"], []):
+                logger.info("Load: %s", loader_config)
+                try:
+                    with self.profile.measure("import %s" % loader_config):
+                        Listener = sams.core.ClassLoader.load(loader_config, "Listener")
+                    with self.profile.measure("init %s" % loader_config):
+                        listener = Listener(loader_config, self.config, self.samplers)
+                    listener.self_stats = self.self_stats
+                    self.listeners.append(listener)
+                    listener.start()
+                except Exception:
+                    logger.error("Failed to initialize listener: %s", loader_config)
+                    raise
+        except Exception:
+            self.cleanup()
+            raise
+
+        if self.cpu_budget is not None and self.cpu_budget.level:
+            self.throttle(self.cpu_budget.level)
+
+    def throttle(self, level):
+        for s in self.samplers:
+            if s.scheduler is not None:
+                self.scheduler.call(s.throttle, level)
+            else:
+                s.throttle(level)
+
+    def put(self, pids):
+        if self.snapshots:
+            self.pids.update(pids)
+            self.snapshot()
+        if not pids:
+            return
+        if self.scheduler is not None:
+            # Delivered as a state change, the samplers sample on their next tick.
+            for s in self.samplers:
+                if s.scheduler is not None:
+                    self.scheduler.call(s.add_pids, pids)
+        if self.pidQueue is not None:
+            self.pidQueue.put(pids)
+
+    def snapshot(self):
+        """Read /proc once for all pids in the job and give it to the samplers.
+
+        Taken when the pidfinder runs, so the samplers only use it for what
+        does not change while a process runs and read counters themselves."""
+        snapshot = sams.procfs.ProcSnapshot.take(self.pids, self.procdir)
+        self.pids.difference_update(snapshot.gone)
+        self.snapshot_stats["count"] += 1
+        self.snapshot_stats["cost"] += snapshot.cost
+        self.snapshot_stats["pids"] = len(snapshot)
+        self.snapshot_stats["tasks"] = snapshot.tasks
+        logger.debug(
+            "Snapshot of job %s: %d pids, %d tasks in %.6f s",
+            self.jobid,
+            len(snapshot),
+            snapshot.tasks,
+            snapshot.cost,
+        )
+        for s in self.samplers:
+            if s.scheduler is not None:
+                self.scheduler.call(s.update_snapshot, snapshot)
+            else:
+                s.update_snapshot(snapshot)
+
+    def self_stats(self):
+        """Instrumentation of the samplers, outputs and queues of the job and
+        the resource usage of the collector process"""
+        queues = {o.id: o.dataQueue.stats() for o in self.outputs}
+        if self.outQueue is not None:
+            queues["outQueue"] = self.outQueue.inQueue.stats()
+        stats = {
+            "samples": {s.id: s.samples for s in self.samplers},
+            "queues": queues,
+            "samplers": {s.id: s.instrumentation.summary() for s in self.samplers},
+            "outputs": {o.id: o.instrumentation.summary() for o in self.outputs},
+            "process": sams.core.Instrumentation.process(),
+        }
+        if self.snapshots:
+            stats["snapshot"] = dict(self.snapshot_stats)
+        if self.cpu_budget is not None:
+            stats["throttle"] = self.cpu_budget.summary(self.start_time)
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            stats["memory"] = {"traced": current, "traced_peak": peak}
+        return stats
+
+    def cleanup(self):
+        # Tell all samplers to exit
+        for s in self.samplers:
+            s.exit()
+
+        # Wait for all samplers to finish
+        for s in filter(lambda t: t.is_alive(), self.samplers):
+            s.join()
+
+        # Report what the collector has cost for this job.
+        stats = self.self_stats()
+        logger.info("Samples of job %s: %s", self.jobid, stats["samples"])
+        logger.info("Output queues of job %s: %s", self.jobid, stats["queues"])
+        if self.outQueue is not None:
+            self.outQueue.put({"id": "sams.collector.self", "data": stats, "type": "final"})
+            self.outQueue.inQueue.join()
+
+        # Tell all output to exit
+        for o in self.outputs:
+            o.exit()
+
+        # Wait for all outputs to finish
+        for o in filter(lambda t: t.is_alive(), self.outputs):
+            o.join()
+
+        for lis in self.listeners:
+            lis.exit()
+            lis.thread.join()
+
+        # exit queues
+        if self.pidQueue is not None:
+            self.pidQueue.exit()
+        self.outQueue.exit()
+
+
+class Main:
+    def __init__(self):
+        self.jobs = {}
+        self.ended = set()
+        self.finishing = []
+        self.job_end_watcher = None
+        self.scheduler = None
+        self.cpu_budget = None
+        self.profile = None
 
         # Options
         parser = OptionParser()
@@ -71,6 +263,13 @@ class Main:
             help="Loglevel",
         )
         parser.add_option("--jobid", type="int", action="store", dest="jobid", help="Slurm JobID")
+        parser.add_option(
+            "--all-jobs",
+            action="store_true",
+            dest="all_jobs",
+            default=False,
+            help="Collect information about all Slurm jobs on the node",
+        )
         parser.add_option(
             "--node",
             type="string",
@@ -94,27 +293,66 @@ class Main:
             dest="testoutput",
             help="path to json-data that is sent to output modules for testing",
         )
+        parser.add_option(
+            "--job-finished",
+            action="store_true",
+            dest="job_finished",
+            default=False,
+            help="Tell the running collector for --jobid that the job has finished",
+        )
+        parser.add_option(
+            "--startup-profile",
+            action="store_true",
+            dest="startup_profile",
+            default=False,
+            help="Report the time spent in each startup phase on stderr",
+        )
+        parser.add_option(
+            "--config-cache",
+            type="string",
+            action="store",
+            dest="config_cache",
+            help="Directory to cache the parsed config file in",
+        )
+        parser.add_option(
+            "--memory-profile",
+            action="store_true",
+            dest="memory_profile",
+            default=False,
+            help="Trace memory allocations and report the largest allocation sites on exit",
+        )
 
         (self.options, self.args) = parser.parse_args()
+        if self.options.memory_profile:
+            tracemalloc.start()
+        self.profile = sams.core.StartupProfile(enabled=self.options.startup_profile)
 
         if self.options.show_version:
             print("SAMS Software Accounting version %s" % __version__)
             sys.exit(0)
 
-        if not self.options.jobid:
+        if self.options.all_jobs and (self.options.jobid or self.options.job_finished or self.options.testoutput):
+            print("Option --all-jobs can not be combined with --jobid, --job-finished or --test-output")
+            parser.print_help()
+            sys.exit(1)
+
+        if not self.options.jobid and not self.options.all_jobs:
             print("Missing option --jobid")
             parser.print_help()
             sys.exit(1)
 
-        self.config = sams.core.Config(
-            self.options.config,
-            {
-                "options": {
-                    "jobid": self.options.jobid,
-                    "node": self.options.node,
-                }
-            },
-        )
+        # Used in file names when collecting all jobs on the node.
+        self.jobid = "all" if self.options.all_jobs else self.options.jobid
+
+        options = {"node": self.options.node}
+        if self.options.jobid:
+            options["jobid"] = self.options.jobid
+        with self.profile.measure("config"):
+            self.config = sams.core.Config(self.options.config, {"options": options}, self.options.config_cache)
+
+        if self.options.job_finished:
+            self.send_job_finished()
+            sys.exit(0)
 
         # Put process into background as daemon.
         # stdout/stderr will be closed.
@@ -140,7 +378,7 @@ class Main:
         if not logfile:
             logfile = self.config.get(["common", "logfile"])
         if logfile:
-            logfile = logfile % {"jobid": self.options.jobid, "node": self.options.node}
+            logfile = logfile % {"jobid": self.jobid, "node": self.options.node}
         logformat = self.config.get([id, "logformat"], "%(asctime)s %(name)s:%(levelname)s %(message)s")
         if logfile:
             logging.basicConfig(filename=logfile, filemode="a", format=logformat, level=loglevel_n)
@@ -158,38 +396,65 @@ class Main:
                 logger.exception(e)
                 sys.exit(1)
 
+        self.runtime = self.config.get([id, "runtime"], "threads")
+        if self.runtime not in ["threads", "scheduler"]:
+            logger.error("runtime must be one of threads or scheduler")
+            sys.exit(1)
+
         self.exit = threading.Event()
+        self.wakeup = threading.Event()
         # Trap signals
         signal.signal(signal.SIGHUP, self.sigHupHandler)
         signal.signal(signal.SIGINT, self.sigHupHandler)
 
     def sigHupHandler(self, signum, frame):
         self.exit.set()
+        self.wakeup.set()
+
+    def jobEndHandler(self, jobid):
+        if self.options.all_jobs:
+            if jobid in self.jobs:
+                logger.info("Job %d has ended", jobid)
+                self.ended.add(jobid)
+                self.wakeup.set()
+        elif jobid == self.options.jobid:
+            logger.info("Job %d has ended", jobid)
+            self.exit.set()
+            self.wakeup.set()
+
+    def control_socket(self):
+        control_socket = self.config.get([id, "control_socket"])
+        if control_socket:
+            return control_socket % {"jobid": self.jobid, "node": self.options.node}
+        return None
+
+    def send_job_finished(self):
+        control_socket = self.control_socket()
+        if not control_socket:
+            print("control_socket is not configured")
+            sys.exit(1)
+        try:
+            sams.core.JobEndWatcher.send_finished(control_socket, self.options.jobid)
+        except OSError as e:
+            print("Failed to send finished message to %s: %s" % (control_socket, e))
+            sys.exit(1)
 
     def cleanup(self):
-        # Tell all samplers to exit
-        for s in self.samplers:
-            s.exit()
+        # Before the jobs are cleaned up, while all their data is still in memory.
+        self.report_memory()
 
-        # Wait for all samplers to finish
-        for s in filter(lambda t: t.is_alive(), self.samplers):
-            s.join()
+        for job in self.jobs.values():
+            job.cleanup()
+        self.jobs = {}
 
-        # Tell all output to exit
-        for o in self.outputs:
-            o.exit()
+        for t in self.finishing:
+            t.join()
 
-        # Wait for all outputs to finish
-        for o in filter(lambda t: t.is_alive(), self.outputs):
-            o.join()
+        if self.scheduler:
+            self.scheduler.exit()
 
-        for lis in self.listeners:
-            lis.exit()
-            lis.thread.join()
-
-        # exit queues
-        self.pidQueue.exit()
-        self.outQueue.exit()
+        if self.job_end_watcher:
+            self.job_end_watcher.exit()
 
     def test_output(self):
         with open(self.options.testoutput) as json_file:
@@ -207,66 +472,179 @@ class Main:
                 logger.exception(e)
                 sys.exit(1)
 
-    def start(self):
-        self.pidQueue = sams.core.OneToN("pidQueue")
-        self.outQueue = sams.core.OneToN("outQueue")
-
-        for o in self.config.get([id, "outputs"], []):
-            logger.info("Load: %s", o)
-            try:
-                Output = sams.core.ClassLoader.load(o, "Output")
-                output = Output(o, self.config)
-                self.outputs.append(output)
-                self.outQueue.addQueue(output.dataQueue)
-                output.start()
-            except Exception as e:
-                logger.error("Failed to initialize: %s", o)
-                logger.exception(e)
-                self.cleanup()
-                sys.exit(1)
+    def load_pid_finder(self, jobid):
+        pid_finder = self.config.get([id, "pid_finder"])
+        try:
+            PidFinder = sams.core.ClassLoader.load(pid_finder, "PIDFinder")
+            return PidFinder(pid_finder, jobid, self.config)
+        except Exception as e:
+            logger.error("Failed to initialize: %s", pid_finder)
+            logger.error(e)
+            self.cleanup()
+            sys.exit(1)
 
-        for s in self.config.get([id, "samplers"], []):
-            logger.info("Load: %s", s)
+    def start_job_end_watcher(self):
+        """Returns True if cgroup.events of the jobs should be watched"""
+        job_end_events = self.config.get([id, "job_end_events"], False)
+        if job_end_events or self.control_socket():
             try:
-                Sampler = sams.core.ClassLoader.load(s, "Sampler")
-                sampler = Sampler(s, self.outQueue.inQueue, self.config)
-                self.samplers.append(sampler)
-                self.pidQueue.addQueue(sampler.pidQueue)
-                sampler.start()
+                self.job_end_watcher = sams.core.JobEndWatcher(self.jobEndHandler, self.control_socket())
+                self.job_end_watcher.start()
             except Exception as e:
-                logger.error("Failed to initialize: %s", s)
+                logger.error("Failed to initialize job end watcher, falling back to polling")
                 logger.exception(e)
-                self.cleanup()
-                sys.exit(1)
+                self.job_end_watcher = None
+                return False
+        return job_end_events
+
+    def watch_job_end(self, pid_finder, jobid):
+        """Watch cgroup.events of jobid, returns True when done (or failed)"""
+        path = pid_finder.cgroup_events(jobid)
+        if not path:
+            return False
+        try:
+            self.job_end_watcher.watch(jobid, path)
+        except OSError as e:
+            logger.error("Failed to watch %s, falling back to polling", path)
+            logger.exception(e)
+        return True
+
+    def start_scheduler(self):
+        if self.runtime == "scheduler":
+            self.scheduler = sams.core.Scheduler()
+
+    def start_cpu_budget(self):
+        cpu_budget_percent = self.config.get([id, "cpu_budget_percent"])
+        if cpu_budget_percent:
+            self.cpu_budget = sams.core.CPUBudget(float(cpu_budget_percent))
+
+    def check_cpu_budget(self):
+        """Throttle the samplers of all jobs if the throttle level has changed"""
+        if self.cpu_budget is None:
+            return
+        level = self.cpu_budget.level
+        if self.cpu_budget.check() != level:
+            for job in self.jobs.values():
+                job.throttle(self.cpu_budget.level)
+
+    def report_startup(self):
+        """Report the startup profile once, when the first pids has been given to the samplers"""
+        if not self.profile.enabled:
+            return
+        self.profile.enabled = False
+        report = self.profile.report()
+        logger.info("Startup profile:\n%s", report)
+        if not self.options.daemon:
+            print(report, file=sys.stderr)
+
+    def report_memory(self, limit=20):
+        """Report the traced memory, rss and the largest allocation sites"""
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        process = sams.core.Instrumentation.process()
+        lines = [
+            "memory: traced: %d, traced peak: %d, rss: %s, max rss: %d" % (current, peak, process["rss"], process["max_rss"]),
+            "memory: %10s | %7s | allocated at" % ("size [B]", "blocks"),
+        ]
+        for stat in snapshot.statistics("lineno")[:limit]:
+            lines.append("memory: %10d | %7d | %s" % (stat.size, stat.count, stat.traceback))
+        report = "\n".join(lines)
+        logger.info("Memory profile:\n%s", report)
+        if not self.options.daemon:
+            print(report, file=sys.stderr)
+
+    def pid_finder_timeout(self):
+        """Time to wait until the next update of the pid finder"""
+        interval = self.config.get([id, "pid_finder_update_interval"], 30)
+        if self.scheduler is not None:
+            # Aligned with the ticks of the samplers.
+            return sams.core.Scheduler.next_deadline(interval) - time.time()
+        return interval
 
-        for loader_config in self.config.get([id, "listeners"], []):
-            logger.info("Load: %s", loader_config)
-            try:
-                Listener = sams.core.ClassLoader.load(loader_config, "Listener")
-                listener = Listener(loader_config, self.config, self.samplers)
-                self.listeners.append(listener)
-                listener.start()
-            except Exception as e:
-                logger.error("Failed to initialize listener: %s", loader_config)
-                logger.exception(e)
-                self.cleanup()
-                sys.exit(1)
+    def start(self):
+        self.start_scheduler()
+        self.start_cpu_budget()
+        if self.options.all_jobs:
+            self.start_all_jobs()
+            return
 
-        # load PIDFinder class
-        PidFinder = sams.core.ClassLoader.load(self.config.get([id, "pid_finder"]), "PIDFinder")
+        job = Job(self.options.jobid, self.config, self.scheduler, self.cpu_budget, self.profile)
         try:
-            pid_finder = PidFinder(self.config.get([id, "pid_finder"]), self.options.jobid, self.config)
+            with self.profile.measure("start job"):
+                job.start()
         except Exception as e:
-            logger.error("Failed to initialize: %s", self.config.get([id, "pid_finder"]))
-            logger.error(e)
+            logger.exception(e)
             self.cleanup()
             sys.exit(1)
+        self.jobs[self.options.jobid] = job
+
+        with self.profile.measure("init %s" % self.config.get([id, "pid_finder"])):
+            pid_finder = self.load_pid_finder(self.options.jobid)
+        job_end_events = self.start_job_end_watcher()
 
         while not self.exit.is_set() and not pid_finder.done():
-            pids = pid_finder.find()
-            if pids:
-                self.pidQueue.put(pids)
-            self.exit.wait(self.config.get([id, "pid_finder_update_interval"], 30))
+            with self.profile.measure("find pids"):
+                job.put(pid_finder.find())
+            self.report_startup()
+            if job_end_events and self.watch_job_end(pid_finder, self.options.jobid):
+                job_end_events = False
+            self.check_cpu_budget()
+            self.exit.wait(self.pid_finder_timeout())
+
+        self.cleanup()
+
+    def start_all_jobs(self):
+        """Collect all jobs on the node using one pid finder"""
+        with self.profile.measure("init %s" % self.config.get([id, "pid_finder"])):
+            pid_finder = self.load_pid_finder(None)
+        job_end_events = self.start_job_end_watcher()
+        watched = set()
+
+        while not self.exit.is_set():
+            new_pids = pid_finder.find_jobs()
+            for jobid, pids in new_pids.items():
+                if jobid not in self.jobs and jobid not in self.ended:
+                    logger.info("Start collecting job %d", jobid)
+                    job = Job(jobid, self.config.derive({"options": {"jobid": jobid}}), self.scheduler, self.cpu_budget, self.profile)
+                    try:
+                        with self.profile.measure("start job %d" % jobid):
+                            job.start()
+                    except Exception as e:
+                        logger.error("Failed to start collecting job %d", jobid)
+                        logger.exception(e)
+                        # Do not try again for this job.
+                        self.ended.add(jobid)
+                        continue
+                    self.jobs[jobid] = job
+
+            for jobid, job in self.jobs.items():
+                job.put(new_pids.get(jobid, []))
+            self.report_startup()
+
+            for jobid in list(self.jobs.keys()):
+                if job_end_events and jobid not in watched and self.watch_job_end(pid_finder, jobid):
+                    watched.add(jobid)
+                if jobid in self.ended or pid_finder.done(jobid):
+                    logger.info("Stop collecting job %d", jobid)
+                    job = self.jobs.pop(jobid)
+                    # Outputs might take a while, do not block the other jobs.
+                    thread = threading.Thread(target=job.cleanup)
+                    thread.start()
+                    self.finishing.append(thread)
+                    watched.discard(jobid)
+
+            # Forget about jobs that are done and no longer have any pids.
+            for jobid in pid_finder.jobs():
+                if jobid not in self.jobs and pid_finder.done(jobid):
+                    pid_finder.forget(jobid)
+                    self.ended.discard(jobid)
+
+            self.finishing = [t for t in self.finishing if t.is_alive()]
+            self.check_cpu_budget()
+            self.wakeup.wait(self.pid_finder_timeout())
+            self.wakeup.clear()
 
         self.cleanup()
 
@@ -20,6 +20,7 @@ You should have received a copy of the GNU General Public License
 along with this program; If not, see <http://www.gnu.org/licenses/>.
 """
 
+import json
 import logging
 import os
 import sys
@@ -56,10 +57,25 @@ class Receiver(MethodView):
                     if not os.path.isdir(base_path):
                         assert False, "Failed to makedirs '%s' " % base_path
 
+        if filename.endswith(".partial") and os.path.exists(os.path.join(base_path, filename[: -len(".partial")])):
+            # A late checkpoint of a job whose final file has already been received.
+            return "OK"
+
+        data = request.data
+        if request.headers.get("X-SAMS-Checkpoint-Delta"):
+            # The final data is posted as what changed since the last checkpoint.
+            try:
+                with open(os.path.join(base_path, filename + ".partial"), "rb") as file:
+                    merged = json.load(file)
+            except (OSError, ValueError):
+                return "No checkpoint to merge with", 409
+            merged.update(json.loads(data))
+            data = json.dumps(merged, sort_keys=True, separators=(",", ":")).encode()
+
         tfilename = ".%s" % filename
         try:
             with open(os.path.join(base_path, tfilename), "wb") as file:
-                file.write(request.data)
+                file.write(data)
             os.rename(os.path.join(base_path, tfilename), os.path.join(base_path, filename))
         except Exception as err:
             logger.debug("Failed to write file")
@@ -69,6 +85,12 @@ class Receiver(MethodView):
                 # Just log unlink errors
                 logger.error("Failed to unlink tmp file")
             raise Exception("Failed to write") from err
+        if not filename.endswith(".partial"):
+            # The checkpoint is replaced by the final file.
+            try:
+                os.unlink(os.path.join(base_path, filename + ".partial"))
+            except FileNotFoundError:
+                pass
         return "OK"
 
 
@@ -0,0 +1,55 @@
+"""
+Tests of the compiled plugin options (sams.core.Option)
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os
+import tempfile
+import unittest
+
+import sams.aggregator.SoftwareAccounting
+import sams.base
+import sams.core
+
+
+class OptionTest(unittest.TestCase):
+    def config(self, content, extra=None):
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.unlink, file.name)
+        return sams.core.Config(file.name, extra)
+
+    def test_falsy_value_wins_over_fallback(self):
+        config = self.config("common:\n  checkpoint_interval: 600\nsams.sampler.Test:\n  checkpoint_interval: 0\n")
+        options = config.compile("sams.sampler.Test", sams.base.Sampler.OPTIONS)
+        self.assertEqual(options.checkpoint_interval, 0)
+
+    def test_fallback_when_unset(self):
+        config = self.config("common:\n  checkpoint_interval: 600\nsams.sampler.Test:\n  checkpoint_interval:\n")
+        self.assertEqual(config.compile("sams.sampler.Test", sams.base.Sampler.OPTIONS).checkpoint_interval, 600)
+        self.assertEqual(config.compile("sams.output.Test", sams.base.Output.OPTIONS).checkpoint_interval, 600)
+
+    def test_output_falsy_value_wins_over_fallback(self):
+        config = self.config("common:\n  checkpoint_interval: 600\nsams.output.Test:\n  checkpoint_interval: 0\n")
+        self.assertEqual(config.compile("sams.output.Test", sams.base.Output.OPTIONS).checkpoint_interval, 0)
+
+    def test_false_is_not_default(self):
+        options = [sams.core.Option("enabled", True, bool)]
+        config = self.config("sams.sampler.Test:\n  enabled: false\n")
+        self.assertIs(config.compile("sams.sampler.Test", options).enabled, False)
+
+    def test_required_empty_list(self):
+        options = [sams.core.Option("volumes", type=list, required=True)]
+        config = self.config("sams.sampler.Test:\n  volumes: []\n")
+        with self.assertRaises(sams.core.ConfigException):
+            config.compile("sams.sampler.Test", options)
+
+    def test_aggregator_invalid_choice(self):
+        config = self.config("sams.aggregator.SoftwareAccounting:\n  db_path: /tmp\n  cluster: test\n  sqlite_temp_store: DISK\n")
+        with self.assertRaises(sams.core.ConfigException):
+            sams.aggregator.SoftwareAccounting.Aggregator("sams.aggregator.SoftwareAccounting", config)
+
+
+if __name__ == "__main__":
+    unittest.main()
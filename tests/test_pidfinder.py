@@ -0,0 +1,43 @@
+"""
+Tests of sams.pidfinder.Slurm
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os
+import tempfile
+import unittest
+
+import sams.core
+import sams.pidfinder.Slurm
+
+STAT = "%d (sleep) S 1 1 1 0 -1 4194304 0 0 0 0 0 0 0 0 20 0 1 0 %d 0 0\n"
+
+
+class ReusedPidTest(unittest.TestCase):
+    def setUp(self):
+        self.procdir = tempfile.mkdtemp()
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as file:
+            file.write("common:\n  procdir: %s\n" % self.procdir)
+        self.addCleanup(os.unlink, file.name)
+        self.config = sams.core.Config(file.name)
+
+    def process(self, pid, starttime, cpuset):
+        os.makedirs(os.path.join(self.procdir, str(pid)), exist_ok=True)
+        with open(os.path.join(self.procdir, str(pid), "stat"), "w") as file:
+            file.write(STAT % (pid, starttime))
+        with open(os.path.join(self.procdir, str(pid), "cpuset"), "w") as file:
+            file.write(cpuset)
+
+    def test_reused_by_job(self):
+        finder = sams.pidfinder.Slurm.PIDFinder("sams.pidfinder.Slurm", None, self.config)
+        self.process(100, 1000, "/system.slice\n")
+        self.assertEqual(finder.find_jobs(), {})
+        # The pid is reused by a job process before the next cycle.
+        self.process(100, 2000, "/slurm/uid_1/job_42/step_0\n")
+        self.assertEqual(finder.find_jobs(), {42: [100]})
+        self.assertEqual(finder.find_jobs(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+"""
+Tests of sams.sampler.Software
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os
+import tempfile
+import unittest
+
+import sams.core
+import sams.sampler.Software
+
+CONFIG = """
+sams.collector:
+  samplers: [%s]
+sams.sampler.Software:
+  child_attribution: parent
+"""
+
+
+class ChildAttributionTest(unittest.TestCase):
+    def sampler(self, samplers):
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as file:
+            file.write(CONFIG % ", ".join(samplers))
+        self.addCleanup(os.unlink, file.name)
+        config = sams.core.Config(file.name, {"options": {"jobid": 1}})
+        return sams.sampler.Software.Sampler("sams.sampler.Software", None, config)
+
+    def test_disabled_with_process_accounting(self):
+        with self.assertLogs("sams.sampler.Software", "ERROR"):
+            sampler = self.sampler(["sams.sampler.Software", "sams.sampler.ProcessAccounting"])
+        self.assertEqual(sampler.child_attribution, "none")
+
+    def test_kept_without_process_accounting(self):
+        sampler = self.sampler(["sams.sampler.Software"])
+        self.assertEqual(sampler.child_attribution, "parent")
+
+
+if __name__ == "__main__":
+    unittest.main()